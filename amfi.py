@@ -0,0 +1,304 @@
+"""AMFI NAV history report fetching and parsing
+
+    * Reports are streamed line by line as they arrive, the body
+      is never held in memory as a whole. Lines are split on "\n" by
+      `split_lines`, so the same body gives the same lines however the
+      network happens to chunk it.
+    * `parse` is a generator and yields one `NavRecord` per scheme row.
+"""
+
+import requests
+import threading
+from array import array
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+
+from instrument import report
+
+BATCH_SIZE = 5000
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+RETRIES = 5
+BACKOFF = 1.0
+PER_HOST = 4
+CHUNK_SIZE = 1 << 16
+
+NavRecord = namedtuple(
+    "NavRecord", ["category", "company", "name", "value", "date", "scheme_code"]
+)
+
+Scheme = namedtuple(
+    "Scheme",
+    [
+        "scheme_code",
+        "category",
+        "company",
+        "name",
+        "isin_growth",
+        "isin_reinvestment",
+    ],
+)
+
+
+"""Shared HTTP fetcher
+
+    * One `requests.Session` keeps up to `per_host` keep-alive
+      connections per host and asks for gzip'd bodies.
+    * Every request has a connect and a read timeout. Connection errors,
+      timeouts and 5xx responses are retried `retries` times with
+      exponential backoff (`backoff`, 2 * `backoff`, ...), honouring
+      `Retry-After`. A body that stalls after lines have been yielded is
+      not retried, the error is raised to the caller.
+    * At most `per_host` requests are in flight to a host at once,
+      further callers wait for a slot.
+"""
+
+
+class Fetcher:
+    def __init__(
+        self,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        retries=RETRIES,
+        backoff=BACKOFF,
+        per_host=PER_HOST,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.per_host = per_host
+        self.slots = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+        self.lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=per_host, pool_maxsize=per_host, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip"
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def slot(self, url):
+        with self.lock:
+            return self.slots[urlsplit(url).netloc]
+
+    @contextmanager
+    def open(self, url):
+        with self.slot(url):
+            response = self.session.get(url, stream=True, timeout=self.timeout)
+            try:
+                response.raise_for_status()
+                yield response
+            finally:
+                response.close()
+
+    def chunks(self, url):
+        """Yield the (decompressed) body of `url` as it arrives, in bytes."""
+        with self.open(url) as response:
+            yield from response.iter_content(CHUNK_SIZE)
+
+    def lines(self, url):
+        with self.open(url) as response:
+            yield from split_lines(
+                response.iter_content(CHUNK_SIZE), response.encoding or "utf-8"
+            )
+
+
+def split_lines(chunks, encoding="utf-8"):
+    """Yield the lines of a body given as byte `chunks`, without line endings.
+
+    Unlike `iter_lines`, a "\r\n" split across two chunks is not taken
+    for two line breaks.
+    """
+    tail = b""
+    for chunk in chunks:
+        parts = (tail + chunk).split(b"\n")
+        tail = parts.pop()
+        for part in parts:
+            yield part.rstrip(b"\r").decode(encoding, "replace")
+    if tail:
+        yield tail.rstrip(b"\r").decode(encoding, "replace")
+
+
+fetcher = Fetcher()
+
+
+def fetch_lines(url):
+    return fetcher.lines(url)
+
+
+def fetch_chunks(url):
+    return fetcher.chunks(url)
+
+
+"""Parse an AMFI NAV history report
+
+    * A single-field line followed by another single-field line is a
+      category header followed by a company header, a lone single-field
+      line is a company header.
+    * Scheme rows have 8 `;` separated fields, anything else is skipped,
+      as are rows whose NAV is not a number (e.g. "N.A.").
+
+    `parse_batches` yields `NavBatch`es of up to `size` rows, `parse`
+    yields the same rows as `NavRecord`s with a datetime `date`.
+"""
+
+
+class NavBatch:
+    """Columnar batch of parsed rows
+
+    * `keys` holds each distinct `Scheme` once, `codes` indexes into it
+      per row. A `Scheme` carries the AMFI scheme code (None if it is
+      not a number) and the ISINs (None for "-" or blank).
+    * `values` holds the NAVs and `dates` the date ordinals, `day` turns
+      an ordinal back into a (shared) datetime.
+    """
+
+    __slots__ = ("keys", "codes", "values", "dates")
+
+    def __init__(self):
+        self.keys = []
+        self.codes = array("i")
+        self.values = array("d")
+        self.dates = array("i")
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        keys = self.keys
+        for code, value, ordinal in zip(self.codes, self.values, self.dates):
+            scheme = keys[code]
+            yield NavRecord(
+                scheme.category,
+                scheme.company,
+                scheme.name,
+                value,
+                day(ordinal),
+                scheme.scheme_code,
+            )
+
+
+days = {}
+
+
+def day(ordinal):
+    date = days.get(ordinal)
+    if date is None:
+        date = days[ordinal] = datetime.fromordinal(ordinal)
+    return date
+
+
+def parse_batches(lines, size=BATCH_SIZE):
+    category, company, pending = None, None, None
+    lines = (line.strip() for line in lines)
+    lines = (line for line in lines if line != "")
+    next(lines, None)  # Column header
+
+    # A report holds only a handful of distinct dates
+    ordinals = {}
+    batch, index = NavBatch(), {}
+    skipped_fields = skipped_nav = 0
+    start = perf_counter()
+
+    for line in lines:
+        parts = line.split(";")
+        if len(parts) == 1:
+            if pending is None:
+                pending = line
+            else:
+                category, company, pending = pending, line, None
+            continue
+
+        if pending is not None:
+            company, pending = pending, None
+
+        if len(parts) != 8:
+            skipped_fields += 1
+            continue
+        (
+            scheme_code,
+            scheme_name,
+            isin_div,
+            isin_reinv,
+            nav,
+            repurchase,
+            sale,
+            date,
+        ) = parts
+        try:
+            value = float(nav)
+        except ValueError:
+            skipped_nav += 1
+            continue
+
+        ordinal = ordinals.get(date)
+        if ordinal is None:
+            ordinal = ordinals[date] = datetime.strptime(
+                date.strip(), "%d-%b-%Y"
+            ).toordinal()
+        key = (scheme_code, category, company, scheme_name)
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(batch.keys)
+            batch.keys.append(
+                Scheme(
+                    int(scheme_code) if scheme_code.strip().isdigit() else None,
+                    category,
+                    company,
+                    scheme_name,
+                    isin(isin_div),
+                    isin(isin_reinv),
+                )
+            )
+        batch.codes.append(code)
+        batch.values.append(value)
+        batch.dates.append(ordinal)
+
+        if len(batch.values) >= size:
+            report.add_time("parse", perf_counter() - start)
+            report.count("rows_parsed", len(batch))
+            yield batch
+            start = perf_counter()
+            batch, index = NavBatch(), {}
+
+    report.add_time("parse", perf_counter() - start)
+    report.count("rows_parsed", len(batch))
+    report.count("rows_skipped_fields", skipped_fields)
+    report.count("rows_skipped_nav", skipped_nav)
+    if len(batch):
+        yield batch
+
+
+def isin(value):
+    value = value.strip()
+    return None if value in ("", "-") else value
+
+
+def parse(lines):
+    for batch in parse_batches(lines):
+        yield from batch
+
+
+def batched(iterable, size=BATCH_SIZE):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
@@ -1,24 +1,130 @@
 from flask import Flask, request, jsonify
-import mysql.connector
 from mysql.connector import Error
 import hashlib
 import os
 from http_err import *
 from flask_cors import CORS
+from werkzeug.http import is_resource_modified
 from time import time
+from datetime import date, timedelta, timezone
+from functools import wraps
+
+import numpy as np
+
+import db
+import run
+from catalog import Catalog
+from data_version import DataVersion
+from history import columns, lttb
+from pool import ConnectionPool
 
 app = Flask(__name__)
 CORS(app)
 
+# One connection per gunicorn thread, credentials are read once here
+pool = ConnectionPool(run.threads, **db.options())
+data_version = DataVersion(pool)
+
 
 def mysql_connect():
-    with open(".passwd.txt", "r") as file:
-        passwd = file.read().strip()
-    return mysql.connector.connect(
-        host="bar0n.live", user="fund", password=passwd, database="fund"
+    """Check out a pooled connection, `close()` returns it to the pool."""
+    return pool.acquire()
+
+
+def catalog():
+    """The fund catalog of the current data version (see catalog.py)."""
+    return data_version.cached(
+        "catalog", lambda conn: Catalog.load(conn, data_version.last("catalog"))
     )
 
 
+def json_response(body):
+    return app.response_class(body, mimetype="application/json")
+
+
+"""Conditional GET
+
+    * `conditional(validator, check)` gives a GET endpoint an ETag and a
+      Last-Modified date from `validator()`, and answers 304 without
+      calling the endpoint when `If-None-Match` or `If-Modified-Since`
+      show the client already has them.
+    * `check()` validates the request's arguments before that, and its
+      error response is sent instead, so a bad request never gets a 304.
+    * `data_version.updated_on` is written in UTC (see `ingest.publish`).
+    * Validators use the data version stamp of the last ingest and the
+      fund catalog, both cached in the worker, so a 304 makes no query.
+    * Cache-Control lets browsers and CDNs reuse a response for
+      `CACHE_MAX_AGE` seconds and revalidate it afterwards.
+"""
+
+CACHE_MAX_AGE = 60
+
+
+def version_validator():
+    version, updated_on = data_version.get()
+    # Written with UTC_TIMESTAMP(), whatever the server's time zone
+    return f"v{version}", updated_on.replace(tzinfo=timezone.utc)
+
+
+def fund_history_validator():
+    """Per fund, the history only changes when the fund gets new NAVs.
+
+    A stale `fund_state` no longer follows new NAVs, such funds fall back
+    to the data version.
+    """
+    fund_id = request.args.get("f_id", "")
+    fund = catalog().by_id.get(int(fund_id)) if fund_id.isdigit() else None
+    tag, modified = version_validator()
+    if fund is None or fund.nav_count is None or fund.stale:
+        return tag, modified
+    return f"f{fund.fund_id}-{fund.nav_count}-{fund.latest_date:%Y%m%d}", modified
+
+
+def required(name, message):
+    """Return a check answering 400 with `message` without the `name` argument."""
+
+    def check():
+        if not request.args.get(name):
+            return jsonify({"error": message}), ERR_INVALID
+
+    return check
+
+
+def conditional(validator, check=None):
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if check is not None:
+                error = check()
+                if error is not None:
+                    return error
+            try:
+                tag, modified = validator()
+            except Error as e:
+                print(e)
+                return view(*args, **kwargs)
+            if is_resource_modified(request.environ, tag, last_modified=modified):
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != ERR_SUCCESS:
+                    return response
+            else:
+                response = app.response_class(status=304)
+            response.set_etag(tag, weak=True)
+            response.last_modified = modified
+            response.cache_control.public = True
+            response.cache_control.max_age = CACHE_MAX_AGE
+            return response
+
+        return wrapper
+
+    return decorate
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({"pool": pool.stats()}), ERR_SUCCESS
+
+
 # Register a user
 @app.route("/register", methods=["POST"])
 def add_user():
@@ -64,11 +170,10 @@ def add_user():
 """
 
 
-def genAuthToken(user_id):
+def genAuthToken(conn, user_id):
     auth = hashlib.sha256(
         (str(time()) + str(user_id) + "bar0n&vb").encode()
     ).hexdigest()
-    conn = mysql_connect()
     cur = conn.cursor()
 
     try:
@@ -87,7 +192,6 @@ def genAuthToken(user_id):
         return None
     finally:
         cur.close()
-        conn.close()
         return auth
 
 
@@ -101,74 +205,81 @@ def verify_user():
     user_name = data["username"]
     password = data["password"]
 
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute(
-            "SELECT password_hash, salt, user_id FROM user WHERE user_name = %s",
-            (user_name,),
-        )
-        rec = cur.fetchone()
-    except Error as e:
-        print(e)
-        return jsonify({"error": "Database query error"}), ERR_INTERNAL_ALL
-    finally:
-        cur.close()
-        conn.close()
-
-    if rec:
-        salt = rec["salt"]
-        expected_hash = rec["password_hash"]
-        uid = rec["user_id"]
-        password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-        if password_hash == expected_hash:
-            auth = genAuthToken(user_id=uid)
-            if not auth:
-                return jsonify({"error": "Invalid credentials"}), ERR_UNAUTHORIZED
-            else:
-                return jsonify(
-                    {"message": "Login successful", "user_id": uid, "auth_token": auth}
-                ), ERR_SUCCESS
+    # The token is saved on the same connection
+    with mysql_connect() as conn:
+        cur = conn.cursor(dictionary=True)
+        try:
+            cur.execute(
+                "SELECT password_hash, salt, user_id FROM user WHERE user_name = %s",
+                (user_name,),
+            )
+            rec = cur.fetchone()
+        except Error as e:
+            print(e)
+            return jsonify({"error": "Database query error"}), ERR_INTERNAL_ALL
+        finally:
+            cur.close()
+
+        if rec:
+            salt = rec["salt"]
+            expected_hash = rec["password_hash"]
+            uid = rec["user_id"]
+            password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
+            if password_hash == expected_hash:
+                auth = genAuthToken(conn, user_id=uid)
+                if not auth:
+                    return jsonify({"error": "Invalid credentials"}), ERR_UNAUTHORIZED
+                else:
+                    return jsonify(
+                        {
+                            "message": "Login successful",
+                            "user_id": uid,
+                            "auth_token": auth,
+                        }
+                    ), ERR_SUCCESS
     return jsonify({"error": "Invalid credentials"}), ERR_UNAUTHORIZED
 
 
 # Home page
-@app.route("/home", methods=["GET"])
-def load_home():
+def check_user_id():
     user_id = request.args.get("u_id")
     if not user_id or not user_id.isdigit():
         return jsonify({"error": "Valid User ID required"}), ERR_INVALID
 
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
-
-    def Query(cur, val, lim=5):
-        query = (
-            "SELECT fund_company.company_name AS cname, fund_name.fund_name AS fname, fund.fund_id AS fid,"
-            "ROUND(fund.{val}, 2) AS price FROM fund_name "
-            "JOIN fund_company ON fund_name.company_id = fund_company.company_id "
-            "JOIN fund ON fund_name.fund_id = fund.fund_id "
-            f"ORDER BY fund.{val} DESC LIMIT {lim};"
-        ).format(val=val)
-        cur.execute(query)
-        rec = cur.fetchmany(size=lim)
-        return [[r["fid"], r["cname"], r["fname"], r["price"]] for r in rec]
 
+@app.route("/home", methods=["GET"])
+@conditional(version_validator, check_user_id)
+def load_home():
     try:
-        res["one_year"] = Query(cur, "one_year")
-        res["six_month"] = Query(cur, "six_month")
-        res["three_month"] = Query(cur, "three_month")
-        res["one_month"] = Query(cur, "one_month")
+        res = data_version.cached("home", home_leaderboards)
     except Error as e:
         print(f"Database error: {e}")
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
+    return jsonify(res), ERR_SUCCESS
+
+
+"""Home page leaderboards
+
+    * The top funds by one year, six month, three month and one month
+      returns, materialised in `leaderboard` by the ingesters (see
+      `ingest.publish`).
+    * Read once per data version and worker.
+"""
+
+
+def home_leaderboards(conn):
+    res = {"one_year": [], "six_month": [], "three_month": [], "one_month": []}
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT period, fund_id, company_name, fund_name, value "
+            "FROM leaderboard ORDER BY period, position;"
+        )
+        for period, fid, cname, fname, price in cur.fetchall():
+            res.setdefault(period, []).append([fid, cname, fname, price])
     finally:
         cur.close()
-        conn.close()
-        return jsonify(res), ERR_SUCCESS
+    return res
 
 
 """Fund information
@@ -184,11 +295,9 @@ def load_home():
 
 
 @app.route("/fund", methods=["GET"])
+@conditional(version_validator, required("f_id", "Fund ID required"))
 def load_fund():
     fund_id = request.args.get("f_id")
-    if not fund_id:
-        return jsonify({"error": "Fund ID required"}), ERR_INVALID
-
     res = {}
     conn = mysql_connect()
     cur = conn.cursor(dictionary=True)
@@ -253,45 +362,100 @@ def load_fund():
 
     * Returns the fund value for the lifetime of the fund,
       for the fund corresponding to the given `fund_id`.
+    * `from` and `to` (YYYY-MM-DD, inclusive) limit the date range.
+    * `points` downsamples the history to at most that many points,
+      keeping its shape (see history.py).
+    * `format=columns` returns `start`, the first date, and parallel
+      `days` (offsets from `start`) and `prices` lists in ascending
+      order, downsampled to 500 points unless `points` is given.
+      Otherwise `history` holds `[date, price]` pairs, latest first.
 
     e.g. localhost:5000/fund/graph_data?f_id=1
+         localhost:5000/fund/graph_data?f_id=1&from=2020-01-01&points=300&format=columns
 
     Returns a JSON object.
 """
 
+GRAPH_POINTS = 500
+MAX_GRAPH_POINTS = 5000
 
-@app.route("/fund/graph_data", methods=["GET"])
-def load_fund_graph_data():
+
+def graph_args():
+    """Return `((f_id, compact, from, to, points), error response or None)`."""
     fund_id = request.args.get("f_id")
     if not fund_id:
-        return jsonify({"error": "Fund ID required"}), ERR_INVALID
-
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
+        return None, (jsonify({"error": "Fund ID required"}), ERR_INVALID)
 
+    compact = request.args.get("format") == "columns"
     try:
-        cur.execute(
-            "SELECT UNIQUE date, price FROM fund_value WHERE fund_id = %s "
-            "ORDER BY date DESC;",
-            (fund_id,),
+        start = request.args.get("from")
+        start = date.fromisoformat(start) if start else None
+        end = request.args.get("to")
+        end = date.fromisoformat(end) if end else None
+        points = request.args.get("points")
+        points = int(points) if points else (GRAPH_POINTS if compact else None)
+    except ValueError:
+        return None, (jsonify({"error": "Invalid from, to or points"}), ERR_INVALID)
+    if points is not None and not 2 <= points <= MAX_GRAPH_POINTS:
+        return None, (
+            jsonify({"error": f"points must be between 2 and {MAX_GRAPH_POINTS}"}),
+            ERR_INVALID,
         )
+    return (fund_id, compact, start, end, points), None
+
+
+@app.route("/fund/graph_data", methods=["GET"])
+@conditional(fund_history_validator, lambda: graph_args()[1])
+def load_fund_graph_data():
+    (fund_id, compact, start, end, points), _ = graph_args()
+
+    # Archived years included, see partitions.py. NULL prices are skipped
+    # like in metrics.py, they cannot be plotted.
+    where = "WHERE fund_id = %s AND price IS NOT NULL"
+    params = [fund_id]
+    if start:
+        where += " AND date >= %s"
+        params.append(start)
+    if end:
+        where += " AND date < %s"
+        params.append(end + timedelta(days=1))
+    query = db.history_query("date, price", where)
+
+    conn = mysql_connect()
+    cur = conn.cursor()
+    try:
+        cur.execute(query + " ORDER BY date;", params * 2)
         rec = cur.fetchall()
-        res["history"] = [[r["date"].strftime("%Y-%m-%d"), r["price"]] for r in rec]
     except Error as e:
         print(e)
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
     finally:
         cur.close()
         conn.close()
-        return jsonify(res), ERR_SUCCESS
+
+    days = np.fromiter((r[0].toordinal() for r in rec), np.int64, len(rec))
+    prices = np.fromiter((r[1] for r in rec), np.float64, len(rec))
+    if points is not None:
+        keep = lttb(days.astype(np.float64), prices, points)
+        days, prices = days[keep], prices[keep]
+
+    if compact:
+        return jsonify(columns(days, prices)), ERR_SUCCESS
+    res = {
+        "history": [
+            [date.fromordinal(int(day)).strftime("%Y-%m-%d"), float(price)]
+            for day, price in zip(days[::-1], prices[::-1])
+        ]
+    }
+    return jsonify(res), ERR_SUCCESS
 
 
 """Search by fund name
 
-    * Search results contain partial matches.
+    * Matches fund, company and category names, words in any order,
+      word prefixes and misspelt words (see search.py).
+    * Returns the 15 best matches, better ranked funds first among
+      equally good matches.
 
     e.g. localhost:5000/search/fund?q=example%20fund
 
@@ -305,32 +469,13 @@ def load_search_fund():
     if not search:
         return jsonify({"error": "Empty search query"}), ERR_INVALID
 
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
-
-    search_fmt = f"%{'%'.join(search.split())}%"  # "example fund" -> "%Example%Fund%"
-
     try:
-        cur.execute(
-            "SELECT DISTINCT fund_name.fund_id, fund_name.fund_name, fund.one_year "
-            "FROM fund_name "
-            "JOIN fund ON fund_name.fund_id = fund.fund_id "
-            "WHERE fund_name.fund_name LIKE %s "
-            "ORDER BY fund.fund_rank limit 15;",
-            (search_fmt,),
-        )
-        rec = cur.fetchall()
-        res["results"] = [[r["fund_id"], r["fund_name"], r["one_year"]] for r in rec]
+        funds = catalog().search.search(search)
     except Error as e:
         print(e)
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
-    finally:
-        cur.close()
-        conn.close()
-        return jsonify(res), ERR_SUCCESS
+    res = {"results": [[fund.fund_id, fund.name, fund.one_year] for fund in funds]}
+    return jsonify(res), ERR_SUCCESS
 
 
 """Get all funds
@@ -342,25 +487,14 @@ def load_search_fund():
 
 
 @app.route("/all/fund", methods=["GET"])
+@conditional(version_validator)
 def load_all_fund():
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
     try:
-        cur.execute(
-            "SELECT DISTINCT fund_id AS f_id, fund_name as f_name FROM fund_name;"
-        )
-        rec = cur.fetchall()
-        res["results"] = [[r["f_id"], r["f_name"]] for r in rec]
+        body = catalog().bodies["all_fund"]
     except Error as e:
         print(e)
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
-    finally:
-        cur.close()
-        conn.close()
-        return jsonify(res), ERR_SUCCESS
+    return json_response(body), ERR_SUCCESS
 
 
 """Get all fund companies
@@ -372,26 +506,14 @@ def load_all_fund():
 
 
 @app.route("/all/company", methods=["GET"])
+@conditional(version_validator)
 def load_all_company():
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
-
     try:
-        cur.execute(
-            "SELECT DISTINCT company_id AS c_id, company_name as c_name FROM fund_company;"
-        )
-        rec = cur.fetchall()
-        res["results"] = [[r["c_id"], r["c_name"]] for r in rec]
+        body = catalog().bodies["all_company"]
     except Error as e:
         print(e)
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
-    finally:
-        cur.close()
-        conn.close()
-        return jsonify(res), ERR_SUCCESS
+    return json_response(body), ERR_SUCCESS
 
 
 """Get all fund categories
@@ -403,26 +525,14 @@ def load_all_company():
 
 
 @app.route("/all/category", methods=["GET"])
+@conditional(version_validator)
 def load_all_category():
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
-
     try:
-        cur.execute(
-            "SELECT DISTINCT category_id AS c_id, category_name as c_name FROM fund_category;"
-        )
-        rec = cur.fetchall()
-        res["results"] = [[r["c_id"], r["c_name"]] for r in rec]
+        body = catalog().bodies["all_category"]
     except Error as e:
         print(e)
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
-    finally:
-        cur.close()
-        conn.close()
-        return jsonify(res), ERR_SUCCESS
+    return json_response(body), ERR_SUCCESS
 
 
 """Search funds by fund company
@@ -439,46 +549,15 @@ def load_all_category():
 
 
 @app.route("/search/company", methods=["GET"])
+@conditional(version_validator, required("c_id", "Empty search query"))
 def load_search_company():
     c_id = request.args.get("c_id")
-    if not c_id:
-        return jsonify({"error": "Empty search query"}), ERR_INVALID
-
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
-
     try:
-        cur.execute(
-            "SELECT UNIQUE company_name from fund_company WHERE company_id = %s;",
-            (c_id,),
-        )
-        rec = cur.fetchone()
-        if not rec:
-            return jsonify({}), ERR_SUCCESS
-
-        res["company_name"] = rec["company_name"]
-
-        cur.execute(
-            "SELECT DISTINCT fund_name.fund_id AS fid, fund_name.fund_name AS fname, ROUND(fund.one_year, 2) as one_year "
-            "FROM fund_name "
-            "JOIN fund_company ON fund_name.company_id = fund_company.company_id "
-            "JOIN fund ON fund_name.fund_id = fund.fund_id "
-            "WHERE fund_company.company_id = %s "
-            "ORDER BY fund.fund_rank;",
-            (c_id,),
-        )
-        rec = cur.fetchall()
-        res["results"] = [[r["fid"], r["fname"], r["one_year"]] for r in rec]
+        res = catalog().company(int(c_id)) if c_id.isdigit() else {}
     except Error as e:
         print(e)
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
-    finally:
-        cur.close()
-        conn.close()
-        return jsonify(res), ERR_SUCCESS
+    return jsonify(res), ERR_SUCCESS
 
 
 """Search funds by fund category
@@ -495,46 +574,15 @@ def load_search_company():
 
 
 @app.route("/search/category", methods=["GET"])
+@conditional(version_validator, required("c_id", "Empty search query"))
 def load_search_category():
     c_id = request.args.get("c_id")
-    if not c_id:
-        return jsonify({"error": "Empty search query"}), ERR_INVALID
-
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
-
     try:
-        cur.execute(
-            "SELECT UNIQUE category_name from fund_category WHERE category_id = %s;",
-            (c_id,),
-        )
-        rec = cur.fetchone()
-        if not rec:
-            return jsonify({}), ERR_SUCCESS
-
-        res["category_name"] = rec["category_name"]
-
-        cur.execute(
-            "SELECT DISTINCT fund_name.fund_id AS fid, fund_name.fund_name AS fname, ROUND(fund.one_year, 2) as one_year "
-            "FROM fund_name "
-            "JOIN fund_category ON fund_name.category_id = fund_category.category_id "
-            "JOIN fund ON fund_name.fund_id = fund.fund_id "
-            "WHERE fund_category.category_id = %s "
-            "ORDER BY fund.fund_category_rank;",
-            (c_id,),
-        )
-        rec = cur.fetchall()
-        res["results"] = [[r["fid"], r["fname"], r["one_year"]] for r in rec]
+        res = catalog().category(int(c_id)) if c_id.isdigit() else {}
     except Error as e:
         print(e)
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
-    finally:
-        cur.close()
-        conn.close()
-        return jsonify(res), ERR_SUCCESS
+    return jsonify(res), ERR_SUCCESS
 
 
 """Get all watchlist items
@@ -820,31 +868,14 @@ def list_portfolio():
 
 
 @app.route("/top/fund", methods=["GET"])
+@conditional(version_validator)
 def top_fund():
-    res = {}
-    conn = mysql_connect()
-    cur = conn.cursor(dictionary=True)
     try:
-        cur.execute(
-            "SELECT fund_company.company_name AS cname, fund_name.fund_name AS fname, fund.fund_id AS fid,"
-            "fund.one_year as one_year FROM fund_name "
-            "JOIN fund_company ON fund_name.company_id = fund_company.company_id "
-            "JOIN fund ON fund_name.fund_id = fund.fund_id "
-            "ORDER BY fund.fund_rank;"
-        )
-        rec = cur.fetchall()
-        res["results"] = [
-            [r["fid"], r["cname"], r["fname"], r["one_year"]] for r in rec
-        ]
+        body = catalog().bodies["top_fund"]
     except Error as e:
         print(e)
-        cur.close()
-        conn.close()
         return jsonify({"error": "Could not process query"}), ERR_INTERNAL_ALL
-    finally:
-        cur.close()
-        conn.close()
-        return jsonify(res), ERR_SUCCESS
+    return json_response(body), ERR_SUCCESS
 
 
 """returns the price of a fund on a given date. Returns the price on the nearest date to the given date if the given date is not present in the database
@@ -862,8 +893,12 @@ def fund_date():
     cur = conn.cursor(dictionary=True)
     try:
         cur.execute(
-            "SELECT price FROM fund_value WHERE fund_id = %s AND date <= %s ORDER BY date DESC LIMIT 1;",
-            (fund_id, date),
+            db.history_query(
+                "date, price",
+                "WHERE fund_id = %s AND date <= %s ORDER BY date DESC LIMIT 1",
+            )
+            + " ORDER BY date DESC LIMIT 1;",
+            (fund_id, date) * 2,
         )
         rec = cur.fetchone()
         if not rec:
@@ -913,5 +948,5 @@ def delete_one_portfolio():
 
 
 if __name__ == "__main__":
-    mysql_connect()
+    mysql_connect().close()
     app.run(host="localhost", port=5000)
@@ -0,0 +1,134 @@
+"""Run ledger for get_funds.py
+
+    * `backfill_month` holds one row per month (keyed by its `frmdt`)
+      with its status, the checksum of its report, the batch size it was
+      cut into, its row count and how many rows were inserted.
+    * `backfill_chunk` holds one row per committed chunk. The row is
+      written by `checkpoint` on the loader's cursor, so it commits or
+      rolls back together with the chunk's `fund_value` rows.
+    * A month is only resumed chunk by chunk when its report checksum
+      and batch size are unchanged, as the chunks are otherwise cut
+      differently. INSERT IGNORE keeps a full reload safe either way.
+"""
+
+import threading
+from datetime import datetime
+
+
+def month_date(month):
+    return datetime.strptime(month, "%d-%b-%Y").date()
+
+
+class BackfillLedger:
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def complete_months(self):
+        """Return the `(frmdt, todt)` dates of every complete month."""
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(
+                    "SELECT frmdt, todt FROM backfill_month WHERE status = 'complete';"
+                )
+                return set(cursor.fetchall())
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def upsert(cursor, month, **fields):
+        columns = ["frmdt", *fields, "updated_on"]
+        values = ["%s"] * (len(fields) + 1) + ["NOW()"]
+        updates = ", ".join(f"{col} = VALUES({col})" for col in columns[1:])
+        cursor.execute(
+            f"INSERT INTO backfill_month ({', '.join(columns)}) "
+            f"VALUES ({', '.join(values)}) ON DUPLICATE KEY UPDATE {updates};",
+            (month_date(month), *fields.values()),
+        )
+
+    def fetched(self, month, todt, checksum, batch_size, resume=False):
+        """Record a downloaded month, return the chunk numbers already loaded."""
+        frmdt = month_date(month)
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(
+                    "SELECT checksum, batch_size FROM backfill_month WHERE frmdt = %s;",
+                    (frmdt,),
+                )
+                previous = cursor.fetchone()
+                done = set()
+                if resume and previous == (checksum, batch_size):
+                    cursor.execute(
+                        "SELECT chunk FROM backfill_chunk WHERE frmdt = %s;", (frmdt,)
+                    )
+                    done = {chunk for (chunk,) in cursor.fetchall()}
+                else:
+                    cursor.execute(
+                        "DELETE FROM backfill_chunk WHERE frmdt = %s;", (frmdt,)
+                    )
+                self.upsert(
+                    cursor,
+                    month,
+                    todt=month_date(todt),
+                    status="fetched",
+                    checksum=checksum,
+                    batch_size=batch_size,
+                )
+                self.connection.commit()
+                return done
+            finally:
+                cursor.close()
+
+    def parsed(self, month, row_count, chunks):
+        self.set(month, status="parsed", row_count=row_count, chunks=chunks)
+
+    def failed(self, month):
+        self.set(month, status="failed")
+
+    def complete(self, month):
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(
+                    "SELECT IFNULL(SUM(inserted), 0) FROM backfill_chunk WHERE frmdt = %s;",
+                    (month_date(month),),
+                )
+                (inserted,) = cursor.fetchone()
+                self.update(cursor, month, status="complete", inserted=int(inserted))
+                self.connection.commit()
+            finally:
+                cursor.close()
+
+    def set(self, month, **fields):
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                self.update(cursor, month, **fields)
+                self.connection.commit()
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def update(cursor, month, **fields):
+        cursor.execute(
+            "UPDATE backfill_month SET "
+            + ", ".join(f"{col} = %s" for col in fields)
+            + ", updated_on = NOW() WHERE frmdt = %s;",
+            (*fields.values(), month_date(month)),
+        )
+
+    @staticmethod
+    def checkpoint(month, chunk):
+        """Return a `FundValueLoader.load` checkpoint recording `chunk`."""
+
+        def record(cursor, row_count, inserted):
+            cursor.execute(
+                "INSERT INTO backfill_chunk (frmdt, chunk, row_count, inserted) "
+                "VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE "
+                "row_count = VALUES(row_count), inserted = VALUES(inserted);",
+                (month_date(month), chunk, row_count, inserted),
+            )
+
+        return record
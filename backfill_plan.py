@@ -0,0 +1,235 @@
+"""Backfill planner
+
+    * Finds the business days (Mon-Fri, less `--holidays`) on which funds
+      are missing a NAV. With `--source fund_value` these are the gaps
+      inside each fund's history plus the days after its latest NAV,
+      with `--source fund` only the days after `fund.latest_date`.
+    * Only funds whose latest NAV is within `--live-days` of the newest
+      NAV overall count as missing the days after it, older ones are
+      taken as wound up (matured, merged, closed) rather than behind.
+    * Days inside ranges the backfill ledger already marks complete are
+      left out: AMFI had nothing more to give for them. So are archived
+      years (see partitions.py), the loaders no longer take NAVs for them.
+    * A day is planned once at least `--min-funds` funds miss it, so a
+      few funds with holes of their own do not trigger requests. The
+      planned days are covered greedily with as few `--max-days` long
+      AMFI requests as possible.
+
+    Prints one `frmdt:todt` range per line, as accepted by get_funds.py,
+    or runs the backfill directly with `--run`.
+
+    e.g. python get_funds.py $(python backfill_plan.py --since 01-Jan-2024)
+         python backfill_plan.py --source fund --run
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from db import connect
+from partitions import archive_cutoff
+
+MAX_DAYS = 31
+MIN_FUNDS = 5
+LIVE_DAYS = 14
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%d-%b-%Y").date()
+
+
+def format_date(day):
+    return day.strftime("%d-%b-%Y")
+
+
+def as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def trailing_gaps(latest_dates, until, live_days=LIVE_DAYS):
+    """Yield the gap after each live fund's latest NAV, up to `until`."""
+    newest = max(latest_dates, default=None)
+    for latest in latest_dates:
+        if newest - latest <= timedelta(days=live_days):
+            yield latest, until + timedelta(days=1)
+
+
+def fund_value_gaps(cursor, since, until, live_days=LIVE_DAYS):
+    """Yield `(after, before)` per fund, exclusive bounds of each gap."""
+    cursor.execute(
+        "SELECT prev_date, date FROM ("
+        "SELECT date, LAG(date) OVER (PARTITION BY fund_id ORDER BY date) AS prev_date "
+        "FROM fund_value WHERE date >= %s AND date < %s) AS v "
+        "WHERE DATEDIFF(date, prev_date) > 1;",
+        (since, until + timedelta(days=1)),
+    )
+    for prev_date, next_date in cursor:
+        yield as_date(prev_date), as_date(next_date)
+    cursor.execute(
+        "SELECT MAX(date) FROM fund_value WHERE date >= %s AND date < %s "
+        "GROUP BY fund_id;",
+        (since, until + timedelta(days=1)),
+    )
+    latest_dates = [as_date(latest) for (latest,) in cursor.fetchall()]
+    yield from trailing_gaps(latest_dates, until, live_days)
+
+
+def fund_gaps(cursor, since, until, live_days=LIVE_DAYS):
+    cursor.execute(
+        "SELECT latest_date FROM fund "
+        "WHERE latest_date IS NOT NULL AND latest_date <= %s;",
+        (until,),
+    )
+    latest_dates = [as_date(latest) for (latest,) in cursor.fetchall()]
+    for after, before in trailing_gaps(latest_dates, until, live_days):
+        yield max(after, since - timedelta(days=1)), before
+
+
+def complete_ranges(cursor):
+    cursor.execute("SELECT frmdt, todt FROM backfill_month WHERE status = 'complete';")
+    return [(as_date(frmdt), as_date(todt)) for frmdt, todt in cursor.fetchall()]
+
+
+def missing_days(gaps, since, until, holidays=(), covered=(), min_funds=MIN_FUNDS):
+    """Return the sorted business days missed by at least `min_funds` funds."""
+    diff = defaultdict(int)
+    for after, before in gaps:
+        if before - after > timedelta(days=1):
+            diff[after + timedelta(days=1)] += 1
+            diff[before] -= 1
+
+    days, missing = [], 0
+    day = since
+    for point in sorted(diff):
+        if point > until:
+            break
+        if point <= since:
+            missing += diff[point]
+            continue
+        days += business_days(day, point - timedelta(days=1), missing, min_funds)
+        missing += diff[point]
+        day = point
+    days += business_days(day, until, missing, min_funds)
+
+    holidays = set(holidays)
+    return [
+        day
+        for day in days
+        if day not in holidays
+        and not any(frmdt <= day <= todt for frmdt, todt in covered)
+    ]
+
+
+def business_days(start, end, missing, min_funds):
+    if missing < min_funds:
+        return []
+    days = []
+    while start <= end:
+        if start.weekday() < 5:
+            days.append(start)
+        start += timedelta(days=1)
+    return days
+
+
+def plan(days, max_days=MAX_DAYS):
+    """Cover `days` with the fewest `(frmdt, todt)` ranges of at most `max_days`."""
+    ranges = []
+    for day in days:
+        if ranges and (day - ranges[-1][0]).days < max_days:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [(frmdt, todt) for frmdt, todt in ranges]
+
+
+def build_plan(
+    connection,
+    source="fund_value",
+    since=None,
+    until=None,
+    holidays=(),
+    min_funds=MIN_FUNDS,
+    max_days=MAX_DAYS,
+    use_ledger=True,
+    live_days=LIVE_DAYS,
+):
+    until = until or date.today()
+    cursor = connection.cursor()
+    try:
+        if since is None:
+            cursor.execute(
+                "SELECT MIN(date) FROM fund_value;"
+                if source == "fund_value"
+                else "SELECT MIN(earliest_date) FROM fund;"
+            )
+            (earliest,) = cursor.fetchone()
+            since = as_date(earliest) if earliest is not None else until
+        cutoff = archive_cutoff(cursor)
+        if cutoff is not None:
+            since = max(since, cutoff)
+        gaps = (fund_value_gaps if source == "fund_value" else fund_gaps)(
+            cursor, since, until, live_days
+        )
+        gaps = list(gaps)
+        covered = complete_ranges(cursor) if use_ledger else []
+    finally:
+        cursor.close()
+    days = missing_days(gaps, since, until, holidays, covered, min_funds)
+    return plan(days, max_days)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan AMFI requests for missing NAVs")
+    parser.add_argument("--source", choices=["fund_value", "fund"], default="fund_value")
+    parser.add_argument("--since", type=parse_date, help="default: earliest NAV")
+    parser.add_argument("--until", type=parse_date, help="default: today")
+    parser.add_argument(
+        "--holidays", help="file with one non-business day per line, e.g. 26-Jan-2024"
+    )
+    parser.add_argument("--min-funds", type=int, default=MIN_FUNDS)
+    parser.add_argument(
+        "--live-days",
+        type=int,
+        default=LIVE_DAYS,
+        help="funds whose latest NAV is older than the newest by more are wound up",
+    )
+    parser.add_argument("--max-days", type=int, default=MAX_DAYS)
+    parser.add_argument(
+        "--ignore-ledger",
+        action="store_true",
+        help="also plan days inside ranges the ledger marks complete",
+    )
+    parser.add_argument(
+        "--run", action="store_true", help="hand the plan to the get_funds.py pipeline"
+    )
+    args = parser.parse_args()
+
+    holidays = []
+    if args.holidays:
+        with open(args.holidays, "r") as file:
+            holidays = [parse_date(line.strip()) for line in file if line.strip()]
+
+    connection = connect()
+    try:
+        ranges = build_plan(
+            connection,
+            source=args.source,
+            since=args.since,
+            until=args.until,
+            holidays=holidays,
+            min_funds=args.min_funds,
+            max_days=args.max_days,
+            use_ledger=not args.ignore_ledger,
+            live_days=args.live_days,
+        )
+    finally:
+        connection.close()
+
+    specs = [f"{format_date(frmdt)}:{format_date(todt)}" for frmdt, todt in ranges]
+    if args.run:
+        if specs:
+            from get_funds import run_pipeline
+
+            run_pipeline(specs)
+    else:
+        print("\n".join(specs))
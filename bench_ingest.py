@@ -0,0 +1,273 @@
+"""Ingestion benchmark
+
+    * Generates synthetic `DownloadNAVHistoryReport` bodies: category and
+      company header lines followed by 8-field scheme rows, one row per
+      fund per business day, with NAVs following a random walk.
+    * Times each stage separately: writing the report, `parse`,
+      dimension resolution, `fund_value` loading, the metric recompute
+      and the ranking. Without `--defer-metrics` the per-row trigger
+      runs inside the load stage.
+    * Loads into the database given by `--host`/`--user`/`--password`/
+      `--database`, e.g. a local MySQL container created from
+      `create_schema.sql`. There is no default host so the live database
+      cannot be benchmarked by accident. `--parse-only` needs no
+      database at all. Each size creates its own funds, so sizes do not
+      see each other's rows as duplicates. Their scheme codes start at
+      `BENCH_CODES`, far above AMFI's, and a run refuses to start if any
+      fund not made by the benchmark already holds one of them.
+    * Save a run with `--json`, then pass it to `--compare` later to see
+      the before/after side by side, as with bench_queries.py.
+
+    e.g. python bench_ingest.py --sizes tiny small --parse-only
+         python bench_ingest.py --host 127.0.0.1 --password fund --defer-metrics numpy
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import zlib
+from datetime import date, timedelta
+from time import perf_counter
+
+from amfi import BATCH_SIZE, parse_batches
+from db import connect
+from ingest import DimensionCache, FundValueLoader, rank_funds, refresh_fund_metrics
+
+HEADER = (
+    "Scheme Code;Scheme Name;ISIN Div Payout/ISIN Growth;ISIN Div Reinvestment;"
+    "Net Asset Value;Repurchase Price;Sale Price;Date"
+)
+
+# (funds, business days)
+SIZES = {
+    "tiny": (1000, 1),
+    "small": (1000, 21),
+    "medium": (5000, 250),
+    "large": (20000, 250),
+    "full": (20000, 2500),
+}
+
+# Synthetic scheme codes start here, AMFI's are 6 digits
+BENCH_CODES = 10_000_000
+FUNDS_PER_COMPANY = 50
+COMPANIES_PER_CATEGORY = 8
+
+
+def business_days(end, count):
+    days = []
+    day = end
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day -= timedelta(days=1)
+    return days[::-1]
+
+
+def generate_report(
+    funds, days, prefix="Bench", first_code=BENCH_CODES, end=date(2024, 12, 31), seed=0
+):
+    """Yield the lines of a report with `funds` schemes over `days` business days.
+
+    Names start with `prefix` and scheme codes at `first_code`, so each
+    size creates its own funds.
+    """
+    rng = random.Random(seed)
+    dates = [day.strftime("%d-%b-%Y") for day in business_days(end, days)]
+    yield HEADER
+    yield ""
+    for fund in range(funds):
+        company = fund // FUNDS_PER_COMPANY
+        if fund % FUNDS_PER_COMPANY == 0:
+            if company % COMPANIES_PER_CATEGORY == 0:
+                category = company // COMPANIES_PER_CATEGORY
+                yield f"Open Ended Schemes({prefix} Category {category})"
+                yield ""
+            yield f"{prefix} Company {company} Mutual Fund"
+            yield ""
+        code = first_code + fund
+        name = f"{prefix} Company {company} Fund {fund} - Direct Plan - Growth"
+        isin = f"INF{company:03d}B{fund:05d}"
+        nav = rng.uniform(10, 500)
+        for day in dates:
+            nav *= 1 + rng.gauss(0.0003, 0.01)
+            yield f"{code};{name};{isin};-;{nav:.4f};;;{day}"
+
+
+def read_lines(path):
+    with open(path, "r") as file:
+        for line in file:
+            yield line.rstrip("\n")
+
+
+def check_codes(connection, prefix, first_code, funds):
+    """Refuse to run over scheme codes held by funds the benchmark did not make."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(*) FROM fund_name WHERE scheme_code >= %s "
+            "AND scheme_code < %s AND fund_name NOT LIKE %s;",
+            (first_code, first_code + funds, prefix + " %"),
+        )
+        (taken,) = cursor.fetchone()
+    finally:
+        cursor.close()
+    if taken:
+        raise RuntimeError(
+            f"{taken} funds not made by the benchmark hold scheme codes "
+            f"{first_code}-{first_code + funds - 1}, refusing to load over them"
+        )
+
+
+def run(
+    name,
+    funds,
+    days,
+    connection=None,
+    batch_size=BATCH_SIZE,
+    infile=False,
+    defer=False,
+):
+    timings = {}
+    first_code = BENCH_CODES + 100000 * (zlib.crc32(name.encode()) % 1000)
+    if connection is not None:
+        check_codes(connection, f"Bench {name}", first_code, funds)
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as file:
+        start = perf_counter()
+        for line in generate_report(
+            funds, days, prefix=f"Bench {name}", first_code=first_code
+        ):
+            file.write(line + "\n")
+        timings["generate"] = perf_counter() - start
+    size = os.path.getsize(file.name)
+
+    try:
+        rows = 0
+        parse_time = resolve_time = 0.0
+        if connection is not None:
+            cache = DimensionCache(connection)
+            loader = FundValueLoader(connection, infile=infile, defer=defer)
+        batches = parse_batches(read_lines(file.name), batch_size)
+        while True:
+            start = perf_counter()
+            batch = next(batches, None)
+            parse_time += perf_counter() - start
+            if batch is None:
+                break
+            rows += len(batch)
+            if connection is None:
+                continue
+            start = perf_counter()
+            fund_rows = cache.fund_rows(connection, batch)
+            resolve_time += perf_counter() - start
+            loader.load(fund_rows)
+    finally:
+        os.remove(file.name)
+
+    timings["parse"] = parse_time
+    if connection is not None:
+        timings["dimensions"] = resolve_time
+        timings["load"] = loader.elapsed
+        if defer:
+            start = perf_counter()
+            refresh_fund_metrics(connection, defer)
+            timings["recompute"] = perf_counter() - start
+        start = perf_counter()
+        rank_funds(connection)
+        timings["rank"] = perf_counter() - start
+
+    return {
+        "funds": funds,
+        "days": days,
+        "rows": rows,
+        "bytes": size,
+        "seconds": timings,
+        "rows_per_second": {
+            stage: rows / elapsed if elapsed > 0 else None
+            for stage, elapsed in timings.items()
+        },
+    }
+
+
+def describe(result):
+    return "  ".join(
+        f"{stage} {elapsed:.2f}s" for stage, elapsed in result["seconds"].items()
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark NAV ingestion stages")
+    parser.add_argument(
+        "--sizes", nargs="+", choices=list(SIZES), default=["tiny", "small", "medium"]
+    )
+    parser.add_argument("--funds", type=int, help="custom size, with --days")
+    parser.add_argument("--days", type=int, help="custom size, with --funds")
+    parser.add_argument("--parse-only", action="store_true")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="fund")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--database", default="fund")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--infile",
+        action="store_true",
+        help="load chunks with LOAD DATA LOCAL INFILE",
+    )
+    parser.add_argument(
+        "--defer-metrics",
+        nargs="?",
+        const="sql",
+        choices=["sql", "numpy", "state"],
+        help="skip the per-row fund trigger and recompute funds once at the end",
+    )
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="results file from an earlier run")
+    args = parser.parse_args()
+
+    if not args.parse_only and args.host is None:
+        parser.error("--host is required unless --parse-only is given")
+
+    sizes = {name: SIZES[name] for name in args.sizes}
+    if args.funds and args.days:
+        sizes = {f"{args.funds}x{args.days}": (args.funds, args.days)}
+
+    before = {}
+    if args.compare:
+        with open(args.compare, "r") as file:
+            before = json.load(file)
+
+    results = {}
+    for name, (funds, days) in sizes.items():
+        connection = None
+        if not args.parse_only:
+            connection = connect(
+                host=args.host,
+                port=args.port,
+                user=args.user,
+                password=args.password,
+                database=args.database,
+                allow_local_infile=args.infile,
+            )
+        try:
+            result = run(
+                name,
+                funds,
+                days,
+                connection,
+                batch_size=args.batch_size,
+                infile=args.infile,
+                defer=args.defer_metrics,
+            )
+        finally:
+            if connection is not None:
+                connection.close()
+        results[name] = result
+        print(f"{name} ({result['rows']} rows): {describe(result)}")
+        if name in before:
+            print(f"    before: {describe(before[name])}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
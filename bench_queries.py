@@ -0,0 +1,136 @@
+"""Query plan and latency benchmark for the hot read paths
+
+    * Runs EXPLAIN and times each query `--runs` times against the live
+      schema, reporting the access type, key and estimated rows from the
+      plan along with the median latency.
+    * Save a run with `--json`, then pass it to `--compare` after a
+      migration to see the before/after side by side.
+
+    e.g. python bench_queries.py --json before.json
+         python migrate.py
+         python bench_queries.py --compare before.json
+"""
+
+import argparse
+import json
+from statistics import median
+from time import perf_counter
+
+from db import connect
+
+QUERIES = [
+    (
+        "graph_data",
+        "SELECT UNIQUE date, price FROM fund_value WHERE fund_id = %(fund_id)s "
+        "ORDER BY date DESC;",
+    ),
+    (
+        "fund_date",
+        "SELECT price FROM fund_value WHERE fund_id = %(fund_id)s AND date <= %(date)s "
+        "ORDER BY date DESC LIMIT 1;",
+    ),
+    (
+        "fund_name_lookup",
+        "SELECT fund_id FROM fund_name WHERE fund_name = %(fund_name)s;",
+    ),
+    (
+        "company_lookup",
+        "SELECT company_id FROM fund_company WHERE company_name = %(company_name)s;",
+    ),
+    (
+        "home_one_year",
+        "SELECT fund_company.company_name AS cname, fund_name.fund_name AS fname, "
+        "fund.fund_id AS fid, ROUND(fund.one_year, 2) AS price FROM fund_name "
+        "JOIN fund_company ON fund_name.company_id = fund_company.company_id "
+        "JOIN fund ON fund_name.fund_id = fund.fund_id "
+        "ORDER BY fund.one_year DESC LIMIT 5;",
+    ),
+    ("one_year_change", "SELECT one_year_change(%(fund_id)s);"),
+]
+
+
+def sample_params(cursor):
+    cursor.execute(
+        "SELECT fund.fund_id, fund_name.fund_name, fund_company.company_name, "
+        "fund.latest_date FROM fund "
+        "JOIN fund_name ON fund_name.fund_id = fund.fund_id "
+        "JOIN fund_company ON fund_company.company_id = fund_name.company_id "
+        "ORDER BY fund.earliest_date LIMIT 1;"
+    )
+    fund_id, fund_name, company_name, latest_date = cursor.fetchone()
+    return {
+        "fund_id": fund_id,
+        "fund_name": fund_name,
+        "company_name": company_name,
+        "date": latest_date,
+    }
+
+
+def run(connection, runs):
+    cursor = connection.cursor()
+    try:
+        params = sample_params(cursor)
+    finally:
+        cursor.close()
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        results = {}
+        for name, query in QUERIES:
+            cursor.execute("EXPLAIN " + query, params)
+            plan = [
+                {
+                    "table": row["table"],
+                    "type": row["type"],
+                    "key": row["key"],
+                    "rows": row["rows"],
+                }
+                for row in cursor.fetchall()
+            ]
+            timings = []
+            for _ in range(runs):
+                start = perf_counter()
+                cursor.execute(query, params)
+                cursor.fetchall()
+                timings.append((perf_counter() - start) * 1000)
+            results[name] = {"plan": plan, "median_ms": median(timings)}
+    finally:
+        cursor.close()
+    return results
+
+
+def describe(plan):
+    return ", ".join(f"{p['table']}:{p['type']}/{p['key']}/{p['rows']}" for p in plan)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hot read queries")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="results file from an earlier run")
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        results = run(connection, args.runs)
+    finally:
+        connection.close()
+
+    before = {}
+    if args.compare:
+        with open(args.compare, "r") as file:
+            before = json.load(file)
+
+    for name, result in results.items():
+        print(f"{name}: {result['median_ms']:.2f} ms  [{describe(result['plan'])}]")
+        if name in before:
+            old = before[name]
+            speedup = old["median_ms"] / result["median_ms"] if result["median_ms"] else 0
+            print(
+                f"    before: {old['median_ms']:.2f} ms  [{describe(old['plan'])}]"
+                f"  ({speedup:.1f}x)"
+            )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2, default=str)
@@ -0,0 +1,180 @@
+"""Fund catalog for app.py
+
+    * Every fund, company and category, with the `fund` columns the
+      listing endpoints show, loaded with three queries once per data
+      version and worker (see data_version.py).
+    * A catalog is never modified after `load`, a new data version gets
+      a new catalog, so requests need no locking.
+    * Funds are pre-sorted by `fund_rank`, overall and per company, and
+      by `fund_category_rank` per category, in the same order as the
+      queries they replace.
+    * The bodies of the endpoints without parameters are encoded once.
+    * Each catalog carries the /search/fund index (see search.py), built
+      from the previous catalog's.
+"""
+
+import json
+
+from search import SearchIndex
+
+
+class Fund:
+    __slots__ = (
+        "fund_id",
+        "name",
+        "company_id",
+        "category_id",
+        "one_year",
+        "fund_rank",
+        "fund_category_rank",
+        "has_metrics",
+        "nav_count",
+        "latest_date",
+        "stale",
+    )
+
+    def __init__(
+        self,
+        fund_id,
+        name,
+        company_id,
+        category_id,
+        one_year,
+        fund_rank,
+        fund_category_rank,
+        has_metrics,
+        nav_count=None,
+        latest_date=None,
+        stale=None,
+    ):
+        self.fund_id = fund_id
+        self.name = name
+        self.company_id = company_id
+        self.category_id = category_id
+        self.one_year = one_year
+        self.fund_rank = fund_rank
+        self.fund_category_rank = fund_category_rank
+        self.has_metrics = has_metrics
+        # From fund_state, they change whenever a NAV of the fund is loaded,
+        # unless the state is stale and waiting for fund_state.rebuild
+        self.nav_count = nav_count
+        self.latest_date = latest_date
+        self.stale = stale
+
+
+def rank_order(rank):
+    # Like ORDER BY in MySQL, NULL ranks come first
+    return lambda fund: (getattr(fund, rank) is not None, getattr(fund, rank) or 0)
+
+
+def round2(value):
+    return None if value is None else round(value, 2)
+
+
+def encode(res):
+    return json.dumps(res, separators=(",", ":"), sort_keys=True)
+
+
+class Catalog:
+    def __init__(self, funds, companies, categories, previous=None):
+        self.funds = tuple(funds)  # by fund_id
+        self.by_id = {fund.fund_id: fund for fund in self.funds}
+        self.companies = dict(companies)
+        self.categories = dict(categories)
+
+        # Funds without a `fund` row are listed by /all/fund only
+        ranked = [fund for fund in self.funds if fund.has_metrics]
+        self.by_rank = tuple(sorted(ranked, key=rank_order("fund_rank")))
+        by_company, by_category = {}, {}
+        for fund in self.by_rank:
+            by_company.setdefault(fund.company_id, []).append(fund)
+        for fund in sorted(ranked, key=rank_order("fund_category_rank")):
+            by_category.setdefault(fund.category_id, []).append(fund)
+        self.by_company = {key: tuple(funds) for key, funds in by_company.items()}
+        self.by_category = {key: tuple(funds) for key, funds in by_category.items()}
+        self.search = SearchIndex(
+            self.by_rank,
+            self.companies,
+            self.categories,
+            previous.search if previous is not None else None,
+        )
+
+        self.bodies = {
+            "all_fund": encode(
+                {"results": [[fund.fund_id, fund.name] for fund in self.funds]}
+            ),
+            "all_company": encode(
+                {"results": [[key, name] for key, name in self.companies.items()]}
+            ),
+            "all_category": encode(
+                {"results": [[key, name] for key, name in self.categories.items()]}
+            ),
+            "top_fund": encode(
+                {
+                    "results": [
+                        [
+                            fund.fund_id,
+                            self.companies[fund.company_id],
+                            fund.name,
+                            fund.one_year,
+                        ]
+                        for fund in self.by_rank
+                        if fund.company_id in self.companies
+                    ]
+                }
+            ),
+        }
+
+    @classmethod
+    def load(cls, conn, previous=None):
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT company_id, company_name FROM fund_company ORDER BY company_id;"
+            )
+            companies = cur.fetchall()
+            cur.execute(
+                "SELECT category_id, category_name FROM fund_category "
+                "ORDER BY category_id;"
+            )
+            categories = cur.fetchall()
+            cur.execute(
+                "SELECT fund_name.fund_id, fund_name.fund_name, fund_name.company_id, "
+                "fund_name.category_id, fund.one_year, fund.fund_rank, "
+                "fund.fund_category_rank, fund.fund_id IS NOT NULL, "
+                "fund_state.n, fund_state.latest_date, fund_state.stale "
+                "FROM fund_name LEFT JOIN fund ON fund.fund_id = fund_name.fund_id "
+                "LEFT JOIN fund_state ON fund_state.fund_id = fund_name.fund_id "
+                "ORDER BY fund_name.fund_id;"
+            )
+            funds = [
+                Fund(*row[:7], bool(row[7]), *row[8:10], bool(row[10]))
+                for row in cur.fetchall()
+            ]
+        finally:
+            cur.close()
+        return cls(funds, companies, categories, previous)
+
+    def company(self, company_id):
+        """Return the /search/company result, {} for an unknown company."""
+        if company_id not in self.companies:
+            return {}
+        return {
+            "company_name": self.companies[company_id],
+            "results": [
+                [fund.fund_id, fund.name, round2(fund.one_year)]
+                for fund in self.by_company.get(company_id, ())
+            ],
+        }
+
+    def category(self, category_id):
+        """Return the /search/category result, {} for an unknown category."""
+        if category_id not in self.categories:
+            return {}
+        return {
+            "category_name": self.categories[category_id],
+            "results": [
+                [fund.fund_id, fund.name, round2(fund.one_year)]
+                for fund in self.by_category.get(category_id, ())
+            ],
+        }
@@ -7,8 +7,35 @@ CREATE TABLE user(user_id int primary key auto_increment, user_name varchar(500)
 CREATE TABLE fund_company(company_id int primary key auto_increment, company_name varchar(500));
 CREATE TABLE fund_category(category_id int primary key auto_increment, category_name varchar(500));
 CREATE TABLE fund_name(fund_id int primary key auto_increment , company_id int, category_id int, fund_name varchar(500),
+scheme_code int, isin_growth varchar(12), isin_reinvestment varchar(12),
 foreign key(category_id) references fund_category(category_id), foreign key(company_id) references fund_company(company_id));
-CREATE TABLE fund_value(fund_id int, date datetime, price double, foreign key(fund_id) references fund_name(fund_id));
+-- Partitioned by year (see partitions.py), which rules out a foreign key to fund_name
+CREATE TABLE fund_value(fund_id int, date datetime, price double, primary key(fund_id, date))
+PARTITION BY RANGE COLUMNS(date) (
+    PARTITION p2006 VALUES LESS THAN ('2007-01-01'),
+    PARTITION p2007 VALUES LESS THAN ('2008-01-01'),
+    PARTITION p2008 VALUES LESS THAN ('2009-01-01'),
+    PARTITION p2009 VALUES LESS THAN ('2010-01-01'),
+    PARTITION p2010 VALUES LESS THAN ('2011-01-01'),
+    PARTITION p2011 VALUES LESS THAN ('2012-01-01'),
+    PARTITION p2012 VALUES LESS THAN ('2013-01-01'),
+    PARTITION p2013 VALUES LESS THAN ('2014-01-01'),
+    PARTITION p2014 VALUES LESS THAN ('2015-01-01'),
+    PARTITION p2015 VALUES LESS THAN ('2016-01-01'),
+    PARTITION p2016 VALUES LESS THAN ('2017-01-01'),
+    PARTITION p2017 VALUES LESS THAN ('2018-01-01'),
+    PARTITION p2018 VALUES LESS THAN ('2019-01-01'),
+    PARTITION p2019 VALUES LESS THAN ('2020-01-01'),
+    PARTITION p2020 VALUES LESS THAN ('2021-01-01'),
+    PARTITION p2021 VALUES LESS THAN ('2022-01-01'),
+    PARTITION p2022 VALUES LESS THAN ('2023-01-01'),
+    PARTITION p2023 VALUES LESS THAN ('2024-01-01'),
+    PARTITION p2024 VALUES LESS THAN ('2025-01-01'),
+    PARTITION p2025 VALUES LESS THAN ('2026-01-01'),
+    PARTITION p2026 VALUES LESS THAN ('2027-01-01'),
+    PARTITION p2027 VALUES LESS THAN ('2028-01-01'),
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+);
 CREATE TABLE fund(fund_id int, one_day double, one_week double, one_month double, three_month double,
 six_month double, one_year double, lifetime double, earliest_date datetime, latest_date datetime, high double, low double, standard_deviation double,
 value double, fund_rank int, fund_category_rank int, primary key(fund_id), foreign key(fund_id) references fund_name(fund_id));
@@ -19,6 +46,59 @@ CREATE TABLE watchlist(user_id int, fund_id int, foreign key(user_id) references
 primary key(user_id, fund_id));
 CREATE TABLE auth (user_id INT(11) NOT NULL, token_hash CHAR(64) NOT NULL PRIMARY KEY, created_on DATE NOT NULL);
 
+-- Lookup and ordering indexes
+CREATE INDEX fund_name_name ON fund_name (fund_name);
+CREATE UNIQUE INDEX fund_name_scheme_code ON fund_name (scheme_code);
+CREATE INDEX fund_company_name ON fund_company (company_name);
+CREATE INDEX fund_category_name ON fund_category (category_name);
+CREATE INDEX fund_one_year ON fund (one_year);
+CREATE INDEX fund_six_month ON fund (six_month);
+CREATE INDEX fund_three_month ON fund (three_month);
+CREATE INDEX fund_one_month ON fund (one_month);
+CREATE INDEX fund_rank ON fund (fund_rank);
+CREATE INDEX fund_category_rank ON fund (fund_category_rank);
+
+-- Funds that received new rows while the trigger was deferred
+CREATE TABLE fund_refresh(fund_id int primary key, foreign key(fund_id) references fund_name(fund_id));
+
+-- Running per-fund statistics maintained by the loaders (see fund_state.py)
+CREATE TABLE fund_state(fund_id int primary key, n int NOT NULL, mean double NOT NULL, m2 double NOT NULL, high double, low double,
+earliest_date datetime, latest_date datetime, latest_price double, earliest_price double, stale boolean NOT NULL DEFAULT FALSE,
+foreign key(fund_id) references fund_name(fund_id));
+
+-- Years moved out of fund_value by `python partitions.py archive`
+CREATE TABLE fund_value_archive(fund_id int, date datetime, price double, primary key(fund_id, date));
+CREATE VIEW fund_value_history AS
+SELECT fund_id, date, price FROM fund_value
+UNION ALL
+SELECT fund_id, date, price FROM fund_value_archive;
+
+-- Per-month run ledger for get_funds.py (see backfill_ledger.py)
+CREATE TABLE backfill_month(frmdt date primary key, todt date NOT NULL, status varchar(16) NOT NULL, checksum char(64),
+batch_size int, row_count int, inserted int, chunks int, updated_on datetime NOT NULL);
+CREATE TABLE backfill_chunk(frmdt date, chunk int, row_count int NOT NULL, inserted int NOT NULL, primary key(frmdt, chunk));
+
+-- Data version stamp (updated_on in UTC) and /home leaderboards, written at the end of every ingest (see ingest.publish)
+CREATE TABLE data_version(id tinyint primary key, version int NOT NULL, updated_on datetime NOT NULL);
+INSERT INTO data_version (id, version, updated_on) VALUES (1, 1, UTC_TIMESTAMP());
+CREATE TABLE leaderboard(period varchar(16), position int, fund_id int NOT NULL, company_name varchar(500), fund_name varchar(500),
+value double, primary key(period, position));
+
+-- Migrations already contained in this file (see migrate.py)
+CREATE TABLE schema_migrations(version varchar(255) primary key, applied_on datetime NOT NULL);
+INSERT INTO schema_migrations (version, applied_on) VALUES
+('0001_deferred_fund_metrics', NOW()),
+('0002_index_pack', NOW()),
+('0003_fund_state', NOW()),
+('0004_fund_ranks', NOW()),
+('0005_partition_fund_value', NOW()),
+('0006_backfill_ledger', NOW()),
+('0007_scheme_code', NOW()),
+('0008_leaderboards', NOW()),
+('0009_archive_history', NOW()),
+('0010_data_version_utc', NOW()),
+('0011_archive_period_changes', NOW());
+
 
 DELIMITER //
 
@@ -27,27 +107,43 @@ BEGIN
     DECLARE change_val DOUBLE;
     DECLARE latest_date DATE;
     DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
 
+    -- Archived years included (see partitions.py)
     SELECT MAX(date) INTO latest_date
-    FROM fund_value
-    WHERE fund_id = f_id;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
 
     SELECT MAX(date) INTO previous_date
-    FROM fund_value
-    WHERE fund_id = f_id AND date < latest_date;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date
+    ) AS h;
 
     IF previous_date IS NULL THEN
         RETURN NULL;
     END IF;
 
-    SET change_val = (
-        SELECT IFNULL((latest.price - previous.price) / IF(previous.price = 0, NULL, previous.price) * 100, NULL)
-        FROM fund_value AS latest
-        JOIN fund_value AS previous
-        ON previous.date = previous_date AND latest.date = latest_date
-        AND latest.fund_id = f_id
-        AND previous.fund_id = f_id
-    );
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
 
     RETURN change_val;
 END //
@@ -57,28 +153,43 @@ BEGIN
     DECLARE change_val DOUBLE;
     DECLARE latest_date DATE;
     DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
 
+    -- Archived years included (see partitions.py)
     SELECT MAX(date) INTO latest_date
-    FROM fund_value
-    WHERE fund_id = f_id;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
 
     SELECT MIN(date) INTO previous_date
-    FROM fund_value
-    WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 7 DAY)
-    LIMIT 1;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 7 DAY)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 7 DAY)
+    ) AS h;
 
     IF previous_date IS NULL THEN
         RETURN NULL;
     END IF;
 
-    SET change_val = (
-        SELECT IFNULL((latest.price - previous.price) / IF(previous.price = 0, NULL, previous.price) * 100, NULL)
-        FROM fund_value AS latest
-        JOIN fund_value AS previous
-        ON previous.date = previous_date AND latest.date = latest_date
-        AND latest.fund_id = f_id
-        AND previous.fund_id = f_id
-    );
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
 
     RETURN change_val;
 END //
@@ -88,28 +199,43 @@ BEGIN
     DECLARE change_val DOUBLE;
     DECLARE latest_date DATE;
     DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
 
+    -- Archived years included (see partitions.py)
     SELECT MAX(date) INTO latest_date
-    FROM fund_value
-    WHERE fund_id = f_id;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
 
     SELECT MIN(date) INTO previous_date
-    FROM fund_value
-    WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 MONTH)
-    LIMIT 1;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 MONTH)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 MONTH)
+    ) AS h;
 
     IF previous_date IS NULL THEN
         RETURN NULL;
     END IF;
 
-    SET change_val = (
-        SELECT IFNULL((latest.price - previous.price) / IF(previous.price = 0, NULL, previous.price) * 100, NULL)
-        FROM fund_value AS latest
-        JOIN fund_value AS previous
-        ON previous.date = previous_date AND latest.date = latest_date
-        AND latest.fund_id = f_id
-        AND previous.fund_id = f_id
-    );
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
 
     RETURN change_val;
 END //
@@ -119,28 +245,43 @@ BEGIN
     DECLARE change_val DOUBLE;
     DECLARE latest_date DATE;
     DECLARE previous_date DATE;
-    
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
+
+    -- Archived years included (see partitions.py)
     SELECT MAX(date) INTO latest_date
-    FROM fund_value
-    WHERE fund_id = f_id;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
 
     SELECT MIN(date) INTO previous_date
-    FROM fund_value
-    WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 3 MONTH)
-    LIMIT 1;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 3 MONTH)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 3 MONTH)
+    ) AS h;
 
     IF previous_date IS NULL THEN
         RETURN NULL;
     END IF;
 
-    SET change_val = (
-        SELECT IFNULL((latest.price - previous.price) / IF(previous.price = 0, NULL, previous.price) * 100, NULL)
-        FROM fund_value AS latest
-        JOIN fund_value AS previous
-        ON previous.date = previous_date AND latest.date = latest_date
-        AND latest.fund_id = f_id
-        AND previous.fund_id = f_id
-    );
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
 
     RETURN change_val;
 END //
@@ -150,28 +291,43 @@ BEGIN
     DECLARE change_val DOUBLE;
     DECLARE latest_date DATE;
     DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
 
+    -- Archived years included (see partitions.py)
     SELECT MAX(date) INTO latest_date
-    FROM fund_value
-    WHERE fund_id = f_id;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
 
     SELECT MIN(date) INTO previous_date
-    FROM fund_value
-    WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 6 MONTH)
-    LIMIT 1;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 6 MONTH)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 6 MONTH)
+    ) AS h;
 
     IF previous_date IS NULL THEN
         RETURN NULL;
     END IF;
 
-    SET change_val = (
-        SELECT IFNULL((latest.price - previous.price) / IF(previous.price = 0, NULL, previous.price) * 100, NULL)
-        FROM fund_value AS latest
-        JOIN fund_value AS previous
-        ON previous.date = previous_date AND latest.date = latest_date
-        AND latest.fund_id = f_id
-        AND previous.fund_id = f_id
-    );
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
 
     RETURN change_val;
 END //
@@ -181,28 +337,43 @@ BEGIN
     DECLARE change_val DOUBLE;
     DECLARE latest_date DATE;
     DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
 
+    -- Archived years included (see partitions.py)
     SELECT MAX(date) INTO latest_date
-    FROM fund_value
-    WHERE fund_id = f_id;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
 
     SELECT MIN(date) INTO previous_date
-    FROM fund_value
-    WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 YEAR)
-    LIMIT 1;
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 YEAR)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 YEAR)
+    ) AS h;
 
     IF previous_date IS NULL THEN
         RETURN NULL;
     END IF;
 
-    SET change_val = (
-        SELECT IFNULL((latest.price - previous.price) / IF(previous.price = 0, NULL, previous.price) * 100, NULL)
-        FROM fund_value AS latest
-        JOIN fund_value AS previous
-        ON previous.date = previous_date AND latest.date = latest_date
-        AND latest.fund_id = f_id
-        AND previous.fund_id = f_id
-    );
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
 
     RETURN change_val;
 END //
@@ -215,26 +386,32 @@ BEGIN
     DECLARE latest_price DOUBLE;
     DECLARE earliest_price DOUBLE;
 
-    SELECT MAX(date) INTO latest_date
-    FROM fund_value
-    WHERE fund_id = f_id;
-
-    SELECT MIN(date) INTO earliest_date
-    FROM fund_value
-    WHERE fund_id = f_id;
+    -- Archived years included (see partitions.py)
+    SELECT MAX(date), MIN(date) INTO latest_date, earliest_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
 
     IF latest_date IS NULL OR earliest_date IS NULL THEN
         RETURN NULL;
     END IF;
 
     SELECT price INTO latest_price
-    FROM fund_value
-    WHERE fund_id = f_id AND date = latest_date
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h
     LIMIT 1;
 
     SELECT price INTO earliest_price
-    FROM fund_value
-    WHERE fund_id = f_id AND date = earliest_date
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = earliest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = earliest_date
+    ) AS h
     LIMIT 1;
 
     IF latest_price IS NULL OR earliest_price IS NULL THEN
@@ -251,8 +428,11 @@ BEGIN
     DECLARE stddev DOUBLE;
     SET stddev = (
         SELECT STDDEV(price)
-        FROM fund_value
-        WHERE fund_id = f_id
+        FROM (
+            SELECT price FROM fund_value WHERE fund_id = f_id
+            UNION ALL
+            SELECT price FROM fund_value_archive WHERE fund_id = f_id
+        ) AS h
     );
     RETURN IFNULL(stddev, 0);
 END //
@@ -267,64 +447,70 @@ BEGIN
     DECLARE earliest_dt DATETIME;
     DECLARE latest_dt DATETIME;
 
-    SET max_value = (SELECT MAX(price) FROM fund_value WHERE fund_id = NEW.fund_id);
-    SET min_value = (SELECT MIN(price) FROM fund_value WHERE fund_id = NEW.fund_id);
-    
-    SET earliest_dt = (SELECT MIN(date) FROM fund_value WHERE fund_id = NEW.fund_id);
-    SET latest_dt = (SELECT MAX(date) FROM fund_value WHERE fund_id = NEW.fund_id);
+    -- Bulk loads set @defer_fund_metrics and call refresh_fund_metrics() once instead
+    IF @defer_fund_metrics IS NULL THEN
+        -- Archived years included (see partitions.py)
+        SELECT MAX(price), MIN(price), MIN(date), MAX(date)
+        INTO max_value, min_value, earliest_dt, latest_dt
+        FROM (
+            SELECT price, date FROM fund_value WHERE fund_id = NEW.fund_id
+            UNION ALL
+            SELECT price, date FROM fund_value_archive WHERE fund_id = NEW.fund_id
+        ) AS h;
     
-	IF NOT EXISTS (SELECT 1 FROM fund WHERE fund_id = NEW.fund_id) THEN
-        INSERT INTO fund (
-            fund_id,
-            one_day,
-            one_week,
-            one_month,
-            three_month,
-            six_month,
-            one_year,
-            lifetime,
-            earliest_date,
-            latest_date,
-            high,
-            low,
-            standard_deviation,
-            value
-        )
-        VALUES (
-            NEW.fund_id,
-            one_day_change(NEW.fund_id),  
-            one_week_change(NEW.fund_id),  
-            one_month_change(NEW.fund_id),  
-            three_month_change(NEW.fund_id),  
-            six_month_change(NEW.fund_id),  
-            one_year_change(NEW.fund_id),  
-            lifetime_change(NEW.fund_id), 
-            earliest_dt,
-            latest_dt,
-            max_value,
-            min_value,
-            fund_std_dev(NEW.fund_id), 
-            NEW.price
-        );
-
-    ELSE
-		UPDATE fund
-		SET 
-			one_day = one_day_change(NEW.fund_id),
-			one_week = one_week_change(NEW.fund_id),
-			one_month = one_month_change(NEW.fund_id),
-			three_month = three_month_change(NEW.fund_id),
-			six_month = six_month_change(NEW.fund_id),
-			one_year = one_year_change(NEW.fund_id),
-			lifetime = lifetime_change(NEW.fund_id),
-			earliest_date = earliest_dt,
-			latest_date = latest_dt,
-			high = max_value,
-			low = min_value,
-			standard_deviation = fund_std_dev(NEW.fund_id),
-			value = NEW.price
-		WHERE fund_id = NEW.fund_id;
-	END IF;
+        IF NOT EXISTS (SELECT 1 FROM fund WHERE fund_id = NEW.fund_id) THEN
+            INSERT INTO fund (
+                fund_id,
+                one_day,
+                one_week,
+                one_month,
+                three_month,
+                six_month,
+                one_year,
+                lifetime,
+                earliest_date,
+                latest_date,
+                high,
+                low,
+                standard_deviation,
+                value
+            )
+            VALUES (
+                NEW.fund_id,
+                one_day_change(NEW.fund_id),  
+                one_week_change(NEW.fund_id),  
+                one_month_change(NEW.fund_id),  
+                three_month_change(NEW.fund_id),  
+                six_month_change(NEW.fund_id),  
+                one_year_change(NEW.fund_id),  
+                lifetime_change(NEW.fund_id), 
+                earliest_dt,
+                latest_dt,
+                max_value,
+                min_value,
+                fund_std_dev(NEW.fund_id), 
+                NEW.price
+            );
+
+        ELSE
+            UPDATE fund
+            SET 
+                one_day = one_day_change(NEW.fund_id),
+                one_week = one_week_change(NEW.fund_id),
+                one_month = one_month_change(NEW.fund_id),
+                three_month = three_month_change(NEW.fund_id),
+                six_month = six_month_change(NEW.fund_id),
+                one_year = one_year_change(NEW.fund_id),
+                lifetime = lifetime_change(NEW.fund_id),
+                earliest_date = earliest_dt,
+                latest_date = latest_dt,
+                high = max_value,
+                low = min_value,
+                standard_deviation = fund_std_dev(NEW.fund_id),
+                value = NEW.price
+            WHERE fund_id = NEW.fund_id;
+        END IF;
+    END IF;
 END //
 
 CREATE PROCEDURE calculate_fund_rank()
@@ -376,6 +562,26 @@ BEGIN
     CLOSE cur;
 END //
 
+CREATE PROCEDURE calculate_fund_ranks()
+BEGIN
+    UPDATE fund AS f
+    JOIN (
+        SELECT fund.fund_id,
+               ROW_NUMBER() OVER (
+                   ORDER BY fund.one_year DESC, fund.six_month DESC, fund.three_month DESC,
+                            fund.one_month DESC, fund.one_week DESC, fund.one_day DESC, fund.fund_id
+               ) AS overall_rank,
+               ROW_NUMBER() OVER (
+                   PARTITION BY fn.category_id
+                   ORDER BY fund.one_year DESC, fund.six_month DESC, fund.three_month DESC,
+                            fund.one_month DESC, fund.one_week DESC, fund.one_day DESC, fund.fund_id
+               ) AS category_rank
+        FROM fund
+        JOIN fund_name AS fn ON fn.fund_id = fund.fund_id
+    ) AS r ON r.fund_id = f.fund_id
+    SET f.fund_rank = r.overall_rank, f.fund_category_rank = r.category_rank;
+END //
+
 CREATE PROCEDURE update_all_fund_prices()
 BEGIN
     DECLARE done INT DEFAULT FALSE;
@@ -409,7 +615,127 @@ BEGIN
     END LOOP;
 
     CLOSE cur;
-END;
+END //
+
+CREATE PROCEDURE refresh_fund_metrics()
+BEGIN
+    INSERT INTO fund (
+        fund_id,
+        one_day,
+        one_week,
+        one_month,
+        three_month,
+        six_month,
+        one_year,
+        lifetime,
+        earliest_date,
+        latest_date,
+        high,
+        low,
+        standard_deviation,
+        value
+    )
+    WITH history AS (
+        -- Archived years included (see partitions.py)
+        SELECT v.fund_id, v.date, v.price
+        FROM fund_value AS v
+        JOIN fund_refresh AS r ON r.fund_id = v.fund_id
+        UNION ALL
+        SELECT a.fund_id, a.date, a.price
+        FROM fund_value_archive AS a
+        JOIN fund_refresh AS r ON r.fund_id = a.fund_id
+    ),
+    stats AS (
+        SELECT v.fund_id, MIN(v.date) AS earliest_dt, MAX(v.date) AS latest_dt,
+               MAX(v.price) AS high, MIN(v.price) AS low, IFNULL(STDDEV(v.price), 0) AS std_dev
+        FROM history AS v
+        GROUP BY v.fund_id
+    ),
+    prices AS (
+        SELECT v.fund_id, v.date, MIN(v.price) AS price
+        FROM history AS v
+        GROUP BY v.fund_id, v.date
+    ),
+    lookback AS (
+        SELECT p.fund_id,
+               MAX(p.date) AS day_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 7 DAY), p.date, NULL)) AS week_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 1 MONTH), p.date, NULL)) AS month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 3 MONTH), p.date, NULL)) AS three_month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 6 MONTH), p.date, NULL)) AS six_month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 1 YEAR), p.date, NULL)) AS year_dt
+        FROM prices AS p
+        JOIN stats AS s ON s.fund_id = p.fund_id AND p.date < s.latest_dt
+        GROUP BY p.fund_id
+    )
+    SELECT s.fund_id,
+           (l.price - d.price) / NULLIF(d.price, 0) * 100,
+           (l.price - w.price) / NULLIF(w.price, 0) * 100,
+           (l.price - m1.price) / NULLIF(m1.price, 0) * 100,
+           (l.price - m3.price) / NULLIF(m3.price, 0) * 100,
+           (l.price - m6.price) / NULLIF(m6.price, 0) * 100,
+           (l.price - y.price) / NULLIF(y.price, 0) * 100,
+           (l.price - e.price) / NULLIF(e.price, 0) * 100,
+           s.earliest_dt,
+           s.latest_dt,
+           s.high,
+           s.low,
+           s.std_dev,
+           l.price
+    FROM stats AS s
+    JOIN prices AS l ON l.fund_id = s.fund_id AND l.date = s.latest_dt
+    JOIN prices AS e ON e.fund_id = s.fund_id AND e.date = s.earliest_dt
+    LEFT JOIN lookback AS b ON b.fund_id = s.fund_id
+    LEFT JOIN prices AS d ON d.fund_id = s.fund_id AND d.date = b.day_dt
+    LEFT JOIN prices AS w ON w.fund_id = s.fund_id AND w.date = b.week_dt
+    LEFT JOIN prices AS m1 ON m1.fund_id = s.fund_id AND m1.date = b.month_dt
+    LEFT JOIN prices AS m3 ON m3.fund_id = s.fund_id AND m3.date = b.three_month_dt
+    LEFT JOIN prices AS m6 ON m6.fund_id = s.fund_id AND m6.date = b.six_month_dt
+    LEFT JOIN prices AS y ON y.fund_id = s.fund_id AND y.date = b.year_dt
+    ON DUPLICATE KEY UPDATE
+        one_day = VALUES(one_day),
+        one_week = VALUES(one_week),
+        one_month = VALUES(one_month),
+        three_month = VALUES(three_month),
+        six_month = VALUES(six_month),
+        one_year = VALUES(one_year),
+        lifetime = VALUES(lifetime),
+        earliest_date = VALUES(earliest_date),
+        latest_date = VALUES(latest_date),
+        high = VALUES(high),
+        low = VALUES(low),
+        standard_deviation = VALUES(standard_deviation),
+        value = VALUES(value);
+
+    DELETE FROM fund_refresh;
+END //
+
+CREATE PROCEDURE refresh_leaderboards(n INT)
+BEGIN
+    DELETE FROM leaderboard;
+    INSERT INTO leaderboard (period, position, fund_id, company_name, fund_name, value)
+    SELECT period, position, fund_id, company_name, fund_name, ROUND(value, 2)
+    FROM (
+        SELECT v.*, ROW_NUMBER() OVER (PARTITION BY v.period ORDER BY v.value DESC, v.fund_id) AS position
+        FROM (
+            SELECT p.period, fund.fund_id, fc.company_name, fn.fund_name,
+                   CASE p.period
+                       WHEN 'one_year' THEN fund.one_year
+                       WHEN 'six_month' THEN fund.six_month
+                       WHEN 'three_month' THEN fund.three_month
+                       ELSE fund.one_month
+                   END AS value
+            FROM fund
+            JOIN fund_name AS fn ON fn.fund_id = fund.fund_id
+            JOIN fund_company AS fc ON fc.company_id = fn.company_id
+            CROSS JOIN (
+                SELECT 'one_year' AS period UNION ALL SELECT 'six_month'
+                UNION ALL SELECT 'three_month' UNION ALL SELECT 'one_month'
+            ) AS p
+        ) AS v
+    ) AS r
+    WHERE position <= n;
+END //
 
 
 DELIMITER ;
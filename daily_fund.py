@@ -1,141 +1,103 @@
-import requests
-import mysql.connector
+import argparse
 from datetime import datetime
+from amfi import BATCH_SIZE, fetch_lines, parse_batches
+from db import connect
+from instrument import report
+from ingest import (
+    DimensionCache,
+    FundValueLoader,
+    publish,
+    rank_funds,
+    refresh_fund_metrics,
+)
+from report_cache import CACHE_DIR, MAX_BYTES, ReportCache
 
 
 url = "https://portal.amfiindia.com/DownloadNAVHistoryReport_Po.aspx?frmdt=%s"
 
-category_map = {}
-company_map = {}
-fund_map = {}
 
-
-def request_url(url, date):
+def request_url(url, date, cache=None, offline=False):
+    """Return `(digest, lines)` for the day's report, `digest` is None uncached."""
     url = url % (date)
-    response = requests.get(url)
-    return response.text
-
-
-def parse(response):
-    category, company = None, None
-    parsed_data = []
-    lines = response.strip().splitlines()
-    lines = [line.strip() for line in lines if line.strip() != ""]
-    lines = lines[1:]
+    if cache is None:
+        return None, fetch_lines(url)
+    digest = cache.fetch(url, date, date, offline=offline)
+    return digest, cache.lines(digest)
 
-    i = 0
-    while i < len(lines):
-        line = lines[i]
 
-        if len(line.split(";")) == 1:
-            if i + 1 < len(lines) and len(lines[i + 1].split(";")) == 1:
-                category = line
-                company = lines[i + 1]
-                i += 2
-            else:
-                company = line
-                i += 1
-        else:
-            parts = line.split(";")
-            if len(parts) == 8:
-                (
-                    scheme_code,
-                    scheme_name,
-                    isin_div,
-                    isin_reinv,
-                    nav,
-                    repurchase,
-                    sale,
-                    date,
-                ) = parts
-                parsed_data.append(
-                    {
-                        "category": category,
-                        "company": company,
-                        "name": scheme_name,
-                        "value": nav,
-                        "date": date,
-                    }
-                )
-            i += 1
+def insert_data(batches, infile=False, defer=False):
+    connection = connect(allow_local_infile=infile)
+    cache = DimensionCache(connection)
+    loader = FundValueLoader(connection, infile=infile, defer=defer)
 
-    return parsed_data
+    for batch in batches:
+        loader.load(cache.fund_rows(connection, batch))
+    print(loader.summary())
+    if defer:
+        refresh_fund_metrics(connection, defer)
 
+    rank_funds(connection)
+    publish(connection)
+    connection.close()
 
-def insert_data(data):
-    with open(".passwd.txt", "r") as file:
-        passwd = file.read().strip()
 
-    connection = mysql.connector.connect(
-        host="bar0n.live", user="fund", password=passwd, database="fund"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load today's NAVs")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--infile",
+        action="store_true",
+        help="load chunks with LOAD DATA LOCAL INFILE",
     )
-    cursor = connection.cursor(buffered=True)
-
-    for line in data:
-        category, company, name, value, date = (
-            line["category"],
-            line["company"],
-            line["name"],
-            line["value"],
-            line["date"],
-        )
-        name = name.replace("'", "")
-        date = datetime.strptime(date.strip(), "%d-%b-%Y")
-        date = date.strftime("%Y-%m-%d %H:%M:%S")
-
-        if category not in category_map:
-            cursor.execute(
-                f"SELECT category_id FROM fund_category WHERE category_name = '{category}'"
-            )
-            if cursor.rowcount <= 0:
-                cursor.execute(
-                    f"INSERT INTO fund_category (category_name) VALUES ('{category}')"
-                )
-                connection.commit()
-                cursor.execute(
-                    f"SELECT category_id FROM fund_category WHERE category_name = '{category}'"
-                )
-            category_map[category] = cursor.fetchone()[0]
-        category_id = category_map[category]
-
-        if company not in company_map:
-            cursor.execute(
-                f"SELECT company_id FROM fund_company WHERE company_name = '{company}'"
+    parser.add_argument(
+        "--defer-metrics",
+        nargs="?",
+        const="sql",
+        choices=["sql", "numpy", "state"],
+        help="skip the per-row fund trigger and recompute funds once at the end",
+    )
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=MAX_BYTES >> 20,
+        help="evict least recently used reports beyond this size",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="always download, keep nothing"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="only use the cached report"
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="do nothing if the report is identical to the last one ingested",
+    )
+    parser.add_argument("--date", help="report date, default today, e.g. 01-Jan-2024")
+    parser.add_argument("--report", help="write the run summary as JSON to this file")
+    parser.add_argument(
+        "--prometheus", help="write the run summary as a Prometheus textfile"
+    )
+    args = parser.parse_args()
+
+    report_cache = None
+    if not args.no_cache:
+        report_cache = ReportCache(args.cache_dir, args.cache_max_mb << 20)
+
+    date = args.date or datetime.now().strftime("%d-%b-%Y")
+    try:
+        digest, lines = request_url(url, date, report_cache, args.offline)
+        unchanged = digest and report_cache.is_ingested(date, date, digest)
+        if args.skip_unchanged and unchanged:
+            print(f"Report for {date} unchanged since last ingest, nothing to do.")
+        else:
+            insert_data(
+                parse_batches(lines, args.batch_size),
+                infile=args.infile,
+                defer=args.defer_metrics,
             )
-            if cursor.rowcount <= 0:
-                cursor.execute(
-                    f"INSERT INTO fund_company (company_name) VALUES ('{company}')"
-                )
-                connection.commit()
-                cursor.execute(
-                    f"SELECT company_id FROM fund_company WHERE company_name = '{company}'"
-                )
-            company_map[company] = cursor.fetchone()[0]
-        company_id = company_map[company]
-
-        if name not in fund_map:
-            cursor.execute(f"SELECT fund_id FROM fund_name WHERE fund_name = '{name}'")
-            if cursor.rowcount <= 0:
-                cursor.execute(
-                    f"INSERT INTO fund_name (fund_name, company_id, category_id) VALUES ('{name}', '{company_id}', '{category_id}')"
-                )
-                connection.commit()
-                cursor.execute(
-                    f"SELECT fund_id FROM fund_name WHERE fund_name = '{name}'"
-                )
-            fund_map[name] = cursor.fetchone()[0]
-        fund_id = fund_map[name]
-
-        cursor.execute(
-            f"INSERT IGNORE INTO fund_value (fund_id, price, date) VALUES ('{fund_id}', '{value}', '{date}')"
-        )
-        connection.commit()
-
-    cursor.execute("call calculate_fund_rank;")
-    cursor.execute("call calculate_fund_category_rank;")
-    cursor.close()
-    connection.close()
-
-
-date = datetime.now().strftime("%d-%b-%Y")
-insert_data(parse(request_url(url, date)))
+            if report_cache is not None:
+                report_cache.mark_ingested(date, date, digest)
+    finally:
+        report.finish("daily_fund", args.report, args.prometheus)
@@ -0,0 +1,66 @@
+"""Data version cache for app.py
+
+    * The ingesters bump the single row of `data_version` at the end of
+      every run (see `ingest.publish`). Each worker reads it at most once
+      every `ttl` seconds, so a new version is picked up within `ttl`
+      seconds of the ingest committing.
+    * `cached(name, build)` returns what `build(connection)` returned for
+      the current version. It is built once per version and worker, by
+      the first request that needs it, and then served without touching
+      the database.
+"""
+
+import threading
+from time import monotonic
+
+VERSION_TTL = 5
+
+
+class DataVersion:
+    def __init__(self, pool, ttl=VERSION_TTL):
+        self.pool = pool
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.checked = None
+        self.current = None  # (version, updated_on)
+        self.values = {}  # name -> (version, value)
+        self.builds = {}  # name -> lock
+
+    def get(self):
+        """Return `(version, updated_on)`."""
+        if self.checked is None or monotonic() - self.checked > self.ttl:
+            with self.lock:
+                if self.checked is None or monotonic() - self.checked > self.ttl:
+                    with self.pool.connection() as conn:
+                        cur = conn.cursor()
+                        try:
+                            cur.execute(
+                                "SELECT version, updated_on FROM data_version "
+                                "WHERE id = 1;"
+                            )
+                            self.current = cur.fetchone()
+                        finally:
+                            cur.close()
+                    self.checked = monotonic()
+        return self.current
+
+    def last(self, name):
+        """Return the value last built for `name`, of any version, or None."""
+        entry = self.values.get(name)
+        return None if entry is None else entry[1]
+
+    def cached(self, name, build):
+        version = self.get()[0]
+        entry = self.values.get(name)
+        if entry is not None and entry[0] >= version:
+            return entry[1]
+        with self.lock:
+            build_lock = self.builds.setdefault(name, threading.Lock())
+        # Concurrent requests wait for one build instead of all building
+        with build_lock:
+            entry = self.values.get(name)
+            if entry is None or entry[0] < version:
+                with self.pool.connection() as conn:
+                    entry = (version, build(conn))
+                self.values[name] = entry
+        return entry[1]
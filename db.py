@@ -0,0 +1,32 @@
+import mysql.connector
+
+from instrument import CountingConnection
+
+
+def options(**kwargs):
+    options = {"host": "bar0n.live", "user": "fund", "database": "fund", **kwargs}
+    if "password" not in options:
+        with open(".passwd.txt", "r") as file:
+            options["password"] = file.read().strip()
+    return options
+
+
+def connect(**kwargs):
+    return CountingConnection(mysql.connector.connect(**options(**kwargs)))
+
+
+# `fund_value` and the years `partitions.py archive` moved out of it
+HISTORY_TABLES = ("fund_value", "fund_value_archive")
+
+
+def history_query(columns, where=""):
+    """Return a query for `columns` of every NAV, archived or not.
+
+    Unlike the `fund_value_history` view, `where` is applied to each table
+    so it can use their primary keys. Its parameters are needed once per
+    table, and the result can be followed by ORDER BY and LIMIT.
+    """
+    return " UNION ALL ".join(
+        f"(SELECT {columns} FROM {table} {where}".rstrip() + ")"
+        for table in HISTORY_TABLES
+    )
@@ -11,13 +11,15 @@ import {
 const FundGraph = ({ graphData }) => {
   if (!graphData) return null;
 
-  const reversedHistory = [...graphData.history].reverse();
-  const trendIsPositive =
-    reversedHistory[0][1] < reversedHistory[reversedHistory.length - 1][1];
+  const { start, days, prices } = graphData;
+  if (!days.length) return null;
+  const trendIsPositive = prices[0] < prices[prices.length - 1];
 
-  const data = reversedHistory.map(([date, value]) => ({
-    date,
-    value: Number(value.toFixed(2)),
+  // Dates are sent as day offsets from `start`
+  const startTime = new Date(`${start}T00:00:00Z`).getTime();
+  const data = days.map((offset, i) => ({
+    date: new Date(startTime + offset * 86400000).toISOString().slice(0, 10),
+    value: Number(prices[i].toFixed(2)),
   }));
 
   const lineColor = trendIsPositive ? "rgb(0,178,135)" : "rgb(240,125,100)";
@@ -40,7 +40,7 @@ export default function FundScreen() {
     const fetchGraphData = async () => {
       try {
         const response = await axios.get(
-          `http://localhost:5000/fund/graph_data?f_id=${fundId}`
+          `http://localhost:5000/fund/graph_data?f_id=${fundId}&format=columns`
         );
         setGraphData(response.data);
       } catch (error) {
@@ -0,0 +1,228 @@
+"""Running per-fund state
+
+    * `fund_state` holds count, mean and M2 (Welford) plus high, low,
+      earliest/latest date and the earliest/latest price for every fund,
+      over its whole history including archived years (see partitions.py).
+    * `track` folds each newly loaded NAV into the state in constant
+      time. A NAV that is not newer than the fund's latest date cannot
+      be folded in order, so the fund is flagged `stale` and rebuilt
+      from history later by `rebuild`.
+    * `track` locks the funds' rows until the chunk commits, so writers
+      loading the same fund at once apply their NAVs one after the
+      other instead of overwriting each other's state.
+    * `refresh_funds` derives `standard_deviation`, `high`, `low`,
+      `value` and the date bounds of `fund` from the state.
+
+    e.g. python fund_state.py rebuild
+"""
+
+import argparse
+
+from amfi import batched
+from db import connect, history_query
+
+STATE_COLUMNS = [
+    "n",
+    "mean",
+    "m2",
+    "high",
+    "low",
+    "earliest_date",
+    "latest_date",
+    "latest_price",
+    "earliest_price",
+    "stale",
+]
+
+LOOKUP_CHUNK = 1000
+
+
+def load(cursor, fund_ids):
+    """Return `{fund_id: state}`, locking the rows until the transaction ends."""
+    states = {}
+    for chunk in batched(sorted(fund_ids), LOOKUP_CHUNK):
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(
+            f"SELECT fund_id, {', '.join(STATE_COLUMNS)} FROM fund_state "
+            f"WHERE fund_id IN ({placeholders}) FOR UPDATE;",
+            tuple(chunk),
+        )
+        for fund_id, *state in cursor.fetchall():
+            states[fund_id] = state
+    return states
+
+
+def track(cursor, rows):
+    """Fold `(fund_id, price, date)` rows into `fund_state`.
+
+    Runs on the loader's cursor so the state commits together with the
+    `fund_value` chunk.
+    """
+    fund_ids = sorted({fund_id for fund_id, _, _ in rows})
+    # A row for every fund, even a new one, so there is a row to lock
+    cursor.executemany(
+        "INSERT IGNORE INTO fund_state (fund_id, n, mean, m2) VALUES (%s, 0, 0, 0)",
+        [(fund_id,) for fund_id in fund_ids],
+    )
+    states = load(cursor, fund_ids)
+    changed = {}
+    for fund_id, price, date in sorted(rows, key=lambda row: row[2]):
+        state = states.get(fund_id)
+        if state is None or state[0] == 0:
+            state = states[fund_id] = [
+                1,
+                price,
+                0.0,
+                price,
+                price,
+                date,
+                date,
+                price,
+                price,
+                0,
+            ]
+        else:
+            n, mean, m2, high, low, earliest, latest, latest_price = state[:8]
+            first_price, stale = state[8:]
+            if stale:
+                continue
+            if date > latest:
+                n += 1
+                delta = price - mean
+                mean += delta / n
+                m2 += delta * (price - mean)
+                state[:] = [
+                    n,
+                    mean,
+                    m2,
+                    max(high, price),
+                    min(low, price),
+                    earliest,
+                    date,
+                    price,
+                    first_price,
+                    0,
+                ]
+            elif date == latest and price == latest_price:
+                # Same NAV again, dropped by INSERT IGNORE on (fund_id, date)
+                continue
+            else:
+                state[-1] = 1
+        changed[fund_id] = state
+
+    if not changed:
+        return
+    placeholders = ", ".join(["%s"] * (len(STATE_COLUMNS) + 1))
+    updates = ", ".join(f"{col} = VALUES({col})" for col in STATE_COLUMNS)
+    cursor.executemany(
+        f"INSERT INTO fund_state (fund_id, {', '.join(STATE_COLUMNS)}) "
+        f"VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {updates}",
+        [(fund_id, *state) for fund_id, state in changed.items()],
+    )
+
+
+def rebuild(connection, fund_ids=None, stale_only=False):
+    """Regenerate `fund_state` from `fund_value` and `fund_value_archive`.
+
+    Rebuilds `fund_ids`, the stale funds with `stale_only`, or every fund.
+    """
+    query = (
+        f"INSERT INTO fund_state (fund_id, {', '.join(STATE_COLUMNS)}) "
+        "SELECT v.fund_id, COUNT(v.price), IFNULL(AVG(v.price), 0), "
+        "IFNULL(VAR_POP(v.price) * COUNT(v.price), 0), MAX(v.price), MIN(v.price), "
+        "MIN(v.date), MAX(v.date), ANY_VALUE(v.latest_price), "
+        "ANY_VALUE(v.earliest_price), FALSE "
+        "FROM (SELECT h.fund_id, h.date, h.price, "
+        "FIRST_VALUE(h.price) OVER (PARTITION BY h.fund_id ORDER BY h.date DESC) "
+        "AS latest_price, "
+        "FIRST_VALUE(h.price) OVER (PARTITION BY h.fund_id ORDER BY h.date) "
+        "AS earliest_price "
+        "FROM ({history}) AS h) AS v GROUP BY v.fund_id "
+        "ON DUPLICATE KEY UPDATE "
+        + ", ".join(f"{col} = VALUES({col})" for col in STATE_COLUMNS)
+    )
+    cursor = connection.cursor()
+    try:
+        if fund_ids is not None:
+            for chunk in batched(sorted(fund_ids), LOOKUP_CHUNK):
+                placeholders = ", ".join(["%s"] * len(chunk))
+                where = f"WHERE fund_id IN ({placeholders})"
+                cursor.execute(
+                    query.format(history=history_query("fund_id, date, price", where)),
+                    tuple(chunk) * 2,
+                )
+        elif stale_only:
+            where = "WHERE fund_id IN (SELECT fund_id FROM fund_state WHERE stale)"
+            cursor.execute(
+                query.format(history=history_query("fund_id, date, price", where))
+            )
+        else:
+            cursor.execute(query.format(history=history_query("fund_id, date, price")))
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+def refresh_funds(connection):
+    """Update `fund` from `fund_state` for every fund queued in `fund_refresh`.
+
+    Period returns still come from the stored functions, everything that
+    needs the whole history comes from the state. Only the funds that were
+    refreshed are taken off the queue.
+    """
+    rebuild(connection, stale_only=True)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT r.fund_id FROM fund_refresh AS r "
+            "JOIN fund_state AS s ON s.fund_id = r.fund_id;"
+        )
+        fund_ids = [fund_id for fund_id, in cursor.fetchall()]
+        for chunk in batched(fund_ids, LOOKUP_CHUNK):
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                "INSERT INTO fund (fund_id, one_day, one_week, one_month, three_month, "
+                "six_month, one_year, lifetime, earliest_date, latest_date, high, low, "
+                "standard_deviation, value) "
+                "SELECT s.fund_id, one_day_change(s.fund_id), "
+                "one_week_change(s.fund_id), one_month_change(s.fund_id), "
+                "three_month_change(s.fund_id), six_month_change(s.fund_id), "
+                "one_year_change(s.fund_id), "
+                "(s.latest_price - s.earliest_price) / "
+                "NULLIF(s.earliest_price, 0) * 100, "
+                "s.earliest_date, s.latest_date, s.high, s.low, "
+                "IF(s.n > 0, SQRT(s.m2 / s.n), 0), s.latest_price "
+                f"FROM fund_state AS s WHERE s.fund_id IN ({placeholders}) "
+                "ON DUPLICATE KEY UPDATE one_day = VALUES(one_day), "
+                "one_week = VALUES(one_week), one_month = VALUES(one_month), "
+                "three_month = VALUES(three_month), six_month = VALUES(six_month), "
+                "one_year = VALUES(one_year), lifetime = VALUES(lifetime), "
+                "earliest_date = VALUES(earliest_date), "
+                "latest_date = VALUES(latest_date), high = VALUES(high), "
+                "low = VALUES(low), standard_deviation = VALUES(standard_deviation), "
+                "value = VALUES(value);",
+                tuple(chunk),
+            )
+            cursor.execute(
+                f"DELETE FROM fund_refresh WHERE fund_id IN ({placeholders});",
+                tuple(chunk),
+            )
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the fund_state table")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("fund_ids", nargs="*", type=int, help="default: all funds")
+    parser.add_argument(
+        "--stale", action="store_true", help="only rebuild funds flagged stale"
+    )
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        rebuild(connection, args.fund_ids or None, stale_only=args.stale)
+    finally:
+        connection.close()
@@ -1,19 +1,28 @@
-import requests
-import mysql.connector
 from dateutil.relativedelta import relativedelta
 from datetime import datetime
-from collections import defaultdict
-import json
-import sys
+import argparse
+import tempfile
 import threading
-from queue import Queue
+from time import perf_counter
+from queue import Empty, Queue
 import logging
+from amfi import BATCH_SIZE, parse_batches
+from backfill_ledger import BackfillLedger, month_date
+from db import connect
+from instrument import report
+from ingest import (
+    DimensionCache,
+    FundValueLoader,
+    load_summary,
+    publish,
+    refresh_fund_metrics,
+)
+from report_cache import CACHE_DIR, MAX_BYTES, ReportCache, read_lines, spool
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
 logger = logging.getLogger()
 
 url = "https://portal.amfiindia.com/DownloadNAVHistoryReport_Po.aspx?frmdt=%s&todt=%s"
-data_queue = Queue()
 
 
 def one_month_later_or_latest(date_str):
@@ -25,207 +34,366 @@ def one_month_later_or_latest(date_str):
     return result_date.strftime("%d-%b-%Y")
 
 
-def request_url(url, date):
-    url = url % (date, one_month_later_or_latest(date))
-    response = requests.get(url)
-    return response.text
-
-
-def parse(response):
-    category, company = None, None
-    parsed_data = []
-    lines = response.strip().splitlines()
-    lines = [line.strip() for line in lines if line.strip() != ""]
-    lines = lines[1:]
-
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-
-        if len(line.split(";")) == 1:
-            if i + 1 < len(lines) and len(lines[i + 1].split(";")) == 1:
-                category = line
-                company = lines[i + 1]
-                i += 2
-            else:
-                company = line
-                i += 1
-        else:
-            parts = line.split(";")
-            if len(parts) == 8:
-                (
-                    scheme_code,
-                    scheme_name,
-                    isin_div,
-                    isin_reinv,
-                    nav,
-                    repurchase,
-                    sale,
-                    date,
-                ) = parts
-                parsed_data.append(
-                    {
-                        "category": category,
-                        "company": company,
-                        "name": scheme_name,
-                        "value": nav,
-                        "date": date,
-                    }
-                )
-            i += 1
-
-    return parsed_data
-
-
-def batch_insert_data(data):
-    with open(".passwd.txt", "r") as file:
-        passwd = file.read().strip()
-
-    connection = mysql.connector.connect(
-        host="bar0n.live", user="fund", password=passwd, database="fund"
-    )
-    cursor = connection.cursor(buffered=True)
-
-    category_map = {}
-    company_map = {}
-    fund_map = {}
-
-    batch_data = []
-    for line in data:
-        print("Processed: ", data.index(line) + 1, "of", len(data), end="\r")
-        category, company, name, value, date = (
-            line["category"],
-            line["company"],
-            line["name"],
-            line["value"],
-            line["date"],
-        )
-        name = name.replace("'", "")
-        date = datetime.strptime(date.strip(), "%d-%b-%Y")
-        date = date.strftime("%Y-%m-%d %H:%M:%S")
-
-        if name not in fund_map:
-            try:
-                cursor.execute(
-                    f"SELECT fund_id FROM fund_name WHERE fund_name = '{name}'"
-                )
-            except mysql.connector.Error as err:
-                logger.error(f"Error checking fund {name}: {err}")
+def month_range(spec):
+    """`frmdt` is the month starting at frmdt, `frmdt:todt` an explicit range."""
+    frmdt, _, todt = spec.partition(":")
+    return frmdt, todt or one_month_later_or_latest(frmdt)
+
+
+def request_url(url, date, cache=None, offline=False, todt=None):
+    """Return `(todt, digest, lines)` for the month starting at `date`.
+
+    Without a cache the report is spooled to a temporary file, removed once
+    its lines have been read, and `digest` is the hash `ReportCache` gives it.
+    """
+    todt = todt or one_month_later_or_latest(date)
+    url = url % (date, todt)
+    if cache is None:
+        file = tempfile.TemporaryFile(suffix=".gz")
+        try:
+            with report.span("download"):
+                digest = spool(url, file)
+            file.seek(0)
+        except BaseException:
+            file.close()
+            raise
+        return todt, digest, spooled_lines(file)
+    digest = cache.fetch(url, date, todt, offline=offline)
+    return todt, digest, cache.lines(digest)
+
+
+def spooled_lines(file):
+    with file:
+        yield from read_lines(file)
+
+
+"""Backfill pipeline
+
+    * `downloaders` threads fetch whole monthly reports into `report_queue`,
+      through the `ReportCache` when one is given. With `skip_unchanged`
+      a month whose report hash was already ingested goes no further.
+    * `parsers` threads turn reports into record batches on `batch_queue`.
+    * `writers` threads insert batches, each over its own DB connection,
+      sharing one `DimensionCache` loaded up front.
+
+    Both queues are bounded by `queue_size`, so a slow stage blocks the
+    one feeding it instead of piling reports up in memory.
+
+    `MonthProgress` counts each month's batches through the writers and
+    calls back once every batch of a cleanly parsed month has committed.
+
+    A writer that cannot load a batch, or has no connection at all, marks
+    the batch's month failed and goes on draining `batch_queue`, so the
+    stages before it never block on a queue nobody empties.
+
+    Every month's progress is recorded in the `BackfillLedger`. With
+    `resume`, months already complete are not fetched again and chunks
+    that committed before a crash are not loaded again.
+"""
+
+
+class MonthProgress:
+    def __init__(self, on_complete, on_failed):
+        self.lock = threading.Lock()
+        self.on_complete = on_complete
+        self.on_failed = on_failed
+        self.months = {}
+
+    def start(self, month, todt, digest):
+        with self.lock:
+            self.months[month] = {
+                "todt": todt,
+                "digest": digest,
+                "batches": 0,
+                "written": 0,
+                "parsed": False,
+                "failed": False,
+            }
+
+    def add_batch(self, month):
+        with self.lock:
+            self.months[month]["batches"] += 1
+
+    def parsed(self, month, ok=True):
+        self.update(month, parsed=True, failed=not ok)
+
+    def written(self, month, ok=True):
+        self.update(month, written=1, failed=not ok)
+
+    def update(self, month, parsed=False, written=0, failed=False):
+        with self.lock:
+            state = self.months[month]
+            newly_failed = failed and not state["failed"]
+            state["parsed"] = state["parsed"] or parsed
+            state["written"] += written
+            state["failed"] = state["failed"] or failed
+            done = (
+                state["parsed"]
+                and not state["failed"]
+                and state["written"] == state["batches"]
+            )
+        # The callbacks write to the ledger, an error there must not take
+        # down the pipeline thread reporting progress
+        try:
+            if done:
+                self.on_complete(month, state)
+            elif newly_failed:
+                self.on_failed(month, state)
+        except Exception as e:
+            logger.error(f"Error recording progress of month {month}: {e}")
+
+
+def download(month_queue, report_queue, progress, ledger, options):
+    cache = options["cache"]
+    while True:
+        try:
+            month, todt = month_queue.get_nowait()
+        except Empty:
+            return
+        try:
+            todt, digest, lines = request_url(
+                url, month, cache, options["offline"], todt
+            )
+            if options["skip_unchanged"] and cache.is_ingested(month, todt, digest):
+                logger.info(f"Month {month} unchanged since last ingest, skipped.")
                 continue
-
-            if cursor.rowcount <= 0:
-                if company not in company_map:
-                    cursor.execute(
-                        f"SELECT company_id FROM fund_company WHERE company_name = '{company}'"
-                    )
-                    if cursor.rowcount <= 0:
-                        cursor.execute(
-                            f"INSERT INTO fund_company (company_name) VALUES ('{company}')"
-                        )
-                        connection.commit()
-                        cursor.execute(
-                            f"SELECT company_id FROM fund_company WHERE company_name = '{company}'"
-                        )
-                    company_id = cursor.fetchone()[0]
-                    company_map[company] = company_id
-                else:
-                    company_id = company_map[company]
-
-                if category not in category_map:
-                    cursor.execute(
-                        f"SELECT category_id FROM fund_category WHERE category_name = '{category}'"
-                    )
-                    if cursor.rowcount <= 0:
-                        cursor.execute(
-                            f"INSERT INTO fund_category (category_name) VALUES ('{category}')"
-                        )
-                        connection.commit()
-                        cursor.execute(
-                            f"SELECT category_id FROM fund_category WHERE category_name = '{category}'"
-                        )
-                    category_id = cursor.fetchone()[0]
-                    category_map[category] = category_id
-                else:
-                    category_id = category_map[category]
-
-                cursor.execute(
-                    f"INSERT INTO fund_name (fund_name, company_id, category_id) VALUES ('{name}', '{company_id}', '{category_id}')"
-                )
-                connection.commit()
-                cursor.execute(
-                    f"SELECT fund_id FROM fund_name WHERE fund_name = '{name}'"
+            done = ledger.fetched(
+                month, todt, digest, options["batch_size"], options["resume"]
+            )
+            logger.info(f"Month {month} downloaded.")
+            if done:
+                logger.info(f"Month {month}: resuming, {len(done)} chunks already loaded.")
+            progress.start(month, todt, digest)
+            report_queue.put((month, lines, done))
+        except Exception as e:
+            logger.error(f"Error downloading month {month}: {e}")
+
+
+def parse_reports(report_queue, batch_queue, batch_size, progress, ledger):
+    while True:
+        item = report_queue.get()
+        if item is None:
+            return
+        month, lines, done = item
+        total, chunks = 0, 0
+        try:
+            for chunk, batch in enumerate(parse_batches(lines, batch_size)):
+                chunks += 1
+                total += len(batch)
+                if chunk in done:
+                    continue
+                progress.add_batch(month)
+                batch_queue.put((month, chunk, batch))
+            logger.info(f"Month {month} parsed, {total} records.")
+            ledger.parsed(month, total, chunks)
+            progress.parsed(month)
+        except Exception as e:
+            logger.error(f"Error parsing month {month}: {e}")
+            progress.parsed(month, ok=False)
+
+
+def write_batches(batch_queue, cache, loader_list, progress, options):
+    connection = loader = None
+    try:
+        connection = connect(allow_local_infile=options["infile"])
+        loader = FundValueLoader(connection, **options)
+        loader_list.append(loader)
+    except Exception as e:
+        logger.error(f"Writer could not connect, failing its batches: {e}")
+    try:
+        while True:
+            item = batch_queue.get()
+            if item is None:
+                return
+            month, chunk, batch = item
+            if loader is None:
+                progress.written(month, ok=False)
+                continue
+            try:
+                count = loader.load(
+                    cache.fund_rows(connection, batch),
+                    checkpoint=BackfillLedger.checkpoint(month, chunk),
                 )
-            fund_id = cursor.fetchone()[0]
-            fund_map[name] = fund_id
-        else:
-            fund_id = fund_map[name]
-        batch_data.append((fund_id, value, date))
-
+                logger.info(f"Month {month}: inserted batch of {count} records.")
+                progress.written(month)
+            except Exception as e:
+                logger.error(f"Error during batch insert for month {month}: {e}")
+                progress.written(month, ok=False)
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+def run_pipeline(
+    months,
+    downloaders=4,
+    parsers=2,
+    writers=2,
+    queue_size=8,
+    batch_size=BATCH_SIZE,
+    infile=False,
+    defer=False,
+    report_cache=None,
+    offline=False,
+    skip_unchanged=False,
+    resume=False,
+):
+    start_time = perf_counter()
+    ledger = BackfillLedger(connect())
+    complete = ledger.complete_months() if resume else set()
+    month_queue = Queue()
+    for month, todt in map(month_range, months):
+        if (month_date(month), month_date(todt)) in complete:
+            logger.info(f"Month {month} already complete, skipped.")
+            continue
+        month_queue.put((month, todt))
+    report_queue = Queue(maxsize=queue_size)
+    batch_queue = Queue(maxsize=queue_size)
+
+    connection = connect()
     try:
-        cursor.executemany(
-            f"INSERT IGNORE INTO fund_value (fund_id, price, date) VALUES (%s, %s, %s)",
-            batch_data,
-        )
-        print(batch_data)
-        connection.commit()
-        logger.info(f"Batch insert completed for {len(batch_data)} records.")
-    except mysql.connector.Error as err:
-        logger.error(f"Error during batch insert: {err}")
+        cache = DimensionCache(connection)
     finally:
-        cursor.close()
         connection.close()
 
+    def start(n, target, *args):
+        threads = [threading.Thread(target=target, args=args) for _ in range(n)]
+        for t in threads:
+            t.start()
+        return threads
+
+    def month_complete(month, state):
+        ledger.complete(month)
+        if report_cache is not None:
+            report_cache.mark_ingested(month, state["todt"], state["digest"])
+        logger.info(f"Month {month} complete.")
+
+    def month_failed(month, state):
+        ledger.failed(month)
+
+    progress = MonthProgress(month_complete, month_failed)
+    fetch_options = {
+        "cache": report_cache,
+        "offline": offline,
+        "skip_unchanged": skip_unchanged and report_cache is not None,
+        "batch_size": batch_size,
+        "resume": resume,
+    }
+    download_threads = start(
+        downloaders, download, month_queue, report_queue, progress, ledger, fetch_options
+    )
+    parse_threads = start(
+        parsers, parse_reports, report_queue, batch_queue, batch_size, progress, ledger
+    )
+    loaders = []
+    options = {"infile": infile, "defer": defer}
+    write_threads = start(
+        writers, write_batches, batch_queue, cache, loaders, progress, options
+    )
 
-# def process_month(month):
-#     try:
-#         response = request_url(url, month)
-#         parsed_data = parse(response)
-#         logger.info(f"Month {month} processed successfully.")
-#         data_queue.put(parsed_data)
-#     except Exception as e:
-#         logger.error(f"Error processing month {month}: {e}")
-
-
-# def worker():
-#     while True:
-#         data = data_queue.get()
-#         if data is None:
-#             break
-#         batch_insert_data(data)
-#         data_queue.task_done()
-
-
-# if __name__ == "__main__":
-#     months = sys.argv[1:]
-
-#     threads = []
-#     for month in months:
-#         t = threading.Thread(target=process_month, args=(month,))
-#         threads.append(t)
-#         t.start()
-
-#     for t in threads:
-#         t.join()
-
-#     num_workers = 4
-#     workers = []
-#     for _ in range(num_workers):
-#         worker_thread = threading.Thread(target=worker)
-#         workers.append(worker_thread)
-#         worker_thread.start()
-
-#     data_queue.join()
-
-#     for _ in range(num_workers):
-#         data_queue.put(None)
+    # Shut stages down in order, each one once its producers are done
+    for t in download_threads:
+        t.join()
+    for _ in parse_threads:
+        report_queue.put(None)
+    for t in parse_threads:
+        t.join()
+    for _ in write_threads:
+        batch_queue.put(None)
+    for t in write_threads:
+        t.join()
+    ledger.connection.close()
+
+    logger.info("Data processing and insertion complete.")
+    logger.info(
+        load_summary(
+            sum(loader.rows for loader in loaders),
+            sum(loader.inserted for loader in loaders),
+            perf_counter() - start_time,
+        )
+    )
 
-#     for worker_thread in workers:
-#         worker_thread.join()
+    connection = connect()
+    try:
+        if defer:
+            refresh_fund_metrics(connection, defer)
+            logger.info("Fund metrics refreshed.")
+        publish(connection)
+    finally:
+        connection.close()
 
-#     logger.info("Data processing and insertion complete.")
 
 if __name__ == "__main__":
-    months = sys.argv[1:]
-    for month in months:
-        batch_insert_data(parse(request_url(url, month)))
+    parser = argparse.ArgumentParser(description="Backfill NAV history by month")
+    parser.add_argument(
+        "months",
+        nargs="+",
+        help="start dates, e.g. 01-Jan-2024, or ranges, e.g. 01-Jan-2024:15-Jan-2024",
+    )
+    parser.add_argument("--downloaders", type=int, default=4)
+    parser.add_argument("--parsers", type=int, default=2)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--infile",
+        action="store_true",
+        help="load chunks with LOAD DATA LOCAL INFILE",
+    )
+    parser.add_argument(
+        "--defer-metrics",
+        nargs="?",
+        const="sql",
+        choices=["sql", "numpy", "state"],
+        help="skip the per-row fund trigger and recompute funds once at the end",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip complete months and chunks committed by an earlier run",
+    )
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=MAX_BYTES >> 20,
+        help="evict least recently used reports beyond this size",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="always download, keep nothing"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="only use reports already cached"
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="skip months whose report is identical to the last one ingested",
+    )
+    parser.add_argument("--report", help="write the run summary as JSON to this file")
+    parser.add_argument(
+        "--prometheus", help="write the run summary as a Prometheus textfile"
+    )
+    args = parser.parse_args()
+
+    report_cache = None
+    if not args.no_cache:
+        report_cache = ReportCache(args.cache_dir, args.cache_max_mb << 20)
 
+    try:
+        run_pipeline(
+            args.months,
+            downloaders=args.downloaders,
+            parsers=args.parsers,
+            writers=args.writers,
+            queue_size=args.queue_size,
+            batch_size=args.batch_size,
+            infile=args.infile,
+            defer=args.defer_metrics,
+            report_cache=report_cache,
+            offline=args.offline,
+            skip_unchanged=args.skip_unchanged,
+            resume=args.resume,
+        )
+    finally:
+        report.finish("get_funds", args.report, args.prometheus, log=logger.info)
@@ -0,0 +1,57 @@
+"""Fund price history for /fund/graph_data
+
+    * `lttb` downsamples a series with Largest-Triangle-Three-Buckets:
+      the first and last points are kept and, from each of the buckets
+      in between, the point forming the largest triangle with the point
+      kept before it and the average of the next bucket. Peaks and
+      troughs survive, unlike with every n-th point.
+    * `columns` encodes a series as day offsets from its first date and
+      prices, instead of a `[date, price]` pair per point.
+"""
+
+from datetime import date
+
+import numpy as np
+
+# NAVs are published with 4 decimals
+PRICE_DECIMALS = 4
+
+
+def lttb(x, y, points):
+    """Return the indices of the `points` points of `(x, y)` to keep."""
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1][:points])
+
+    keep = np.empty(points, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    # points - 2 buckets over the points between the first and the last
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def columns(days, prices):
+    """Return `{"start", "days", "prices"}` for ascending day ordinals and prices."""
+    if len(days) == 0:
+        return {"start": None, "days": [], "prices": []}
+    return {
+        "start": date.fromordinal(int(days[0])).isoformat(),
+        "days": (days - days[0]).tolist(),
+        "prices": np.round(prices, PRICE_DECIMALS).tolist(),
+    }
@@ -0,0 +1,140 @@
+"""Bulk import of saved AMFI reports
+
+    * Every `.txt` or `.gz` file in the directory is one NAV history
+      report as downloaded from AMFI.
+    * Files are parsed in parallel by a pool of `processes`, at most
+      `2 * processes` files are parsed ahead of the writer.
+    * A single writer loads the batches in file name order with a
+      `DimensionCache` and a `FundValueLoader`, so older reports should
+      sort first to keep `fund_state` in order.
+
+    e.g. python import_reports.py archive/ --processes 8 --defer-metrics numpy
+"""
+
+import argparse
+import gzip
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from amfi import BATCH_SIZE, parse_batches
+from db import connect
+from instrument import report
+from ingest import DimensionCache, FundValueLoader, publish, refresh_fund_metrics
+
+
+def report_files(directory):
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.endswith((".txt", ".gz"))
+    ]
+
+
+def read_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as file:
+        for line in file:
+            yield line.rstrip("\n")
+
+
+def parse_file(path, batch_size):
+    # Runs in a worker process, whose counters are sent back with the batches
+    before = dict(report.counters)
+    start = perf_counter()
+    batches = list(parse_batches(read_lines(path), batch_size))
+    elapsed = perf_counter() - start
+    counters = {
+        name: n - before.get(name, 0) for name, n in report.counters.items()
+    }
+    return batches, elapsed, counters
+
+
+def import_reports(
+    directory,
+    processes=os.cpu_count(),
+    batch_size=BATCH_SIZE,
+    infile=False,
+    defer=False,
+):
+    start = perf_counter()
+    files = report_files(directory)
+    connection = connect(allow_local_infile=infile)
+    cache = DimensionCache(connection)
+    loader = FundValueLoader(connection, infile=infile, defer=defer)
+    parse_time = 0.0
+    size = sum(os.path.getsize(path) for path in files)
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            pending = deque()
+            paths = iter(files)
+            for path in paths:
+                pending.append((path, pool.submit(parse_file, path, batch_size)))
+                if len(pending) >= 2 * processes:
+                    break
+            while pending:
+                path, future = pending.popleft()
+                batches, elapsed, counters = future.result()
+                parse_time += elapsed
+                report.add_time("parse", elapsed)
+                for name, n in counters.items():
+                    report.count(name, n)
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append(
+                        (next_path, pool.submit(parse_file, next_path, batch_size))
+                    )
+                for batch in batches:
+                    loader.load(cache.fund_rows(connection, batch))
+                print(f"{os.path.basename(path)}: {sum(map(len, batches))} records.")
+        if defer:
+            refresh_fund_metrics(connection, defer)
+        publish(connection)
+    finally:
+        connection.close()
+
+    elapsed = perf_counter() - start
+    print(loader.summary())
+    print(
+        f"Imported {len(files)} files ({size / 2 ** 20:.1f} MiB) in {elapsed:.2f}s: "
+        f"{loader.rows / elapsed if elapsed else 0:.0f} rows/s overall, "
+        f"{parse_time:.2f}s parsing across {processes} processes, "
+        f"{loader.elapsed:.2f}s loading."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import saved AMFI reports")
+    parser.add_argument("directory")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--infile",
+        action="store_true",
+        help="load chunks with LOAD DATA LOCAL INFILE",
+    )
+    parser.add_argument(
+        "--defer-metrics",
+        nargs="?",
+        const="sql",
+        choices=["sql", "numpy", "state"],
+        help="skip the per-row fund trigger and recompute funds once at the end",
+    )
+    parser.add_argument("--report", help="write the run summary as JSON to this file")
+    parser.add_argument(
+        "--prometheus", help="write the run summary as a Prometheus textfile"
+    )
+    args = parser.parse_args()
+
+    try:
+        import_reports(
+            args.directory,
+            processes=args.processes,
+            batch_size=args.batch_size,
+            infile=args.infile,
+            defer=args.defer_metrics,
+        )
+    finally:
+        report.finish("import_reports", args.report, args.prometheus)
@@ -0,0 +1,399 @@
+"""Shared ingestion helpers for get_funds.py and daily_fund.py
+"""
+
+import csv
+import os
+import tempfile
+import threading
+from time import perf_counter
+from amfi import batched, day
+import fund_state
+from instrument import report
+from partitions import archive_cutoff
+
+# Upper bound on names per `IN (...)` list when reading back new IDs
+LOOKUP_CHUNK = 1000
+
+# Funds per period on the /home leaderboards
+LEADERBOARD_SIZE = 5
+
+
+def clean_name(name):
+    return name.replace("'", "")
+
+
+"""Dimension cache
+
+    * `fund_company` and `fund_category` are loaded into name -> id
+      dictionaries and funds into a scheme code -> fund_id dictionary,
+      with one query each.
+    * Funds are resolved by their AMFI scheme code, once per distinct
+      `Scheme` in a `NavBatch`, so a renamed scheme keeps its fund_id.
+      Only rows without a usable code fall back to the cleaned name.
+    * A scheme code seen for the first time whose name matches a fund
+      created before codes were stored adopts that fund: the code and
+      ISINs are written to its row instead of creating a new one.
+    * Missing funds are created together, with one multi-row INSERT per
+      table inside a single transaction, and their IDs are read back in
+      bulk.
+    * A cache may be shared between threads, creation is serialised.
+"""
+
+
+class DimensionCache:
+    def __init__(self, connection):
+        self.lock = threading.Lock()
+        # Descending so that the oldest row wins for duplicated names
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "SELECT category_name, category_id FROM fund_category ORDER BY category_id DESC;"
+            )
+            self.category_map = dict(cursor.fetchall())
+            cursor.execute(
+                "SELECT company_name, company_id FROM fund_company ORDER BY company_id DESC;"
+            )
+            self.company_map = dict(cursor.fetchall())
+            cursor.execute(
+                "SELECT scheme_code, fund_id FROM fund_name "
+                "WHERE scheme_code IS NOT NULL;"
+            )
+            self.code_map = dict(cursor.fetchall())
+            cursor.execute(
+                "SELECT fund_name, fund_id FROM fund_name WHERE scheme_code IS NULL "
+                "ORDER BY fund_id DESC;"
+            )
+            self.fund_map = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def fund_rows(self, connection, batch):
+        """Return `(fund_id, value, date)` rows for a `NavBatch`."""
+        with report.span("dimensions"):
+            return self.resolve(connection, batch)
+
+    def resolve(self, connection, batch):
+        missing = [scheme for scheme in batch.keys if self.fund_id(scheme) is None]
+        if missing:
+            with self.lock:
+                self.create_funds(connection, missing)
+
+        fund_ids = [self.fund_id(scheme) for scheme in batch.keys]
+        dates = {ordinal: day(ordinal) for ordinal in set(batch.dates)}
+        return [
+            (fund_ids[code], value, dates[ordinal])
+            for code, value, ordinal in zip(batch.codes, batch.values, batch.dates)
+        ]
+
+    def fund_id(self, scheme):
+        if scheme.scheme_code is not None:
+            return self.code_map.get(scheme.scheme_code)
+        return self.fund_map.get(clean_name(scheme.name))
+
+    def create_funds(self, connection, schemes):
+        # Another thread may have created some of these while we waited
+        unique = {}
+        for scheme in schemes:
+            if self.fund_id(scheme) is None:
+                key = scheme.scheme_code
+                if key is None:
+                    key = clean_name(scheme.name)
+                unique.setdefault(key, scheme)
+        if not unique:
+            return
+
+        adopted, new_funds, taken, tried = {}, [], set(), set()
+        for scheme in unique.values():
+            fund_id = self.fund_map.get(clean_name(scheme.name))
+            adoptable = fund_id is not None and fund_id not in taken
+            if scheme.scheme_code is not None and adoptable:
+                adopted[scheme.scheme_code] = (fund_id, scheme)
+                taken.add(fund_id)
+                tried.add(clean_name(scheme.name))
+            else:
+                new_funds.append(scheme)
+
+        cursor = connection.cursor()
+        try:
+            for code, (fund_id, s) in list(adopted.items()):
+                cursor.execute(
+                    "UPDATE fund_name SET scheme_code = %s, isin_growth = %s, "
+                    "isin_reinvestment = %s WHERE fund_id = %s AND scheme_code IS NULL;",
+                    (code, s.isin_growth, s.isin_reinvestment, fund_id),
+                )
+                if cursor.rowcount == 0:
+                    # Adopted by another loader since the cache was read
+                    del adopted[code]
+                    new_funds.append(s)
+
+            categories = {scheme.category for scheme in new_funds}
+            categories = [
+                c
+                for c in categories
+                if c is not None and c not in self.category_map
+            ]
+            companies = {scheme.company for scheme in new_funds}
+            companies = [
+                c for c in companies if c is not None and c not in self.company_map
+            ]
+            category_ids = self.insert_names(
+                cursor, "fund_category", "category_id", "category_name", categories
+            )
+            company_ids = self.insert_names(
+                cursor, "fund_company", "company_id", "company_name", companies
+            )
+            category_map = {**self.category_map, **category_ids}
+            company_map = {**self.company_map, **company_ids}
+
+            if new_funds:
+                cursor.executemany(
+                    "INSERT INTO fund_name (fund_name, company_id, category_id, "
+                    "scheme_code, isin_growth, isin_reinvestment) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    [
+                        (
+                            clean_name(s.name),
+                            company_map.get(s.company),
+                            category_map.get(s.category),
+                            s.scheme_code,
+                            s.isin_growth,
+                            s.isin_reinvestment,
+                        )
+                        for s in new_funds
+                    ],
+                )
+            codes = [s.scheme_code for s in new_funds if s.scheme_code is not None]
+            code_ids = self.read_ids(
+                cursor, "fund_name", "fund_id", "scheme_code", codes
+            )
+            names = [clean_name(s.name) for s in new_funds if s.scheme_code is None]
+            name_ids = self.read_ids(
+                cursor,
+                "fund_name",
+                "fund_id",
+                "fund_name",
+                names,
+                "scheme_code IS NULL",
+            )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        report.count("new_categories", len(category_ids))
+        report.count("new_companies", len(company_ids))
+        report.count("new_funds", len(code_ids) + len(name_ids))
+        report.count("funds_adopted", len(adopted))
+
+        # Only publish IDs once the transaction has committed
+        self.category_map.update(category_ids)
+        self.company_map.update(company_ids)
+        self.code_map.update(code_ids)
+        self.code_map.update({code: fund_id for code, (fund_id, _) in adopted.items()})
+        self.fund_map.update(name_ids)
+        # An adopted fund now has a code, it must not be adopted again
+        for name in tried:
+            if self.fund_map.get(name) in taken:
+                del self.fund_map[name]
+
+    @staticmethod
+    def insert_names(cursor, table, id_col, name_col, names):
+        if not names:
+            return {}
+        cursor.executemany(
+            f"INSERT INTO {table} ({name_col}) VALUES (%s)", [(n,) for n in names]
+        )
+        return DimensionCache.read_ids(cursor, table, id_col, name_col, names)
+
+    @staticmethod
+    def read_ids(cursor, table, id_col, name_col, names, where=None):
+        ids = {}
+        where = f" AND {where}" if where else ""
+        for chunk in batched(names, LOOKUP_CHUNK):
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"SELECT {name_col}, {id_col} FROM {table} "
+                f"WHERE {name_col} IN ({placeholders}){where};",
+                tuple(chunk),
+            )
+            ids.update(cursor.fetchall())
+        return ids
+
+
+"""Bulk loader for `fund_value`
+
+    * Every call to `load` is one chunk and one transaction.
+    * With `infile=True` a chunk is streamed to a temporary CSV and sent
+      with `LOAD DATA LOCAL INFILE`, which needs a connection opened with
+      `allow_local_infile=True`.
+    * With `defer=True` the per-row `update_fund_after_insert` work is
+      skipped for this connection, the chunk's funds are queued in
+      `fund_refresh` instead and `refresh_fund_metrics` must be called
+      once loading is done.
+    * `fund_state` is updated in the same transaction as each chunk, as
+      is the optional `checkpoint(cursor, rows, inserted)` callback.
+    * Rows dated before the years `partitions.py archive` moved out are
+      dropped: `fund_value` would take them again, next to their copy in
+      `fund_value_archive`.
+    * `summary` reports rows sent, rows inserted and rows/second.
+"""
+
+
+class FundValueLoader:
+    def __init__(self, connection, infile=False, defer=False):
+        self.connection = connection
+        self.infile = infile
+        self.defer = defer
+        cursor = connection.cursor()
+        try:
+            if defer:
+                cursor.execute("SET @defer_fund_metrics = 1;")
+            cutoff = archive_cutoff(cursor)
+        finally:
+            cursor.close()
+        self.cutoff = None if cutoff is None else day(cutoff.toordinal())
+        self.rows = 0
+        self.inserted = 0
+        self.elapsed = 0.0
+
+    def load(self, rows, checkpoint=None):
+        with report.span("load"):
+            return self.load_chunk(rows, checkpoint)
+
+    def load_chunk(self, rows, checkpoint=None):
+        start = perf_counter()
+        if self.cutoff is not None:
+            kept = [row for row in rows if row[2] >= self.cutoff]
+            report.count("rows_archived_skipped", len(rows) - len(kept))
+            rows = kept
+        cursor = self.connection.cursor()
+        try:
+            if self.infile:
+                inserted = self.load_infile(cursor, rows)
+            else:
+                cursor.executemany(
+                    "INSERT IGNORE INTO fund_value (fund_id, price, date) VALUES (%s, %s, %s)",
+                    rows,
+                )
+                inserted = cursor.rowcount
+            if self.defer:
+                cursor.executemany(
+                    "INSERT IGNORE INTO fund_refresh (fund_id) VALUES (%s)",
+                    [(fund_id,) for fund_id in {row[0] for row in rows}],
+                )
+            fund_state.track(cursor, rows)
+            if checkpoint is not None:
+                checkpoint(cursor, len(rows), max(inserted, 0))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        self.rows += len(rows)
+        self.inserted += max(inserted, 0)
+        self.elapsed += perf_counter() - start
+        report.count("rows_loaded", len(rows))
+        report.count("rows_inserted", max(inserted, 0))
+        report.count("duplicates_ignored", len(rows) - max(inserted, 0))
+        return len(rows)
+
+    @staticmethod
+    def load_infile(cursor, rows):
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".csv", newline="", delete=False
+        ) as file:
+            writer = csv.writer(file, lineterminator="\n")
+            dates = {date: date.strftime("%Y-%m-%d") for date in {row[2] for row in rows}}
+            for fund_id, price, date in rows:
+                writer.writerow((fund_id, repr(price), dates[date]))
+        try:
+            cursor.execute(
+                "LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE fund_value "
+                "FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' "
+                "(fund_id, price, date);",
+                (file.name,),
+            )
+            return cursor.rowcount
+        finally:
+            os.remove(file.name)
+
+    def summary(self):
+        return load_summary(self.rows, self.inserted, self.elapsed)
+
+
+def refresh_fund_metrics(connection, engine="sql"):
+    """Recompute `fund` for every fund queued in `fund_refresh`.
+
+    `engine` is "sql" for the `refresh_fund_metrics` procedure, "numpy"
+    for the vectorised engine in metrics.py or "state" to derive the
+    history-wide columns from `fund_state`.
+    """
+    with report.span("refresh"):
+        refresh_with(connection, engine)
+
+
+def refresh_with(connection, engine):
+    if engine == "state":
+        fund_state.refresh_funds(connection)
+        return
+
+    cursor = connection.cursor()
+    try:
+        if engine == "numpy":
+            import metrics
+
+            cursor.execute("SELECT fund_id FROM fund_refresh;")
+            fund_ids = [fund_id for (fund_id,) in cursor.fetchall()]
+            metrics.refresh(connection, fund_ids)
+            for chunk in batched(fund_ids, LOOKUP_CHUNK):
+                cursor.executemany(
+                    "DELETE FROM fund_refresh WHERE fund_id = %s",
+                    [(fund_id,) for fund_id in chunk],
+                )
+        else:
+            cursor.execute("CALL refresh_fund_metrics();")
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+def rank_funds(connection):
+    """Recompute `fund_rank` and `fund_category_rank` in one pass."""
+    with report.span("rank"):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("CALL calculate_fund_ranks();")
+            connection.commit()
+        finally:
+            cursor.close()
+
+
+def publish(connection):
+    """Rebuild the /home leaderboards and bump the data version.
+
+    Called at the end of every ingest, once `fund` is final. The API
+    drops everything it cached for the previous version.
+    """
+    with report.span("publish"):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("CALL refresh_leaderboards(%s);", (LEADERBOARD_SIZE,))
+            cursor.execute(
+                "UPDATE data_version SET version = version + 1, "
+                "updated_on = UTC_TIMESTAMP();"
+            )
+            connection.commit()
+        finally:
+            cursor.close()
+
+
+def load_summary(rows, inserted, elapsed):
+    rate = rows / elapsed if elapsed > 0 else 0.0
+    return (
+        f"Loaded {rows} rows ({inserted} new, {rows - inserted} duplicates) "
+        f"in {elapsed:.2f}s, {rate:.0f} rows/s."
+    )
@@ -0,0 +1,141 @@
+"""Ingestion instrumentation
+
+    * `report.span(stage)` times a block and adds it to the stage's
+      total, spans from several threads add up, so a stage's seconds
+      can exceed the wall clock time of the run.
+    * `report.count(name, n)` bumps a counter.
+    * Connections made with `db.connect` count every `execute` and
+      `executemany` as one DB round trip.
+    * `report.finish` logs the run summary and writes it as JSON and,
+      optionally, as a Prometheus textfile (for node_exporter's textfile
+      collector).
+
+    Stages: download, parse, dimensions, load (which includes the
+    per-row trigger unless metrics are deferred), refresh, rank and
+    publish.
+    A report that is streamed rather than cached is downloaded while
+    it is parsed, so its download time is part of `parse`.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter, time
+
+PROMETHEUS_PREFIX = "amfi_ingest"
+
+
+class RunReport:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time()
+        self.start = perf_counter()
+        self.spans = {}
+        self.counters = {}
+
+    @contextmanager
+    def span(self, stage):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, perf_counter() - start)
+
+    def add_time(self, stage, seconds, calls=1):
+        with self.lock:
+            total = self.spans.setdefault(stage, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += seconds
+            total["calls"] += calls
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self, job):
+        with self.lock:
+            return {
+                "job": job,
+                "started": datetime.fromtimestamp(self.started).isoformat(),
+                "duration_seconds": perf_counter() - self.start,
+                "spans": {stage: dict(total) for stage, total in self.spans.items()},
+                "counters": dict(self.counters),
+            }
+
+    def finish(self, job, path=None, prometheus=None, log=print):
+        summary = self.summary(job)
+        for stage, total in summary["spans"].items():
+            log(f"{stage}: {total['seconds']:.2f}s over {total['calls']} calls")
+        log(", ".join(f"{name} {n}" for name, n in sorted(summary["counters"].items())))
+        log(f"{job} finished in {summary['duration_seconds']:.2f}s.")
+        if path:
+            write_atomic(path, json.dumps(summary, indent=2) + "\n")
+        if prometheus:
+            write_atomic(prometheus, prometheus_text(summary))
+        return summary
+
+
+def prometheus_text(summary):
+    job = summary["job"]
+    lines = [
+        f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds gauge",
+        *(
+            f'{PROMETHEUS_PREFIX}_stage_seconds{{job="{job}",stage="{stage}"}} '
+            f"{total['seconds']:.6f}"
+            for stage, total in summary["spans"].items()
+        ),
+        f"# TYPE {PROMETHEUS_PREFIX}_count gauge",
+        *(
+            f'{PROMETHEUS_PREFIX}_count{{job="{job}",counter="{name}"}} {n}'
+            for name, n in summary["counters"].items()
+        ),
+        f"# TYPE {PROMETHEUS_PREFIX}_duration_seconds gauge",
+        f'{PROMETHEUS_PREFIX}_duration_seconds{{job="{job}"}} '
+        f"{summary['duration_seconds']:.6f}",
+        f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge",
+        f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds{{job="{job}"}} {time():.0f}',
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_atomic(path, text):
+    # The textfile collector must never see a half written file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "w") as file:
+        file.write(text)
+    os.replace(tmp, path)
+
+
+class CountingCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        report.count("db_round_trips")
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        report.count("db_round_trips")
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class CountingConnection:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self.connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+report = RunReport()
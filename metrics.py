@@ -0,0 +1,241 @@
+"""Vectorised fund metrics
+
+    * Computes every column of the `fund` table, except the ranks, for
+      all funds at once from `fund_value` and `fund_value_archive`
+      pulled as columns sorted by (fund_id, date).
+    * Matches the stored functions: period lookbacks take the earliest
+      date within the window before the latest date, `one_day` takes the
+      last date before it, months/years are subtracted like DATE_SUB
+      (clamped to the end of the month), standard deviation is the
+      population STDDEV and a zero base price gives NULL.
+    * Results are written back with one chunked bulk upsert.
+
+    e.g. python metrics.py
+"""
+
+import argparse
+from array import array
+from calendar import monthrange
+from datetime import date as Date, datetime
+from time import perf_counter
+
+import numpy as np
+
+from amfi import batched
+from db import connect, history_query
+
+FETCH_SIZE = 50000
+WRITE_CHUNK = 5000
+
+# Composite sort key is fund_index * KEY_STRIDE + date ordinal, the
+# stride is larger than the ordinal of any representable date
+KEY_STRIDE = 1 << 22
+
+PERIODS = [
+    ("one_week", ("day", 7)),
+    ("one_month", ("month", 1)),
+    ("three_month", ("month", 3)),
+    ("six_month", ("month", 6)),
+    ("one_year", ("month", 12)),
+]
+
+COLUMNS = [
+    "one_day",
+    "one_week",
+    "one_month",
+    "three_month",
+    "six_month",
+    "one_year",
+    "lifetime",
+    "earliest_date",
+    "latest_date",
+    "high",
+    "low",
+    "standard_deviation",
+    "value",
+]
+
+
+def date_sub(ordinal, unit, n):
+    """DATE_SUB(date, INTERVAL n unit) on a date ordinal."""
+    if unit == "day":
+        return ordinal - n
+    d = Date.fromordinal(ordinal)
+    month = d.year * 12 + d.month - 1 - n
+    year, month = divmod(month, 12)
+    month += 1
+    return Date(year, month, min(d.day, monthrange(year, month)[1])).toordinal()
+
+
+def load_columns(connection, fund_ids=None):
+    """Pull every NAV, archived or not, as (fund_id, date ordinal, price) columns.
+
+    Rows come back sorted by (fund_id, date). Rows with a NULL price are
+    dropped, as the SQL aggregates ignore them.
+    """
+    if fund_ids is None:
+        chunks = [None]
+    else:
+        chunks = batched(sorted(fund_ids), WRITE_CHUNK)
+
+    ids, days, prices = array("q"), array("q"), array("d")
+    ordinals = {}
+    cursor = connection.cursor()
+    try:
+        for chunk in chunks:
+            if chunk is None:
+                query = history_query("fund_id, date, price")
+                params = ()
+            else:
+                placeholders = ", ".join(["%s"] * len(chunk))
+                where = f"WHERE fund_id IN ({placeholders})"
+                query = history_query("fund_id, date, price", where)
+                params = tuple(chunk) * 2
+            cursor.execute(query + " ORDER BY fund_id, date;", params)
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for fund_id, dt, price in rows:
+                    if price is None:
+                        continue
+                    ordinal = ordinals.get(dt)
+                    if ordinal is None:
+                        ordinal = ordinals[dt] = dt.toordinal()
+                    ids.append(fund_id)
+                    days.append(ordinal)
+                    prices.append(price)
+    finally:
+        cursor.close()
+
+    return (
+        np.frombuffer(ids, dtype=np.int64),
+        np.frombuffer(days, dtype=np.int64),
+        np.frombuffer(prices, dtype=np.float64),
+    )
+
+
+def compute_metrics(fund_ids, days, prices):
+    """Compute `fund` columns from columns sorted by (fund_id, date).
+
+    Returns the distinct fund IDs and a dict of per-fund arrays keyed by
+    `COLUMNS`, NaN standing for NULL.
+    """
+    if len(fund_ids) == 0:
+        return np.empty(0, dtype=np.int64), {}
+
+    starts = np.flatnonzero(np.r_[True, fund_ids[1:] != fund_ids[:-1]])
+    ends = np.r_[starts[1:], len(fund_ids)]
+    counts = ends - starts
+    group = np.repeat(np.arange(len(starts)), counts)
+    base = np.arange(len(starts), dtype=np.int64) * KEY_STRIDE
+    key = group * KEY_STRIDE + days
+
+    def first_at(day):
+        # Index of the first row of each fund on `day`
+        return np.searchsorted(key, base + day, side="left")
+
+    def change(latest, previous):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = (latest - previous) / previous * 100
+        pct[previous == 0] = np.nan
+        return pct
+
+    earliest_day = days[starts]
+    latest_day = days[ends - 1]
+    latest_idx = first_at(latest_day)
+    latest_price = prices[latest_idx]
+
+    res = {}
+
+    # Last date before the latest one
+    prev_idx = latest_idx - 1
+    has_prev = prev_idx >= starts
+    prev_idx = first_at(days[np.where(has_prev, prev_idx, latest_idx)])
+    res["one_day"] = np.where(
+        has_prev, change(latest_price, prices[prev_idx]), np.nan
+    )
+
+    # Earliest date on or after latest - interval and before latest
+    unique_latest, inverse = np.unique(latest_day, return_inverse=True)
+    for name, (unit, n) in PERIODS:
+        bound = np.array([date_sub(int(d), unit, n) for d in unique_latest])[inverse]
+        idx = first_at(bound)
+        has_prev = idx < latest_idx
+        idx = np.where(has_prev, idx, latest_idx)
+        res[name] = np.where(has_prev, change(latest_price, prices[idx]), np.nan)
+
+    res["lifetime"] = change(latest_price, prices[first_at(earliest_day)])
+    res["earliest_date"] = earliest_day
+    res["latest_date"] = latest_day
+    res["high"] = np.maximum.reduceat(prices, starts)
+    res["low"] = np.minimum.reduceat(prices, starts)
+    mean = np.add.reduceat(prices, starts) / counts
+    res["standard_deviation"] = np.sqrt(
+        np.add.reduceat((prices - mean[group]) ** 2, starts) / counts
+    )
+    res["value"] = latest_price
+
+    return fund_ids[starts], res
+
+
+def write_metrics(connection, funds, res):
+    def value(x):
+        return None if np.isnan(x) else float(x)
+
+    dates = {}
+
+    def to_datetime(ordinal):
+        dt = dates.get(ordinal)
+        if dt is None:
+            dt = dates[ordinal] = datetime.fromordinal(ordinal)
+        return dt
+
+    date_cols = {"earliest_date", "latest_date"}
+    columns = [res[col].tolist() for col in COLUMNS]
+    rows = (
+        tuple(
+            [int(fund_id)]
+            + [
+                to_datetime(x) if col in date_cols else value(x)
+                for col, x in zip(COLUMNS, values)
+            ]
+        )
+        for fund_id, *values in zip(funds.tolist(), *columns)
+    )
+
+    placeholders = ", ".join(["%s"] * (len(COLUMNS) + 1))
+    updates = ", ".join(f"{col} = VALUES({col})" for col in COLUMNS)
+    cursor = connection.cursor()
+    try:
+        for chunk in batched(rows, WRITE_CHUNK):
+            cursor.executemany(
+                f"INSERT INTO fund (fund_id, {', '.join(COLUMNS)}) VALUES ({placeholders}) "
+                f"ON DUPLICATE KEY UPDATE {updates}",
+                chunk,
+            )
+            connection.commit()
+    finally:
+        cursor.close()
+
+
+def refresh(connection, fund_ids=None):
+    """Recompute and store metrics for `fund_ids`, or for every fund."""
+    funds, res = compute_metrics(*load_columns(connection, fund_ids))
+    if len(funds):
+        write_metrics(connection, funds, res)
+    return len(funds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute the fund table")
+    parser.add_argument("fund_ids", nargs="*", type=int, help="default: all funds")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    connection = connect()
+    try:
+        n = refresh(connection, args.fund_ids or None)
+    finally:
+        connection.close()
+    print(f"Recomputed {n} funds in {perf_counter() - start:.2f}s.")
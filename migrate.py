@@ -0,0 +1,112 @@
+"""Versioned schema migrations
+
+    * Migrations are the `.sql` files in `migrations/`, applied in file
+      name order. The file name without `.sql` is the version and is
+      recorded in `schema_migrations` once the file has run.
+    * Files may switch the statement delimiter with `DELIMITER`, like
+      the mysql client, to define triggers and procedures.
+    * MySQL commits DDL implicitly, so a migration that fails half way
+      is not rolled back. Fix the schema by hand and rerun.
+
+    e.g. python migrate.py
+         python migrate.py --list
+"""
+
+import argparse
+import os
+
+from db import connect
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def split_statements(sql):
+    delimiter = ";"
+    statements, current = [], []
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if stripped.upper().startswith("DELIMITER "):
+            delimiter = stripped.split(None, 1)[1]
+            continue
+        if not current and (stripped == "" or stripped.startswith("--")):
+            continue
+        if stripped.endswith(delimiter):
+            current.append(line.rstrip()[: -len(delimiter)])
+            statement = "\n".join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(line)
+    statement = "\n".join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def available():
+    return [
+        (name[: -len(".sql")], os.path.join(MIGRATIONS_DIR, name))
+        for name in sorted(os.listdir(MIGRATIONS_DIR))
+        if name.endswith(".sql")
+    ]
+
+
+def applied(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations("
+        "version varchar(255) primary key, applied_on datetime NOT NULL);"
+    )
+    cursor.execute("SELECT version FROM schema_migrations;")
+    return {version for (version,) in cursor.fetchall()}
+
+
+def migrate(connection, target=None):
+    """Apply pending migrations up to and including `target`."""
+    cursor = connection.cursor()
+    try:
+        done = applied(cursor)
+        for version, path in available():
+            if target is not None and version > target:
+                break
+            if version in done:
+                continue
+            print(f"Applying {version} ...")
+            with open(path, "r") as file:
+                for statement in split_statements(file.read()):
+                    cursor.execute(statement)
+                    if cursor.with_rows:
+                        cursor.fetchall()
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, applied_on) VALUES (%s, NOW());",
+                (version,),
+            )
+            connection.commit()
+    finally:
+        cursor.close()
+
+
+def status(connection):
+    cursor = connection.cursor()
+    try:
+        done = applied(cursor)
+    finally:
+        cursor.close()
+    for version, _ in available():
+        print(f"{'applied' if version in done else 'pending'}  {version}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument("--list", action="store_true", help="show migration status")
+    parser.add_argument("--to", help="stop after this version")
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        if args.list:
+            status(connection)
+        else:
+            migrate(connection, args.to)
+    finally:
+        connection.close()
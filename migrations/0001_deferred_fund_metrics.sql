@@ -0,0 +1,167 @@
+-- Queue table, deferrable insert trigger and set-based refresh (--defer-metrics)
+CREATE TABLE fund_refresh(fund_id int primary key, foreign key(fund_id) references fund_name(fund_id));
+
+DELIMITER //
+
+DROP TRIGGER IF EXISTS update_fund_after_insert //
+
+CREATE TRIGGER update_fund_after_insert
+AFTER INSERT ON fund_value
+FOR EACH ROW
+BEGIN
+    DECLARE max_value DOUBLE;
+    DECLARE min_value DOUBLE;
+    DECLARE earliest_dt DATETIME;
+    DECLARE latest_dt DATETIME;
+
+    -- Bulk loads set @defer_fund_metrics and call refresh_fund_metrics() once instead
+    IF @defer_fund_metrics IS NULL THEN
+        SET max_value = (SELECT MAX(price) FROM fund_value WHERE fund_id = NEW.fund_id);
+        SET min_value = (SELECT MIN(price) FROM fund_value WHERE fund_id = NEW.fund_id);
+    
+        SET earliest_dt = (SELECT MIN(date) FROM fund_value WHERE fund_id = NEW.fund_id);
+        SET latest_dt = (SELECT MAX(date) FROM fund_value WHERE fund_id = NEW.fund_id);
+    
+        IF NOT EXISTS (SELECT 1 FROM fund WHERE fund_id = NEW.fund_id) THEN
+            INSERT INTO fund (
+                fund_id,
+                one_day,
+                one_week,
+                one_month,
+                three_month,
+                six_month,
+                one_year,
+                lifetime,
+                earliest_date,
+                latest_date,
+                high,
+                low,
+                standard_deviation,
+                value
+            )
+            VALUES (
+                NEW.fund_id,
+                one_day_change(NEW.fund_id),  
+                one_week_change(NEW.fund_id),  
+                one_month_change(NEW.fund_id),  
+                three_month_change(NEW.fund_id),  
+                six_month_change(NEW.fund_id),  
+                one_year_change(NEW.fund_id),  
+                lifetime_change(NEW.fund_id), 
+                earliest_dt,
+                latest_dt,
+                max_value,
+                min_value,
+                fund_std_dev(NEW.fund_id), 
+                NEW.price
+            );
+
+        ELSE
+            UPDATE fund
+            SET 
+                one_day = one_day_change(NEW.fund_id),
+                one_week = one_week_change(NEW.fund_id),
+                one_month = one_month_change(NEW.fund_id),
+                three_month = three_month_change(NEW.fund_id),
+                six_month = six_month_change(NEW.fund_id),
+                one_year = one_year_change(NEW.fund_id),
+                lifetime = lifetime_change(NEW.fund_id),
+                earliest_date = earliest_dt,
+                latest_date = latest_dt,
+                high = max_value,
+                low = min_value,
+                standard_deviation = fund_std_dev(NEW.fund_id),
+                value = NEW.price
+            WHERE fund_id = NEW.fund_id;
+        END IF;
+    END IF;
+END //
+
+DROP PROCEDURE IF EXISTS refresh_fund_metrics //
+
+CREATE PROCEDURE refresh_fund_metrics()
+BEGIN
+    INSERT INTO fund (
+        fund_id,
+        one_day,
+        one_week,
+        one_month,
+        three_month,
+        six_month,
+        one_year,
+        lifetime,
+        earliest_date,
+        latest_date,
+        high,
+        low,
+        standard_deviation,
+        value
+    )
+    WITH stats AS (
+        SELECT v.fund_id, MIN(v.date) AS earliest_dt, MAX(v.date) AS latest_dt,
+               MAX(v.price) AS high, MIN(v.price) AS low, IFNULL(STDDEV(v.price), 0) AS std_dev
+        FROM fund_value AS v
+        JOIN fund_refresh AS r ON r.fund_id = v.fund_id
+        GROUP BY v.fund_id
+    ),
+    prices AS (
+        SELECT v.fund_id, v.date, MIN(v.price) AS price
+        FROM fund_value AS v
+        JOIN fund_refresh AS r ON r.fund_id = v.fund_id
+        GROUP BY v.fund_id, v.date
+    ),
+    lookback AS (
+        SELECT p.fund_id,
+               MAX(p.date) AS day_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 7 DAY), p.date, NULL)) AS week_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 1 MONTH), p.date, NULL)) AS month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 3 MONTH), p.date, NULL)) AS three_month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 6 MONTH), p.date, NULL)) AS six_month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 1 YEAR), p.date, NULL)) AS year_dt
+        FROM prices AS p
+        JOIN stats AS s ON s.fund_id = p.fund_id AND p.date < s.latest_dt
+        GROUP BY p.fund_id
+    )
+    SELECT s.fund_id,
+           (l.price - d.price) / NULLIF(d.price, 0) * 100,
+           (l.price - w.price) / NULLIF(w.price, 0) * 100,
+           (l.price - m1.price) / NULLIF(m1.price, 0) * 100,
+           (l.price - m3.price) / NULLIF(m3.price, 0) * 100,
+           (l.price - m6.price) / NULLIF(m6.price, 0) * 100,
+           (l.price - y.price) / NULLIF(y.price, 0) * 100,
+           (l.price - e.price) / NULLIF(e.price, 0) * 100,
+           s.earliest_dt,
+           s.latest_dt,
+           s.high,
+           s.low,
+           s.std_dev,
+           l.price
+    FROM stats AS s
+    JOIN prices AS l ON l.fund_id = s.fund_id AND l.date = s.latest_dt
+    JOIN prices AS e ON e.fund_id = s.fund_id AND e.date = s.earliest_dt
+    LEFT JOIN lookback AS b ON b.fund_id = s.fund_id
+    LEFT JOIN prices AS d ON d.fund_id = s.fund_id AND d.date = b.day_dt
+    LEFT JOIN prices AS w ON w.fund_id = s.fund_id AND w.date = b.week_dt
+    LEFT JOIN prices AS m1 ON m1.fund_id = s.fund_id AND m1.date = b.month_dt
+    LEFT JOIN prices AS m3 ON m3.fund_id = s.fund_id AND m3.date = b.three_month_dt
+    LEFT JOIN prices AS m6 ON m6.fund_id = s.fund_id AND m6.date = b.six_month_dt
+    LEFT JOIN prices AS y ON y.fund_id = s.fund_id AND y.date = b.year_dt
+    ON DUPLICATE KEY UPDATE
+        one_day = VALUES(one_day),
+        one_week = VALUES(one_week),
+        one_month = VALUES(one_month),
+        three_month = VALUES(three_month),
+        six_month = VALUES(six_month),
+        one_year = VALUES(one_year),
+        lifetime = VALUES(lifetime),
+        earliest_date = VALUES(earliest_date),
+        latest_date = VALUES(latest_date),
+        high = VALUES(high),
+        low = VALUES(low),
+        standard_deviation = VALUES(standard_deviation),
+        value = VALUES(value);
+
+    DELETE FROM fund_refresh;
+END //
+
+DELIMITER ;
@@ -0,0 +1,35 @@
+-- Deduplicate fund_value and give it a (fund_id, date) primary key, so that
+-- INSERT IGNORE deduplicates and per-fund history reads are index range scans.
+
+-- Temporary row id and lookup index to find duplicates without a full self-join scan
+ALTER TABLE fund_value
+    ADD COLUMN row_id BIGINT NOT NULL AUTO_INCREMENT,
+    ADD PRIMARY KEY (row_id),
+    ADD INDEX fund_value_dedup (fund_id, date);
+
+-- Keep the first inserted row of every (fund_id, date)
+DELETE d FROM fund_value AS d
+JOIN fund_value AS k ON k.fund_id = d.fund_id AND k.date = d.date AND k.row_id < d.row_id;
+
+DELETE FROM fund_value WHERE fund_id IS NULL OR date IS NULL;
+
+ALTER TABLE fund_value
+    DROP PRIMARY KEY,
+    DROP COLUMN row_id,
+    DROP INDEX fund_value_dedup,
+    MODIFY fund_id int NOT NULL,
+    MODIFY date datetime NOT NULL,
+    ADD PRIMARY KEY (fund_id, date);
+
+-- Name lookups made by the ingesters
+CREATE INDEX fund_name_name ON fund_name (fund_name);
+CREATE INDEX fund_company_name ON fund_company (company_name);
+CREATE INDEX fund_category_name ON fund_category (category_name);
+
+-- ORDER BY ... LIMIT on /home, /top/fund and the ranked listings
+CREATE INDEX fund_one_year ON fund (one_year);
+CREATE INDEX fund_six_month ON fund (six_month);
+CREATE INDEX fund_three_month ON fund (three_month);
+CREATE INDEX fund_one_month ON fund (one_month);
+CREATE INDEX fund_rank ON fund (fund_rank);
+CREATE INDEX fund_category_rank ON fund (fund_category_rank);
@@ -0,0 +1,10 @@
+-- Running per-fund statistics, populated from the existing history
+CREATE TABLE fund_state(fund_id int primary key, n int NOT NULL, mean double NOT NULL, m2 double NOT NULL, high double, low double,
+earliest_date datetime, latest_date datetime, latest_price double, stale boolean NOT NULL DEFAULT FALSE, foreign key(fund_id) references fund_name(fund_id));
+
+INSERT INTO fund_state (fund_id, n, mean, m2, high, low, earliest_date, latest_date, latest_price, stale)
+SELECT v.fund_id, COUNT(v.price), IFNULL(AVG(v.price), 0), IFNULL(VAR_POP(v.price) * COUNT(v.price), 0),
+       MAX(v.price), MIN(v.price), MIN(v.date), MAX(v.date),
+       (SELECT l.price FROM fund_value AS l WHERE l.fund_id = v.fund_id ORDER BY l.date DESC LIMIT 1), FALSE
+FROM fund_value AS v
+GROUP BY v.fund_id;
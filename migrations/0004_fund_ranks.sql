@@ -0,0 +1,26 @@
+-- Single-pass global and per-category ranking
+DELIMITER //
+
+DROP PROCEDURE IF EXISTS calculate_fund_ranks //
+
+CREATE PROCEDURE calculate_fund_ranks()
+BEGIN
+    UPDATE fund AS f
+    JOIN (
+        SELECT fund.fund_id,
+               ROW_NUMBER() OVER (
+                   ORDER BY fund.one_year DESC, fund.six_month DESC, fund.three_month DESC,
+                            fund.one_month DESC, fund.one_week DESC, fund.one_day DESC, fund.fund_id
+               ) AS overall_rank,
+               ROW_NUMBER() OVER (
+                   PARTITION BY fn.category_id
+                   ORDER BY fund.one_year DESC, fund.six_month DESC, fund.three_month DESC,
+                            fund.one_month DESC, fund.one_week DESC, fund.one_day DESC, fund.fund_id
+               ) AS category_rank
+        FROM fund
+        JOIN fund_name AS fn ON fn.fund_id = fund.fund_id
+    ) AS r ON r.fund_id = f.fund_id
+    SET f.fund_rank = r.overall_rank, f.fund_category_rank = r.category_rank;
+END //
+
+DELIMITER ;
@@ -0,0 +1,42 @@
+-- Partition fund_value by year so recent-window reads prune to the latest
+-- partitions, and add the archive table that partitions.py moves cold years into.
+-- Partitioned InnoDB tables cannot have foreign keys, so fund_value loses its
+-- (auto-named) key to fund_name; the ingesters only insert resolved fund_ids.
+
+ALTER TABLE fund_value DROP FOREIGN KEY fund_value_ibfk_1;
+
+-- p2006 also holds anything older
+ALTER TABLE fund_value
+PARTITION BY RANGE COLUMNS(date) (
+    PARTITION p2006 VALUES LESS THAN ('2007-01-01'),
+    PARTITION p2007 VALUES LESS THAN ('2008-01-01'),
+    PARTITION p2008 VALUES LESS THAN ('2009-01-01'),
+    PARTITION p2009 VALUES LESS THAN ('2010-01-01'),
+    PARTITION p2010 VALUES LESS THAN ('2011-01-01'),
+    PARTITION p2011 VALUES LESS THAN ('2012-01-01'),
+    PARTITION p2012 VALUES LESS THAN ('2013-01-01'),
+    PARTITION p2013 VALUES LESS THAN ('2014-01-01'),
+    PARTITION p2014 VALUES LESS THAN ('2015-01-01'),
+    PARTITION p2015 VALUES LESS THAN ('2016-01-01'),
+    PARTITION p2016 VALUES LESS THAN ('2017-01-01'),
+    PARTITION p2017 VALUES LESS THAN ('2018-01-01'),
+    PARTITION p2018 VALUES LESS THAN ('2019-01-01'),
+    PARTITION p2019 VALUES LESS THAN ('2020-01-01'),
+    PARTITION p2020 VALUES LESS THAN ('2021-01-01'),
+    PARTITION p2021 VALUES LESS THAN ('2022-01-01'),
+    PARTITION p2022 VALUES LESS THAN ('2023-01-01'),
+    PARTITION p2023 VALUES LESS THAN ('2024-01-01'),
+    PARTITION p2024 VALUES LESS THAN ('2025-01-01'),
+    PARTITION p2025 VALUES LESS THAN ('2026-01-01'),
+    PARTITION p2026 VALUES LESS THAN ('2027-01-01'),
+    PARTITION p2027 VALUES LESS THAN ('2028-01-01'),
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+);
+
+CREATE TABLE fund_value_archive(fund_id int, date datetime, price double, primary key(fund_id, date));
+
+-- Full history, hot and archived
+CREATE VIEW fund_value_history AS
+SELECT fund_id, date, price FROM fund_value
+UNION ALL
+SELECT fund_id, date, price FROM fund_value_archive;
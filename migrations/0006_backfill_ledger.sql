@@ -0,0 +1,6 @@
+-- Per-month run ledger for get_funds.py (see backfill_ledger.py)
+CREATE TABLE backfill_month(frmdt date primary key, todt date NOT NULL, status varchar(16) NOT NULL, checksum char(64),
+batch_size int, row_count int, inserted int, chunks int, updated_on datetime NOT NULL);
+
+-- Chunks committed per month, written in the same transaction as the chunk
+CREATE TABLE backfill_chunk(frmdt date, chunk int, row_count int NOT NULL, inserted int NOT NULL, primary key(frmdt, chunk));
@@ -0,0 +1,5 @@
+-- Identify funds by AMFI scheme code. Existing rows get their code when
+-- the ingesters next see the scheme, or all at once with
+-- `python scheme_codes.py backfill`.
+ALTER TABLE fund_name ADD COLUMN scheme_code int, ADD COLUMN isin_growth varchar(12), ADD COLUMN isin_reinvestment varchar(12);
+CREATE UNIQUE INDEX fund_name_scheme_code ON fund_name (scheme_code);
@@ -0,0 +1,42 @@
+-- Data version stamp and the /home leaderboards, both written by the
+-- ingesters at the end of every run (see ingest.publish)
+CREATE TABLE data_version(id tinyint primary key, version int NOT NULL, updated_on datetime NOT NULL);
+INSERT INTO data_version (id, version, updated_on) VALUES (1, 1, NOW());
+-- No foreign key, scheme_codes.py deletes merged funds before republishing
+CREATE TABLE leaderboard(period varchar(16), position int, fund_id int NOT NULL, company_name varchar(500), fund_name varchar(500),
+value double, primary key(period, position));
+
+DELIMITER //
+
+DROP PROCEDURE IF EXISTS refresh_leaderboards //
+
+CREATE PROCEDURE refresh_leaderboards(n INT)
+BEGIN
+    DELETE FROM leaderboard;
+    INSERT INTO leaderboard (period, position, fund_id, company_name, fund_name, value)
+    SELECT period, position, fund_id, company_name, fund_name, ROUND(value, 2)
+    FROM (
+        SELECT v.*, ROW_NUMBER() OVER (PARTITION BY v.period ORDER BY v.value DESC, v.fund_id) AS position
+        FROM (
+            SELECT p.period, fund.fund_id, fc.company_name, fn.fund_name,
+                   CASE p.period
+                       WHEN 'one_year' THEN fund.one_year
+                       WHEN 'six_month' THEN fund.six_month
+                       WHEN 'three_month' THEN fund.three_month
+                       ELSE fund.one_month
+                   END AS value
+            FROM fund
+            JOIN fund_name AS fn ON fn.fund_id = fund.fund_id
+            JOIN fund_company AS fc ON fc.company_id = fn.company_id
+            CROSS JOIN (
+                SELECT 'one_year' AS period UNION ALL SELECT 'six_month'
+                UNION ALL SELECT 'three_month' UNION ALL SELECT 'one_month'
+            ) AS p
+        ) AS v
+    ) AS r
+    WHERE position <= n;
+END //
+
+DELIMITER ;
+
+CALL refresh_leaderboards(5);
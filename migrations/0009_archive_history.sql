@@ -0,0 +1,258 @@
+-- Read archived years too (see partitions.py): the functions, the insert trigger,
+-- refresh_fund_metrics() and fund_state cover fund_value and fund_value_archive.
+-- fund_state keeps each fund's earliest price for `lifetime`, and is rebuilt
+-- from the full history in case `fund_state.py rebuild` ran after an archive.
+ALTER TABLE fund_state ADD COLUMN earliest_price double AFTER latest_price;
+
+INSERT INTO fund_state (fund_id, n, mean, m2, high, low, earliest_date, latest_date, latest_price, earliest_price, stale)
+SELECT v.fund_id, COUNT(v.price), IFNULL(AVG(v.price), 0), IFNULL(VAR_POP(v.price) * COUNT(v.price), 0),
+       MAX(v.price), MIN(v.price), MIN(v.date), MAX(v.date), ANY_VALUE(v.latest_price), ANY_VALUE(v.earliest_price), FALSE
+FROM (
+    SELECT h.fund_id, h.date, h.price,
+           FIRST_VALUE(h.price) OVER (PARTITION BY h.fund_id ORDER BY h.date DESC) AS latest_price,
+           FIRST_VALUE(h.price) OVER (PARTITION BY h.fund_id ORDER BY h.date) AS earliest_price
+    FROM fund_value_history AS h
+) AS v
+GROUP BY v.fund_id
+ON DUPLICATE KEY UPDATE n = VALUES(n), mean = VALUES(mean), m2 = VALUES(m2), high = VALUES(high), low = VALUES(low),
+earliest_date = VALUES(earliest_date), latest_date = VALUES(latest_date), latest_price = VALUES(latest_price),
+earliest_price = VALUES(earliest_price), stale = VALUES(stale);
+
+DELIMITER //
+
+DROP FUNCTION IF EXISTS lifetime_change //
+
+CREATE FUNCTION lifetime_change(f_id INT) RETURNS DOUBLE
+BEGIN
+    DECLARE change_val DOUBLE;
+    DECLARE latest_date DATE;
+    DECLARE earliest_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE earliest_price DOUBLE;
+
+    -- Archived years included (see partitions.py)
+    SELECT MAX(date), MIN(date) INTO latest_date, earliest_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
+
+    IF latest_date IS NULL OR earliest_date IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT price INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h
+    LIMIT 1;
+
+    SELECT price INTO earliest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = earliest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = earliest_date
+    ) AS h
+    LIMIT 1;
+
+    IF latest_price IS NULL OR earliest_price IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SET change_val = IFNULL((latest_price - earliest_price) / IF(earliest_price = 0, NULL, earliest_price) * 100, NULL);
+
+    RETURN change_val;
+END //
+
+DROP FUNCTION IF EXISTS fund_std_dev //
+
+CREATE FUNCTION fund_std_dev(f_id INT) RETURNS DOUBLE
+BEGIN
+    DECLARE stddev DOUBLE;
+    SET stddev = (
+        SELECT STDDEV(price)
+        FROM (
+            SELECT price FROM fund_value WHERE fund_id = f_id
+            UNION ALL
+            SELECT price FROM fund_value_archive WHERE fund_id = f_id
+        ) AS h
+    );
+    RETURN IFNULL(stddev, 0);
+END //
+
+DROP TRIGGER IF EXISTS update_fund_after_insert //
+
+CREATE TRIGGER update_fund_after_insert
+AFTER INSERT ON fund_value
+FOR EACH ROW
+BEGIN
+    DECLARE max_value DOUBLE;
+    DECLARE min_value DOUBLE;
+    DECLARE earliest_dt DATETIME;
+    DECLARE latest_dt DATETIME;
+
+    -- Bulk loads set @defer_fund_metrics and call refresh_fund_metrics() once instead
+    IF @defer_fund_metrics IS NULL THEN
+        -- Archived years included (see partitions.py)
+        SELECT MAX(price), MIN(price), MIN(date), MAX(date)
+        INTO max_value, min_value, earliest_dt, latest_dt
+        FROM (
+            SELECT price, date FROM fund_value WHERE fund_id = NEW.fund_id
+            UNION ALL
+            SELECT price, date FROM fund_value_archive WHERE fund_id = NEW.fund_id
+        ) AS h;
+    
+        IF NOT EXISTS (SELECT 1 FROM fund WHERE fund_id = NEW.fund_id) THEN
+            INSERT INTO fund (
+                fund_id,
+                one_day,
+                one_week,
+                one_month,
+                three_month,
+                six_month,
+                one_year,
+                lifetime,
+                earliest_date,
+                latest_date,
+                high,
+                low,
+                standard_deviation,
+                value
+            )
+            VALUES (
+                NEW.fund_id,
+                one_day_change(NEW.fund_id),  
+                one_week_change(NEW.fund_id),  
+                one_month_change(NEW.fund_id),  
+                three_month_change(NEW.fund_id),  
+                six_month_change(NEW.fund_id),  
+                one_year_change(NEW.fund_id),  
+                lifetime_change(NEW.fund_id), 
+                earliest_dt,
+                latest_dt,
+                max_value,
+                min_value,
+                fund_std_dev(NEW.fund_id), 
+                NEW.price
+            );
+
+        ELSE
+            UPDATE fund
+            SET 
+                one_day = one_day_change(NEW.fund_id),
+                one_week = one_week_change(NEW.fund_id),
+                one_month = one_month_change(NEW.fund_id),
+                three_month = three_month_change(NEW.fund_id),
+                six_month = six_month_change(NEW.fund_id),
+                one_year = one_year_change(NEW.fund_id),
+                lifetime = lifetime_change(NEW.fund_id),
+                earliest_date = earliest_dt,
+                latest_date = latest_dt,
+                high = max_value,
+                low = min_value,
+                standard_deviation = fund_std_dev(NEW.fund_id),
+                value = NEW.price
+            WHERE fund_id = NEW.fund_id;
+        END IF;
+    END IF;
+END //
+
+DROP PROCEDURE IF EXISTS refresh_fund_metrics //
+
+CREATE PROCEDURE refresh_fund_metrics()
+BEGIN
+    INSERT INTO fund (
+        fund_id,
+        one_day,
+        one_week,
+        one_month,
+        three_month,
+        six_month,
+        one_year,
+        lifetime,
+        earliest_date,
+        latest_date,
+        high,
+        low,
+        standard_deviation,
+        value
+    )
+    WITH history AS (
+        -- Archived years included (see partitions.py)
+        SELECT v.fund_id, v.date, v.price
+        FROM fund_value AS v
+        JOIN fund_refresh AS r ON r.fund_id = v.fund_id
+        UNION ALL
+        SELECT a.fund_id, a.date, a.price
+        FROM fund_value_archive AS a
+        JOIN fund_refresh AS r ON r.fund_id = a.fund_id
+    ),
+    stats AS (
+        SELECT v.fund_id, MIN(v.date) AS earliest_dt, MAX(v.date) AS latest_dt,
+               MAX(v.price) AS high, MIN(v.price) AS low, IFNULL(STDDEV(v.price), 0) AS std_dev
+        FROM history AS v
+        GROUP BY v.fund_id
+    ),
+    prices AS (
+        SELECT v.fund_id, v.date, MIN(v.price) AS price
+        FROM history AS v
+        GROUP BY v.fund_id, v.date
+    ),
+    lookback AS (
+        SELECT p.fund_id,
+               MAX(p.date) AS day_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 7 DAY), p.date, NULL)) AS week_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 1 MONTH), p.date, NULL)) AS month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 3 MONTH), p.date, NULL)) AS three_month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 6 MONTH), p.date, NULL)) AS six_month_dt,
+               MIN(IF(p.date >= DATE_SUB(s.latest_dt, INTERVAL 1 YEAR), p.date, NULL)) AS year_dt
+        FROM prices AS p
+        JOIN stats AS s ON s.fund_id = p.fund_id AND p.date < s.latest_dt
+        GROUP BY p.fund_id
+    )
+    SELECT s.fund_id,
+           (l.price - d.price) / NULLIF(d.price, 0) * 100,
+           (l.price - w.price) / NULLIF(w.price, 0) * 100,
+           (l.price - m1.price) / NULLIF(m1.price, 0) * 100,
+           (l.price - m3.price) / NULLIF(m3.price, 0) * 100,
+           (l.price - m6.price) / NULLIF(m6.price, 0) * 100,
+           (l.price - y.price) / NULLIF(y.price, 0) * 100,
+           (l.price - e.price) / NULLIF(e.price, 0) * 100,
+           s.earliest_dt,
+           s.latest_dt,
+           s.high,
+           s.low,
+           s.std_dev,
+           l.price
+    FROM stats AS s
+    JOIN prices AS l ON l.fund_id = s.fund_id AND l.date = s.latest_dt
+    JOIN prices AS e ON e.fund_id = s.fund_id AND e.date = s.earliest_dt
+    LEFT JOIN lookback AS b ON b.fund_id = s.fund_id
+    LEFT JOIN prices AS d ON d.fund_id = s.fund_id AND d.date = b.day_dt
+    LEFT JOIN prices AS w ON w.fund_id = s.fund_id AND w.date = b.week_dt
+    LEFT JOIN prices AS m1 ON m1.fund_id = s.fund_id AND m1.date = b.month_dt
+    LEFT JOIN prices AS m3 ON m3.fund_id = s.fund_id AND m3.date = b.three_month_dt
+    LEFT JOIN prices AS m6 ON m6.fund_id = s.fund_id AND m6.date = b.six_month_dt
+    LEFT JOIN prices AS y ON y.fund_id = s.fund_id AND y.date = b.year_dt
+    ON DUPLICATE KEY UPDATE
+        one_day = VALUES(one_day),
+        one_week = VALUES(one_week),
+        one_month = VALUES(one_month),
+        three_month = VALUES(three_month),
+        six_month = VALUES(six_month),
+        one_year = VALUES(one_year),
+        lifetime = VALUES(lifetime),
+        earliest_date = VALUES(earliest_date),
+        latest_date = VALUES(latest_date),
+        high = VALUES(high),
+        low = VALUES(low),
+        standard_deviation = VALUES(standard_deviation),
+        value = VALUES(value);
+
+    DELETE FROM fund_refresh;
+END //
+
+DELIMITER ;
@@ -0,0 +1,5 @@
+-- The ingesters now stamp data_version.updated_on with UTC_TIMESTAMP() instead of
+-- NOW(), as app.py sends it as the Last-Modified date in UTC. Restamp the current
+-- row the same way and bump the version, so no client keeps a validator based on
+-- the old local time stamp.
+UPDATE data_version SET version = version + 1, updated_on = UTC_TIMESTAMP() WHERE id = 1;
@@ -0,0 +1,296 @@
+-- Read archived years in the period return functions too (see partitions.py).
+-- Their windows end at each fund's latest NAV, so for a fund whose recent NAVs
+-- are archived they disagreed with metrics.py and fund_state, which already
+-- read fund_value_archive.
+
+DELIMITER //
+
+DROP FUNCTION IF EXISTS one_day_change //
+
+CREATE FUNCTION one_day_change(f_id INT) RETURNS DOUBLE
+BEGIN
+    DECLARE change_val DOUBLE;
+    DECLARE latest_date DATE;
+    DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
+
+    -- Archived years included (see partitions.py)
+    SELECT MAX(date) INTO latest_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
+
+    SELECT MAX(date) INTO previous_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date
+    ) AS h;
+
+    IF previous_date IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
+
+    RETURN change_val;
+END //
+
+DROP FUNCTION IF EXISTS one_week_change //
+
+CREATE FUNCTION one_week_change(f_id INT) RETURNS DOUBLE
+BEGIN
+    DECLARE change_val DOUBLE;
+    DECLARE latest_date DATE;
+    DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
+
+    -- Archived years included (see partitions.py)
+    SELECT MAX(date) INTO latest_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
+
+    SELECT MIN(date) INTO previous_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 7 DAY)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 7 DAY)
+    ) AS h;
+
+    IF previous_date IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
+
+    RETURN change_val;
+END //
+
+DROP FUNCTION IF EXISTS one_month_change //
+
+CREATE FUNCTION one_month_change(f_id INT) RETURNS DOUBLE
+BEGIN
+    DECLARE change_val DOUBLE;
+    DECLARE latest_date DATE;
+    DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
+
+    -- Archived years included (see partitions.py)
+    SELECT MAX(date) INTO latest_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
+
+    SELECT MIN(date) INTO previous_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 MONTH)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 MONTH)
+    ) AS h;
+
+    IF previous_date IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
+
+    RETURN change_val;
+END //
+
+DROP FUNCTION IF EXISTS three_month_change //
+
+CREATE FUNCTION three_month_change(f_id INT) RETURNS DOUBLE
+BEGIN
+    DECLARE change_val DOUBLE;
+    DECLARE latest_date DATE;
+    DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
+
+    -- Archived years included (see partitions.py)
+    SELECT MAX(date) INTO latest_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
+
+    SELECT MIN(date) INTO previous_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 3 MONTH)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 3 MONTH)
+    ) AS h;
+
+    IF previous_date IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
+
+    RETURN change_val;
+END //
+
+DROP FUNCTION IF EXISTS six_month_change //
+
+CREATE FUNCTION six_month_change(f_id INT) RETURNS DOUBLE
+BEGIN
+    DECLARE change_val DOUBLE;
+    DECLARE latest_date DATE;
+    DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
+
+    -- Archived years included (see partitions.py)
+    SELECT MAX(date) INTO latest_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
+
+    SELECT MIN(date) INTO previous_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 6 MONTH)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 6 MONTH)
+    ) AS h;
+
+    IF previous_date IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
+
+    RETURN change_val;
+END //
+
+DROP FUNCTION IF EXISTS one_year_change //
+
+CREATE FUNCTION one_year_change(f_id INT) RETURNS DOUBLE
+BEGIN
+    DECLARE change_val DOUBLE;
+    DECLARE latest_date DATE;
+    DECLARE previous_date DATE;
+    DECLARE latest_price DOUBLE;
+    DECLARE previous_price DOUBLE;
+
+    -- Archived years included (see partitions.py)
+    SELECT MAX(date) INTO latest_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id
+    ) AS h;
+
+    SELECT MIN(date) INTO previous_date
+    FROM (
+        SELECT date FROM fund_value WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 YEAR)
+        UNION ALL
+        SELECT date FROM fund_value_archive WHERE fund_id = f_id AND date < latest_date AND date >= DATE_SUB(latest_date, INTERVAL 1 YEAR)
+    ) AS h;
+
+    IF previous_date IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT MIN(price) INTO latest_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = latest_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = latest_date
+    ) AS h;
+
+    SELECT MIN(price) INTO previous_price
+    FROM (
+        SELECT price FROM fund_value WHERE fund_id = f_id AND date = previous_date
+        UNION ALL
+        SELECT price FROM fund_value_archive WHERE fund_id = f_id AND date = previous_date
+    ) AS h;
+
+    SET change_val = IFNULL((latest_price - previous_price) / IF(previous_price = 0, NULL, previous_price) * 100, NULL);
+
+    RETURN change_val;
+END //
+
+DELIMITER ;
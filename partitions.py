@@ -0,0 +1,118 @@
+"""fund_value partition maintenance
+
+    * `list` shows the yearly partitions and their approximate row counts.
+    * `add-next` splits partitions for the coming years off the `pmax`
+      catch-all ahead of time, while it is still empty and cheap to split.
+    * `archive` copies every yearly partition older than the horizon
+      into `fund_value_archive` and drops it from `fund_value`. The
+      metrics, `fund_state`, /fund/graph_data and /fund/date read both
+      tables. At least the past year is kept, so the period windows of
+      live funds stay in `fund_value`.
+    * Archived years are frozen. Their dates would fall into the first
+      partition left, next to the archived copy, so the loaders drop
+      NAVs dated before `archive_cutoff` and backfill_plan.py skips them.
+
+    e.g. python partitions.py add-next --years 1
+         python partitions.py archive --horizon-years 10
+"""
+
+import argparse
+from datetime import date
+
+from db import connect
+
+
+def partitions(cursor):
+    cursor.execute(
+        "SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'fund_value' "
+        "ORDER BY PARTITION_ORDINAL_POSITION;"
+    )
+    return [(name, rows) for name, rows in cursor.fetchall() if name is not None]
+
+
+def partition_year(name):
+    return int(name[1:]) if name[1:].isdigit() else None
+
+
+def archive_cutoff(cursor):
+    """Return the first date not archived, None if nothing was archived.
+
+    Years are archived from the front of `fund_value`, so the first yearly
+    partition left starts where the archive ends.
+    """
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM fund_value_archive);")
+    (archived,) = cursor.fetchone()
+    if not archived:
+        return None
+    years = [partition_year(name) for name, _ in partitions(cursor)]
+    years = [year for year in years if year is not None]
+    return date(min(years), 1, 1) if years else None
+
+
+def add_next(connection, years=1):
+    cursor = connection.cursor()
+    try:
+        existing = {partition_year(name) for name, _ in partitions(cursor)}
+        for year in range(date.today().year, date.today().year + years + 1):
+            if year in existing:
+                continue
+            cursor.execute(
+                "ALTER TABLE fund_value REORGANIZE PARTITION pmax INTO ("
+                f"PARTITION p{year} VALUES LESS THAN ('{year + 1}-01-01'), "
+                "PARTITION pmax VALUES LESS THAN (MAXVALUE));"
+            )
+            print(f"Added partition p{year}.")
+    finally:
+        cursor.close()
+
+
+def archive(connection, horizon_years):
+    if horizon_years < 1:
+        raise ValueError("horizon_years must be at least 1")
+    cutoff = date.today().year - horizon_years
+    cursor = connection.cursor()
+    try:
+        for name, _ in partitions(cursor):
+            year = partition_year(name)
+            if year is None or year >= cutoff:
+                continue
+            cursor.execute(
+                "INSERT IGNORE INTO fund_value_archive (fund_id, date, price) "
+                f"SELECT fund_id, date, price FROM fund_value PARTITION ({name});"
+            )
+            moved = cursor.rowcount
+            connection.commit()
+            cursor.execute(f"ALTER TABLE fund_value DROP PARTITION {name};")
+            print(f"Archived partition {name} ({moved} rows).")
+    finally:
+        cursor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain fund_value partitions")
+    parser.add_argument("command", choices=["list", "add-next", "archive"])
+    parser.add_argument(
+        "--years", type=int, default=1, help="add-next: years ahead to prepare"
+    )
+    parser.add_argument(
+        "--horizon-years",
+        type=int,
+        default=10,
+        help="archive: keep this many years before the current one",
+    )
+    args = parser.parse_args()
+
+    connection = connect()
+    try:
+        if args.command == "list":
+            cursor = connection.cursor()
+            for name, rows in partitions(cursor):
+                print(f"{name}\t{rows}")
+            cursor.close()
+        elif args.command == "add-next":
+            add_next(connection, args.years)
+        else:
+            archive(connection, args.horizon_years)
+    finally:
+        connection.close()
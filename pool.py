@@ -0,0 +1,137 @@
+"""Connection pool for app.py
+
+    * Holds up to `size` connections per worker process, opened on
+      demand and reused, with the credentials read once at startup.
+    * `acquire` waits up to `timeout` seconds for a free connection.
+      A connection that sat idle for more than `ping_after` seconds is
+      pinged on checkout and reconnected if the server dropped it.
+    * `release` rolls back whatever the request left open, so the next
+      request starts a fresh transaction and sees current data.
+    * Use `with pool.connection() as conn:`, or call `close()` on the
+      acquired connection, which returns it to the pool. Closing twice
+      is harmless.
+    * `stats` reports the pool size, open/idle/in-use connections and
+      checkout, wait, reconnect and timeout counters.
+"""
+
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+import mysql.connector
+
+PING_AFTER = 30
+TIMEOUT = 10
+
+
+class PoolTimeout(mysql.connector.Error):
+    pass
+
+
+class PooledConnection:
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+
+    def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            self.pool.release(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        if self.connection is None:
+            raise mysql.connector.errors.OperationalError("Connection returned to pool")
+        return getattr(self.connection, name)
+
+
+class ConnectionPool:
+    def __init__(self, size, timeout=TIMEOUT, ping_after=PING_AFTER, **options):
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.options = options
+        self.idle = []  # (connection, released at)
+        self.opened = 0
+        self.condition = threading.Condition()
+        self.counters = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "reconnects": 0,
+            "timeouts": 0,
+        }
+
+    def acquire(self):
+        start = monotonic()
+        with self.condition:
+            if not self.idle and self.opened >= self.size:
+                self.counters["waits"] += 1
+                if not self.condition.wait_for(
+                    lambda: self.idle or self.opened < self.size, self.timeout
+                ):
+                    self.counters["timeouts"] += 1
+                    raise PoolTimeout("No database connection available")
+            self.counters["wait_seconds"] += monotonic() - start
+            self.counters["checkouts"] += 1
+            if self.idle:
+                connection, released = self.idle.pop()
+            else:
+                connection, released = None, None
+                self.opened += 1
+
+        try:
+            if connection is None:
+                connection = mysql.connector.connect(**self.options)
+            elif monotonic() - released > self.ping_after:
+                self.check(connection)
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+        return PooledConnection(self, connection)
+
+    def check(self, connection):
+        try:
+            connection.ping(reconnect=False)
+        except mysql.connector.Error:
+            with self.condition:
+                self.counters["reconnects"] += 1
+            connection.reconnect(attempts=2, delay=0)
+
+    def release(self, connection):
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            # Broken, drop it and let the next checkout open a new one
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            return
+        with self.condition:
+            self.idle.append((connection, monotonic()))
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "size": self.size,
+                "open": self.opened,
+                "idle": len(self.idle),
+                "in_use": self.opened - len(self.idle),
+                **self.counters,
+            }
@@ -0,0 +1,153 @@
+"""Local cache of raw AMFI reports
+
+    * Report bodies are stored gzip'd under `objects/<sha256>.gz`, named
+      by the hash of their content, and `index.json` maps each
+      (frmdt, todt) range to the hash of its latest download. The hash
+      is taken over the body exactly as received, before it is split
+      into lines (see `spool`).
+    * Ranges that end before today are served from the cache, ranges
+      that reach today are downloaded again unless `offline` is set, as
+      AMFI is still adding NAVs to them.
+    * The cache is kept under `max_bytes` by evicting the least recently
+      used ranges, objects are removed once no range refers to them.
+    * The index also remembers which content hash was last ingested for
+      a range, so an unchanged range can be skipped entirely.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from time import time
+
+from amfi import fetch_chunks, split_lines
+from instrument import report
+
+CACHE_DIR = os.environ.get("AMFI_CACHE_DIR", ".amfi_cache")
+MAX_BYTES = 1 << 30
+READ_SIZE = 1 << 16
+
+
+def spool(url, file):
+    """Write the body of `url` gzip'd to the binary `file`, return its SHA-256.
+
+    The body is hashed as it streams in, exactly as received.
+    """
+    sha = hashlib.sha256()
+    with gzip.GzipFile(fileobj=file, mode="wb") as compressed:
+        for chunk in fetch_chunks(url):
+            sha.update(chunk)
+            compressed.write(chunk)
+    return sha.hexdigest()
+
+
+def read_lines(file):
+    """Yield the lines of a body written by `spool`, `file` is a path or file."""
+    with gzip.open(file, "rb") as file:
+        yield from split_lines(iter(lambda: file.read(READ_SIZE), b""))
+
+
+class ReportCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        try:
+            with open(self.index_path, "r") as file:
+                self.index = json.load(file)
+        except FileNotFoundError:
+            self.index = {}
+
+    @staticmethod
+    def key(frmdt, todt):
+        return f"{frmdt}|{todt}"
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest + ".gz")
+
+    def save_index(self):
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w") as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(path, self.index_path)
+
+    def fetch(self, url, frmdt, todt, refresh=False, offline=False):
+        """Make sure the report for the range is cached, return its hash."""
+        key = self.key(frmdt, todt)
+        with self.lock:
+            entry = self.index.get(key)
+        complete = datetime.strptime(todt, "%d-%b-%Y").date() < datetime.today().date()
+
+        if entry is not None and os.path.exists(self.object_path(entry["hash"])):
+            if offline or (complete and not refresh):
+                with self.lock:
+                    entry["last_used"] = time()
+                    self.save_index()
+                report.count("reports_cached")
+                return entry["hash"]
+        if offline:
+            raise LookupError(f"Report {frmdt} - {todt} is not cached")
+
+        with report.span("download"):
+            digest = self.download(url)
+        report.count("reports_downloaded")
+        with self.lock:
+            entry = self.index.setdefault(key, {})
+            entry.update(
+                hash=digest,
+                size=os.path.getsize(self.object_path(digest)),
+                last_used=time(),
+            )
+            self.evict(keep=key)
+            self.save_index()
+        return digest
+
+    def download(self, url):
+        # Hash and compress the body as it streams in, then move it into place
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix=".gz")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                digest = spool(url, file)
+            os.replace(path, self.object_path(digest))
+        except BaseException:
+            os.remove(path)
+            raise
+        return digest
+
+    def lines(self, digest):
+        return read_lines(self.object_path(digest))
+
+    def is_ingested(self, frmdt, todt, digest):
+        with self.lock:
+            entry = self.index.get(self.key(frmdt, todt), {})
+            return entry.get("ingested") == digest
+
+    def mark_ingested(self, frmdt, todt, digest):
+        with self.lock:
+            entry = self.index.get(self.key(frmdt, todt))
+            if entry is not None:
+                entry["ingested"] = digest
+                self.save_index()
+
+    def evict(self, keep=None):
+        # Called with the lock held
+        sizes = {entry["hash"]: entry["size"] for entry in self.index.values()}
+        total = sum(sizes.values())
+        for key, entry in sorted(self.index.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            del self.index[key]
+            digest = entry["hash"]
+            if all(other["hash"] != digest for other in self.index.values()):
+                total -= sizes[digest]
+                try:
+                    os.remove(self.object_path(digest))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,186 @@
+"""Scheme code backfill
+
+    * Reads NAV history reports, fetched like get_funds.py (through the
+      report cache) or from saved files with `--dir`, and collects every
+      scheme code with the names it was listed under and its ISINs.
+    * A fund without a code whose name was only ever listed under one
+      code gets that code and its ISINs.
+    * Funds split by a scheme rename, i.e. several funds matching one
+      code, are merged into the fund that already has the code, or else
+      the oldest one. Their `fund_value` rows, archived rows, watchlist
+      and portfolio entries move to it and the others are deleted.
+      `fund_state`, `fund` and the ranks are then recomputed for the
+      merged funds.
+    * `--dry-run` only prints what would change.
+
+    e.g. python scheme_codes.py backfill 01-Apr-2006 01-May-2006 ...
+         python scheme_codes.py backfill --dir archive/ --dry-run
+"""
+
+import argparse
+from collections import defaultdict
+
+import fund_state
+from amfi import parse_batches
+from db import connect
+from ingest import clean_name, publish, rank_funds, refresh_fund_metrics
+from report_cache import CACHE_DIR, ReportCache
+
+
+def collect(batches, schemes):
+    """Add to `{scheme_code: (names, isin_growth, isin_reinvestment)}`."""
+    for batch in batches:
+        for scheme in batch.keys:
+            if scheme.scheme_code is None:
+                continue
+            names, growth, reinvestment = schemes.get(
+                scheme.scheme_code, (set(), None, None)
+            )
+            names.add(clean_name(scheme.name))
+            schemes[scheme.scheme_code] = (
+                names,
+                scheme.isin_growth or growth,
+                scheme.isin_reinvestment or reinvestment,
+            )
+
+
+def plan(cursor, schemes):
+    """Return `(assignments, merges, conflicts)` for the collected schemes.
+
+    `assignments` are `(fund_id, code, isin_growth, isin_reinvestment)`,
+    `merges` map a kept fund_id to the fund_ids merged into it and
+    `conflicts` are names listed under more than one code.
+    """
+    cursor.execute("SELECT fund_id, fund_name, scheme_code FROM fund_name;")
+    coded, uncoded = {}, defaultdict(list)
+    for fund_id, name, code in cursor.fetchall():
+        if code is None:
+            uncoded[name].append(fund_id)
+        else:
+            coded[code] = fund_id
+
+    name_codes = defaultdict(set)
+    for code, (names, _, _) in schemes.items():
+        for name in names:
+            name_codes[name].add(code)
+    conflicts = sorted(name for name, codes in name_codes.items() if len(codes) > 1)
+
+    assignments, merges = [], {}
+    for code, (names, growth, reinvestment) in schemes.items():
+        ids = sorted(
+            {
+                fund_id
+                for name in names
+                if len(name_codes[name]) == 1
+                for fund_id in uncoded.get(name, [])
+            }
+        )
+        keep = coded.get(code)
+        if keep is None:
+            if not ids:
+                continue
+            keep = ids[0]
+            assignments.append((keep, code, growth, reinvestment))
+        others = [fund_id for fund_id in ids if fund_id != keep]
+        if others:
+            merges[keep] = others
+    return assignments, merges, conflicts
+
+
+def merge(cursor, keep, other):
+    for table in ("fund_value", "fund_value_archive", "watchlist"):
+        cursor.execute(
+            f"UPDATE IGNORE {table} SET fund_id = %s WHERE fund_id = %s;", (keep, other)
+        )
+        # Rows left behind duplicate a (fund_id, date) or watchlist entry of `keep`
+        cursor.execute(f"DELETE FROM {table} WHERE fund_id = %s;", (other,))
+    # Never drop portfolio entries, a clash aborts the merge
+    cursor.execute(
+        "UPDATE portfolio SET fund_id = %s WHERE fund_id = %s;", (keep, other)
+    )
+    for table in ("fund_state", "fund_refresh", "fund", "fund_name"):
+        cursor.execute(f"DELETE FROM {table} WHERE fund_id = %s;", (other,))
+
+
+def backfill(connection, schemes, dry_run=False):
+    cursor = connection.cursor()
+    try:
+        assignments, merges, conflicts = plan(cursor, schemes)
+        for name in conflicts:
+            print(f"Skipped '{name}', listed under several scheme codes.")
+        print(f"{len(assignments)} funds get a scheme code, {len(merges)} merges.")
+        if dry_run:
+            for keep, others in merges.items():
+                print(f"Would merge {others} into {keep}.")
+            return
+
+        # Merge first, the merged rows must be gone before `keep` takes the code
+        for keep, others in merges.items():
+            try:
+                for other in others:
+                    merge(cursor, keep, other)
+                connection.commit()
+                print(f"Merged {others} into {keep}.")
+            except Exception as e:
+                connection.rollback()
+                print(f"Could not merge {others} into {keep}: {e}")
+        cursor.executemany(
+            "UPDATE fund_name SET scheme_code = %s, isin_growth = %s, "
+            "isin_reinvestment = %s WHERE fund_id = %s AND scheme_code IS NULL",
+            [
+                (code, growth, reinvestment, fund_id)
+                for fund_id, code, growth, reinvestment in assignments
+            ],
+        )
+        connection.commit()
+    finally:
+        cursor.close()
+
+    if merges:
+        fund_state.rebuild(connection, list(merges))
+        cursor = connection.cursor()
+        try:
+            cursor.executemany(
+                "INSERT IGNORE INTO fund_refresh (fund_id) VALUES (%s)",
+                [(fund_id,) for fund_id in merges],
+            )
+            connection.commit()
+        finally:
+            cursor.close()
+        refresh_fund_metrics(connection)
+        rank_funds(connection)
+        publish(connection)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill AMFI scheme codes")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument(
+        "months", nargs="*", help="start dates or frmdt:todt ranges, like get_funds.py"
+    )
+    parser.add_argument("--dir", help="read saved reports from this directory instead")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.dir:
+        from import_reports import read_lines, report_files
+
+        sources = [read_lines(path) for path in report_files(args.dir)]
+    else:
+        from get_funds import month_range, request_url, url
+
+        cache = ReportCache(args.cache_dir)
+        sources = []
+        for frmdt, todt in map(month_range, args.months):
+            sources.append(request_url(url, frmdt, cache, todt=todt)[2])
+
+    schemes = {}
+    for lines in sources:
+        collect(parse_batches(lines), schemes)
+
+    connection = connect()
+    try:
+        backfill(connection, schemes, args.dry_run)
+    finally:
+        connection.close()
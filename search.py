@@ -0,0 +1,204 @@
+"""Fund search index for /search/fund
+
+    * Fund, company and category names are split into lower case words.
+      Each word maps to the funds it occurs in, weighted by the field it
+      came from, so a fund name match outranks a company or category
+      match.
+    * Every query word must match, in any order, either a whole word,
+      the start of a word (autocomplete) or, when neither does, a word
+      sharing enough trigrams with it (typos).
+    * Results are ordered by match quality blended with `fund_rank`.
+      Scores are summed in arrays indexed by fund_id, so a query costs a
+      few vector operations however many funds a word matches.
+    * Only funds with a `fund` row are indexed, like the query it
+      replaces. A new index is built from the previous one, only the
+      funds that were added, removed or renamed are reindexed and the
+      previous index is left untouched for requests still using it.
+"""
+
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+RESULTS = 15
+FIELD_WEIGHTS = {"name": 1.0, "company": 0.7, "category": 0.5}
+EXACT = 1.0
+PREFIX = 0.8
+FUZZY = 0.6
+# Minimum Dice coefficient of the trigrams of a misspelt word
+MIN_SIMILARITY = 0.5
+# Share of the score that comes from fund_rank
+RANK_WEIGHT = 0.25
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def words(text):
+    return WORD.findall(text.lower()) if text else []
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def patched(index, removed, added):
+    """Return a copy of `index` ({key: {item: value}}) with items removed and added.
+
+    Only the entries of changed keys are copied, `index` is not modified.
+    """
+    new = dict(index)
+    for key in removed.keys() | added.keys():
+        gone = removed.get(key, ())
+        entry = {
+            item: value
+            for item, value in index.get(key, {}).items()
+            if item not in gone
+        }
+        entry.update(added.get(key, {}))
+        if entry:
+            new[key] = entry
+        else:
+            new.pop(key, None)
+    return new
+
+
+class SearchIndex:
+    def __init__(self, funds, companies, categories, previous=None):
+        """Index `funds`, a sequence of `catalog.Fund` in `fund_rank` order."""
+        old_fields, old_docs, postings, grams, old_words = {}, {}, {}, {}, []
+        if previous is not None:
+            old_fields, old_docs = previous.fields, previous.docs
+            postings, grams = previous.postings, previous.grams
+            old_words = previous.words
+
+        self.funds = {fund.fund_id: fund for fund in funds}
+        self.fields = {}  # fund_id -> (name, company, category)
+        self.docs = {}  # fund_id -> ((word, weight), ...)
+        for fund in funds:
+            fields = (
+                fund.name,
+                companies.get(fund.company_id),
+                categories.get(fund.category_id),
+            )
+            self.fields[fund.fund_id] = fields
+            if old_fields.get(fund.fund_id) == fields:
+                self.docs[fund.fund_id] = old_docs[fund.fund_id]
+                continue
+            doc = {}
+            for field, text in zip(FIELD_WEIGHTS, fields):
+                for word in words(text):
+                    doc[word] = max(doc.get(word, 0.0), FIELD_WEIGHTS[field])
+            self.docs[fund.fund_id] = tuple(doc.items())
+
+        changed = [
+            fund_id
+            for fund_id in old_docs.keys() | self.docs.keys()
+            if old_docs.get(fund_id) is not self.docs.get(fund_id)
+        ]
+        self.reindexed = len(changed)
+        removed, added = {}, {}
+        for fund_id in changed:
+            for word, _ in old_docs.get(fund_id, ()):
+                removed.setdefault(word, set()).add(fund_id)
+            for word, weight in self.docs.get(fund_id, ()):
+                added.setdefault(word, {})[fund_id] = weight
+        self.postings = patched(postings, removed, added)  # word -> {fund_id: weight}
+
+        # Arrays of the postings, made on first use and kept while unchanged.
+        # Requests may still be adding to the previous index's, dict.copy()
+        # takes a snapshot atomically where iterating it could fail.
+        self.arrays = {}
+        if previous is not None:
+            self.arrays = {
+                word: arrays
+                for word, arrays in previous.arrays.copy().items()
+                if word not in removed and word not in added
+            }
+
+        if self.postings.keys() == postings.keys():
+            self.words = old_words
+            self.grams = grams
+        else:
+            self.words = sorted(self.postings)
+            removed, added = {}, {}
+            for word in postings.keys() - self.postings.keys():
+                for gram in trigrams(word):
+                    removed.setdefault(gram, set()).add(word)
+            for word in self.postings.keys() - postings.keys():
+                word_grams = trigrams(word)
+                for gram in word_grams:
+                    added.setdefault(gram, {})[word] = len(word_grams)
+            self.grams = patched(grams, removed, added)  # trigram -> {word: trigrams}
+
+        self.size = max(self.funds, default=0) + 1
+        self.rank_score = np.zeros(self.size, dtype=np.float32)
+        ranked = np.fromiter(self.funds, dtype=np.int64, count=len(self.funds))
+        self.rank_score[ranked] = 1 - np.arange(len(ranked)) / max(len(ranked), 1)
+
+    def array(self, word):
+        """Return `(fund_ids, weights)` of the funds `word` occurs in."""
+        arrays = self.arrays.get(word)
+        if arrays is None:
+            entry = self.postings[word]
+            arrays = (
+                np.fromiter(entry.keys(), dtype=np.int64, count=len(entry)),
+                np.fromiter(entry.values(), dtype=np.float32, count=len(entry)),
+            )
+            self.arrays[word] = arrays
+        return arrays
+
+    def matches(self, query_word):
+        """Return `{word: quality}` for the indexed words `query_word` matches."""
+        found = {}
+        if query_word in self.postings:
+            found[query_word] = EXACT
+        i = bisect_left(self.words, query_word)
+        while i < len(self.words) and self.words[i].startswith(query_word):
+            found.setdefault(self.words[i], PREFIX)
+            i += 1
+        if found or len(query_word) < 3:
+            return found
+
+        query_grams = trigrams(query_word)
+        shared, sizes = {}, {}
+        for gram in query_grams:
+            for word, size in self.grams.get(gram, {}).items():
+                shared[word] = shared.get(word, 0) + 1
+                sizes[word] = size
+        for word, n in shared.items():
+            similarity = 2 * n / (len(query_grams) + sizes[word])
+            if similarity >= MIN_SIMILARITY:
+                found[word] = FUZZY * similarity
+        return found
+
+    def search(self, query, limit=RESULTS):
+        """Return up to `limit` `catalog.Fund`s matching every word of `query`."""
+        per_word = [self.matches(word) for word in dict.fromkeys(words(query))]
+        if not per_word or not all(per_word):
+            return []
+
+        total = np.zeros(self.size, dtype=np.float32)
+        matched = np.ones(self.size, dtype=bool)
+        for found in per_word:
+            # A fund's score for a word is its best matching word's
+            score = np.zeros(self.size, dtype=np.float32)
+            for word, quality in found.items():
+                fund_ids, weights = self.array(word)
+                score[fund_ids] = np.maximum(score[fund_ids], quality * weights)
+            total += score
+            matched &= score > 0
+
+        candidates = np.flatnonzero(matched)
+        if len(candidates) == 0:
+            return []
+        quality = total[candidates] / len(per_word)
+        rank = self.rank_score[candidates]
+        blended = (1 - RANK_WEIGHT) * quality + RANK_WEIGHT * rank
+        if len(candidates) > limit:
+            top = np.argpartition(-blended, limit - 1)[:limit]
+            candidates, blended = candidates[top], blended[top]
+        # Best first, lower fund_id first among equal scores
+        order = np.lexsort((candidates, -blended))
+        return [self.funds[int(fund_id)] for fund_id in candidates[order]]